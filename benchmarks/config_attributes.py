@@ -0,0 +1,88 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+"""
+Benchmark attribute reads on ready (frozen) configuration objects.
+
+Loads and readies the configuration identified by $DATACUBE_OWS_CFG, then times reads of commonly used
+attributes of every layer, band index, style and resource limit object - first with the objects frozen
+(as they are after make_ready), then with them thawed back to the checked attribute access used before
+they are ready.
+
+Requires an ODC database with the OWS schema (datacube-ows-update --schema) and populated range tables.
+
+Usage: python benchmarks/config_attributes.py [--repeat 20]
+"""
+import argparse
+import timeit
+
+from datacube_ows.config_utils import OWSConfigEntry
+from datacube_ows.ows_configuration import get_config
+
+LAYER_ATTRS = ["name", "title", "abstract", "band_idx", "hide", "ready", "resource_limits",
+               "native_CRS", "product_names", "time_resolution", "style_index", "default_time"]
+STYLE_ATTRS = ["name", "title", "abstract", "product", "needed_bands", "include_in_feature_info"]
+BAND_IDX_ATTRS = ["native_bands", "_idx", "product_name"]
+
+
+def config_entries(root):
+    """All config entries reachable from root."""
+    seen = {}
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if isinstance(obj, OWSConfigEntry):
+            if id(obj) in seen:
+                continue
+            seen[id(obj)] = obj
+            pending.extend(obj.__dict__.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        elif isinstance(obj, dict):
+            pending.extend(obj.values())
+    return list(seen.values())
+
+
+def read_attributes(cfg):
+    for lyr in cfg.product_index.values():
+        for attr in LAYER_ATTRS:
+            getattr(lyr, attr, None)
+        for attr in BAND_IDX_ATTRS:
+            getattr(lyr.band_idx, attr, None)
+        for style in lyr.styles:
+            for attr in STYLE_ATTRS:
+                getattr(style, attr, None)
+
+
+def count_reads(cfg):
+    reads = 0
+    for lyr in cfg.product_index.values():
+        reads += len(LAYER_ATTRS) + len(BAND_IDX_ATTRS) + len(lyr.styles) * len(STYLE_ATTRS)
+    return reads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="iterations per measurement")
+    args = parser.parse_args()
+    cfg = get_config()
+    entries = config_entries(cfg)
+    frozen = [e for e in entries if e.frozen]
+    reads = count_reads(cfg) * args.repeat
+    print(f"{len(cfg.product_index)} layers, {len(entries)} config entries ({len(frozen)} frozen)")
+    after = timeit.timeit(lambda: read_attributes(cfg), number=args.repeat)
+    for e in frozen:
+        e.thaw()
+    before = timeit.timeit(lambda: read_attributes(cfg), number=args.repeat)
+    for e in frozen:
+        e.freeze()
+    print(f"{'':>8} {'ns/read':>8}")
+    print(f"{'checked':>8} {before / reads * 1e9:>8.0f}")
+    print(f"{'frozen':>8} {after / reads * 1e9:>8.0f}")
+    print(f"speedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+"""
+Benchmark GetMap extent mask construction.
+
+Compares the vectorised datacube_ows.data.build_extent_mask against the previous
+implementation (one mask per time slice, then concatenated) for 1, 5 and 20 dates.
+
+Usage: python benchmarks/extent_masks.py [--size 256] [--repeat 50]
+"""
+import argparse
+import timeit
+from types import SimpleNamespace
+
+import numpy
+import xarray
+
+from datacube_ows.data import build_extent_mask
+from datacube_ows.ogc_utils import mask_by_val
+
+
+def per_slice_extent_mask(data, style, layer):
+    # The pre-vectorisation implementation, for comparison.
+    td_masks = []
+    for npdt in data.time.values:
+        td = data.sel(time=npdt)
+        td_ext_mask = None
+        band = ""
+        for band in style.needed_bands:
+            if band not in style.flag_bands:
+                if layer.data_manual_merge:
+                    if td_ext_mask is None:
+                        td_ext_mask = ~numpy.isnan(td[band])
+                    else:
+                        td_ext_mask &= ~numpy.isnan(td[band])
+                else:
+                    for f in layer.extent_mask_func:
+                        if td_ext_mask is None:
+                            td_ext_mask = f(td, band)
+                        else:
+                            td_ext_mask &= f(td, band)
+        if layer.data_manual_merge:
+            td_ext_mask = xarray.DataArray(td_ext_mask)
+        if td_ext_mask is None:
+            td_ext_mask = xarray.DataArray(
+                ~numpy.zeros(td[band].values.shape, dtype=numpy.bool_),
+                td[band].coords
+            )
+        td_masks.append(td_ext_mask)
+    return xarray.concat(td_masks, dim=data.time)
+
+
+def sample_data(n_dates, size, bands):
+    rng = numpy.random.default_rng(42)
+    coords = {
+        "time": numpy.arange(n_dates).astype("datetime64[D]"),
+        "y": numpy.arange(size, dtype="float64"),
+        "x": numpy.arange(size, dtype="float64"),
+    }
+    data_vars = {}
+    for band in bands:
+        vals = rng.integers(-999, 10000, size=(n_dates, size, size), dtype="int16")
+        data_vars[band] = xarray.DataArray(vals, coords=coords, dims=["time", "y", "x"], attrs={"nodata": -999})
+    return xarray.Dataset(data_vars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=int, default=256, help="tile width and height in pixels")
+    parser.add_argument("--repeat", type=int, default=50, help="iterations per measurement")
+    args = parser.parse_args()
+    bands = ["red", "green", "blue"]
+    style = SimpleNamespace(needed_bands=bands, flag_bands=set())
+    layer = SimpleNamespace(data_manual_merge=False, extent_mask_func=[mask_by_val])
+    print(f"{'dates':>5} {'per-slice (ms)':>15} {'vectorised (ms)':>16} {'speedup':>8}")
+    for n_dates in (1, 5, 20):
+        data = sample_data(n_dates, args.size, bands)
+        assert (per_slice_extent_mask(data, style, layer).values == build_extent_mask(data, style, layer).values).all()
+        old = timeit.timeit(lambda: per_slice_extent_mask(data, style, layer), number=args.repeat) / args.repeat
+        new = timeit.timeit(lambda: build_extent_mask(data, style, layer), number=args.repeat) / args.repeat
+        print(f"{n_dates:>5} {old * 1000:>15.2f} {new * 1000:>16.2f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
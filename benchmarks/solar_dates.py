@@ -0,0 +1,56 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+"""
+Benchmark solar date calculation for product range updates.
+
+Compares calculating local solar dates in the database (datacube_ows.product_ranges.solar_dates_sql)
+against the per-dataset timezone lookup loop in Python (solar_dates_python), for the named ODC products.
+Also reports any dates that differ between the two methods.
+
+Requires an ODC database with the OWS schema and space-time views (datacube-ows-update --schema).
+
+Usage: python benchmarks/solar_dates.py [--repeat 3] PRODUCT [PRODUCT ...]
+"""
+import argparse
+import timeit
+
+from datacube import Datacube
+
+from datacube_ows.product_ranges import (solar_dates_python, solar_dates_sql,
+                                         timezone_polygons_loaded)
+from datacube_ows.utils import get_sqlconn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="iterations per measurement")
+    parser.add_argument("products", nargs="+", help="ODC product names")
+    args = parser.parse_args()
+    dc = Datacube(app="ows_benchmark")
+    conn = get_sqlconn(dc)
+    conn.execute("set timezone to 'Etc/UTC'")
+    print("Timezone polygons:", "loaded" if timezone_polygons_loaded(conn) else "not loaded (longitude offsets)")
+    print(f"{'product':>30} {'datasets':>9} {'dates':>6} {'python (s)':>11} {'sql (s)':>8} {'speedup':>8} {'differ':>7}")
+    for name in args.products:
+        product = dc.index.products.get_by_name(name)
+        if product is None:
+            print(f"{name:>30} not found")
+            continue
+        n_datasets = conn.execute(
+            "SELECT count(*) FROM public.space_time_view WHERE dataset_type_ref = %(p_id)s",
+            {"p_id": product.id}
+        ).scalar()
+        py_dates = solar_dates_python(conn, product.id)
+        sql_dates = solar_dates_sql(conn, product.id)
+        differ = len(set(py_dates).symmetric_difference(sql_dates))
+        old = timeit.timeit(lambda: solar_dates_python(conn, product.id), number=args.repeat) / args.repeat
+        new = timeit.timeit(lambda: solar_dates_sql(conn, product.id), number=args.repeat) / args.repeat
+        print(f"{name:>30} {n_datasets:>9} {len(sql_dates):>6} {old:>11.2f} {new:>8.2f} {old / new:>7.1f}x {differ:>7}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
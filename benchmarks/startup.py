@@ -0,0 +1,98 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+"""
+Benchmark OWS worker cold-start time.
+
+Each measurement runs in a fresh Python process, as a newly started worker would.  Reports:
+
+* the modules that take longest to import when importing the Flask app (datacube_ows.ogc),
+  according to python -X importtime, aggregated by top-level package, and
+* the time to import the app (including parsing the configuration and making it ready) and
+  to serve the first request (GetCapabilities by default) with the Flask test client.
+
+Uses the configuration identified by $DATACUBE_OWS_CFG.  Without a database, requests that need
+one fail quickly, so only the import time is meaningful.
+
+Usage: python benchmarks/startup.py [--repeat 5] [--top 20] [--url "/wms?request=GetCapabilities..."]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+FIRST_REQUEST = """
+import json, time
+t0 = time.perf_counter()
+import datacube_ows.ogc
+t1 = time.perf_counter()
+client = datacube_ows.ogc.app.test_client()
+status = client.get({url!r}).status_code
+t2 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "first_request": t2 - t1, "status": status}}))
+"""
+
+
+def run_python(args):
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True)
+
+
+def import_times():
+    """
+    Import times in seconds: the total for each top-level package, and the cumulative time
+    (i.e. including the modules it imports) for each datacube_ows module.
+    """
+    stderr = run_python(["-X", "importtime", "-c", "import datacube_ows.ogc"]).stderr
+    packages = defaultdict(float)
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        name = name.strip()
+        # Each module is only listed when first imported, so summing self times by package does not double count.
+        packages[name.split(".")[0]] += int(self_us) / 1e6
+        if name.startswith("datacube_ows"):
+            modules[name] = int(cumulative_us) / 1e6
+    return packages, modules
+
+
+def first_request_times(url, repeat):
+    return [json.loads(run_python(["-c", FIRST_REQUEST.format(url=url)]).stdout.splitlines()[-1])
+            for i in range(repeat)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--top", type=int, default=20, help="number of packages and modules to list")
+    parser.add_argument("--url", default="/wms?request=GetCapabilities&service=WMS&version=1.3.0",
+                        help="the first request to make")
+    args = parser.parse_args()
+
+    packages, modules = import_times()
+    print(f"{'package':>40} {'import (s)':>11}")
+    for name, secs in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{name:>40} {secs:>11.3f}")
+    print()
+    print(f"{'datacube_ows module':>40} {'cumulative (s)':>15}")
+    for name, secs in sorted(modules.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"{name:>40} {secs:>15.3f}")
+    print()
+
+    results = first_request_times(args.url, args.repeat)
+    imports = [r["import"] for r in results]
+    requests = [r["first_request"] for r in results]
+    totals = [r["import"] + r["first_request"] for r in results]
+    print(f"First request: {args.url} (HTTP {results[-1]['status']})")
+    print(f"{'':>14} {'median (s)':>11} {'min (s)':>8}")
+    for label, values in (("import app", imports), ("first request", requests), ("total", totals)):
+        print(f"{label:>14} {statistics.median(values):>11.3f} {min(values):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import (Any, Callable, Dict, Hashable, NamedTuple, Optional, Tuple,
+                    Type, Union)
+
+from flask_babel import get_locale
+
+from datacube_ows.ogc_exceptions import OGCException
+from datacube_ows.ogc_utils import cache_control_headers
+
+
+def _locale_key() -> Optional[str]:
+    locale = get_locale()
+    return str(locale) if locale else None
+
+
+class CachedDocument(NamedTuple):
+    body: Union[str, bytes]
+    content_type: str
+    etag: str
+    update_sequence: str
+
+
+# Renders a capabilities document, given its updateSequence.  Returns the document and its content type.
+RENDERER = Callable[[str], Tuple[Union[str, bytes], str]]
+
+# Documents are rendered with this in place of the updateSequence, which is filled in after the ETag is
+# computed.  The ETag of a document is therefore the same in all worker processes.
+UPDATE_SEQUENCE_PLACEHOLDER = "ows-update-sequence-placeholder"
+
+
+def _fill_update_sequence(body: Union[str, bytes], sequence: str) -> Union[str, bytes]:
+    if isinstance(body, bytes):
+        return body.replace(UPDATE_SEQUENCE_PLACEHOLDER.encode("utf-8"), sequence.encode("utf-8"))
+    return body.replace(UPDATE_SEQUENCE_PLACEHOLDER, sequence)
+
+
+class CapabilitiesCache:
+    """
+    In-process cache of rendered GetCapabilities documents.
+
+    Documents are cached per (service, version, locale, base URL, sections) and are all discarded
+    whenever the configuration is made ready or the ranges of a layer change.
+
+    Each such change also advances the update sequence.  Update sequences are based on the time of
+    the change, so they keep increasing across server restarts, but they are per worker process.
+    ETags do not depend on the update sequence, so are the same in all worker processes.
+    """
+    def __init__(self, max_entries: int = 256) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, CachedDocument]" = OrderedDict()
+        self._render_locks: Dict[Hashable, threading.Lock] = {}
+        self._sequence = int(time.time())
+
+    @property
+    def update_sequence(self) -> str:
+        return str(self._sequence)
+
+    def invalidate(self) -> None:
+        """
+        Discard all cached documents and advance the update sequence.
+        """
+        with self._lock:
+            self._sequence = max(self._sequence + 1, int(time.time()))
+            self._entries.clear()
+
+    def get(self, key: Hashable, render: RENDERER) -> CachedDocument:
+        """
+        :param key: Identifies the document (service, version, base url, sections) - the locale is added.
+        :param render: Renders the document if it is not already cached.
+        :return: The cached (or newly rendered) document
+        """
+        key = (key, _locale_key())
+        with self._lock:
+            doc = self._entries.get(key)
+            if doc is not None:
+                self._entries.move_to_end(key)
+                return doc
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+        # Only one thread renders each document - others wait for it.
+        with render_lock:
+            with self._lock:
+                doc = self._entries.get(key)
+                sequence = self._sequence
+            if doc is not None:
+                return doc
+            try:
+                body, content_type = render(UPDATE_SEQUENCE_PLACEHOLDER)
+            finally:
+                with self._lock:
+                    self._render_locks.pop(key, None)
+            raw = body.encode("utf-8") if isinstance(body, str) else body
+            etag = '"%s"' % hashlib.sha1(raw).hexdigest()
+            doc = CachedDocument(_fill_update_sequence(body, str(sequence)), content_type, etag, str(sequence))
+            with self._lock:
+                # Not cached if invalidated while rendering.
+                if sequence == self._sequence:
+                    self._entries[key] = doc
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        return doc
+
+
+capabilities_cache = CapabilitiesCache()
+
+
+class FragmentCache:
+    """
+    In-process cache of rendered per-layer document fragments, e.g. DescribeCoverage coverage descriptions.
+
+    Fragments are cached per (layer, kind, locale) and are discarded when the ranges of their layer
+    change, or (for all layers) when the configuration is made ready.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[Hashable, Any]] = {}
+        self._generations: Dict[str, int] = {}
+        self._generation = 0
+
+    def invalidate(self, layer_name: Optional[str] = None) -> None:
+        """
+        Discard the cached fragments of a layer, or of all layers if no layer name is supplied.
+        """
+        with self._lock:
+            if layer_name is None:
+                self._generation += 1
+                self._generations.clear()
+                self._entries.clear()
+            else:
+                self._generations[layer_name] = self._generations.get(layer_name, 0) + 1
+                self._entries.pop(layer_name, None)
+
+    def get(self, layer_name: str, kind: Hashable, render: Callable[[], Any]) -> Any:
+        """
+        :param layer_name: The layer the fragment describes
+        :param kind: Identifies the type of fragment (e.g. service and version) - the locale is added.
+        :param render: Renders the fragment if it is not already cached.
+        :return: The cached (or newly rendered) fragment
+        """
+        key = (kind, _locale_key())
+        with self._lock:
+            fragment = self._entries.get(layer_name, {}).get(key)
+            if fragment is not None:
+                return fragment
+            generation = (self._generation, self._generations.get(layer_name, 0))
+        fragment = render()
+        with self._lock:
+            # Not cached if invalidated while rendering.
+            if generation == (self._generation, self._generations.get(layer_name, 0)):
+                self._entries.setdefault(layer_name, {})[key] = fragment
+        return fragment
+
+
+description_cache = FragmentCache()
+
+
+def check_update_sequence(args, exception_class: Type[OGCException]) -> None:
+    """
+    Handle the updatesequence parameter of a GetCapabilities request.
+
+    Raises CurrentUpdateSequence if the client's capabilities document is up to date.  Other values
+    (including higher values, which may have come from another worker process) are ignored and the
+    current document returned.
+    """
+    client_sequence = args.get("updatesequence")
+    if client_sequence and client_sequence == capabilities_cache.update_sequence:
+        raise exception_class("Capabilities document is up to date (updateSequence %s)" % client_sequence,
+                              OGCException.CURRENT_UPDATE_SEQUENCE,
+                              locator="UpdateSequence parameter")
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as per RFC 7232
+    candidates = [t.strip() for t in if_none_match.split(",")]
+    return any((c[2:] if c.startswith("W/") else c) == etag for c in candidates)
+
+
+def capabilities_response(cfg, args, key: Hashable, render: RENDERER):
+    """
+    Return a cached capabilities document, or Not Modified if the client already has it.
+
+    :param cfg: The OWS configuration
+    :param args: The (lower-case) request arguments
+    :param key: Identifies the document (service, version, base url, sections)
+    :param render: Renders the document if it is not already cached.
+    :return: A Flask response tuple
+    """
+    doc = capabilities_cache.get(key, render)
+    headers = cache_control_headers(cfg.wms_cap_cache_age)
+    headers["ETag"] = doc.etag
+    if etag_matches(args.get("if-none-match"), doc.etag):
+        return ("", 304, cfg.response_headers(headers))
+    headers["Content-Type"] = doc.content_type
+    return (doc.body, 200, cfg.response_headers(headers))
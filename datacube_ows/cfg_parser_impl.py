@@ -7,6 +7,7 @@
 
 import json
 import os
+import pickle
 import sys
 
 import click
@@ -15,6 +16,7 @@ from datacube import Datacube
 from deepdiff import DeepDiff
 
 from datacube_ows import __version__
+from datacube_ows.config_snapshot import write_snapshot
 from datacube_ows.ows_configuration import (ConfigException, OWSConfig,
                                             OWSFolder, read_config)
 
@@ -320,6 +322,44 @@ def compile_cmd(languages, domain, translations_dir, cfg):
     return 0
 
 
+@main.command()
+@click.option(
+    "-o",
+    "--output",
+    default="ows_cfg.snapshot",
+    help="The snapshot file to write (defaults to 'ows_cfg.snapshot')",
+)
+@click.argument("path", nargs=1, required=False)
+def snapshot(path, output):
+    """Write a pre-parsed snapshot of a configuration, for fast worker startup.
+
+    The configuration is parsed, validated and made ready against the database (including band
+    indexes, flag definitions and layer ranges), and the result is written to the snapshot file.
+    Workers load the snapshot instead of parsing the configuration if the
+    $DATACUBE_OWS_CFG_SNAPSHOT environment variable is set to the snapshot file.
+
+    Takes a configuration specification which is loaded as per the $DATACUBE_OWS_CFG environment variable.
+
+    If no specification is provided, the $DATACUBE_OWS_CFG environment variable is used.
+    """
+    try:
+        raw_cfg = read_config(path)
+        cfg = OWSConfig(refresh=True, cfg=raw_cfg)
+        with Datacube() as dc:
+            cfg.make_ready(dc)
+    except ConfigException as e:
+        click.echo(f"Config exception for path {str(e)}")
+        sys.exit(1)
+    try:
+        write_snapshot(cfg, raw_cfg, output)
+    # Objects that cannot be pickled (e.g. lambdas) raise any of these.
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        click.echo(f"Configuration cannot be snapshotted: {str(e)}")
+        sys.exit(1)
+    click.echo(f"Configuration snapshot {output} written")
+    return 0
+
+
 def compile_translation(translations_dir, domain, language):
     click.echo(f"Compiling template for language: {language}")
     os.system(f"pybabel compile -d {translations_dir} -D {domain} -l {language}")
@@ -0,0 +1,147 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+from typing import Any, Optional
+
+from datacube_ows import __version__
+from datacube_ows.config_utils import CFG_DICT
+from datacube_ows.cube_pool import cube
+from datacube_ows.ogc_utils import ConfigException
+from datacube_ows.ows_configuration import OWSConfig, read_config
+
+_LOG = logging.getLogger(__name__)
+
+# Increment when the snapshot file layout changes.
+SNAPSHOT_FORMAT = 1
+
+
+def _fingerprint_default(obj: Any) -> str:
+    if callable(obj):
+        return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', repr(obj))}"
+    return type(obj).__name__
+
+
+def config_fingerprint(raw_cfg: CFG_DICT) -> str:
+    """
+    Fingerprint a configuration, for checking that a snapshot is up to date.
+
+    Covers the fully expanded configuration, the metadata message file (if any) and the datacube-ows version.
+
+    :param raw_cfg: The expanded configuration, as returned by read_config()
+    :return: A hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    digest.update(__version__.encode("utf-8"))
+    digest.update(json.dumps(raw_cfg, sort_keys=True, default=_fingerprint_default).encode("utf-8"))
+    msg_file = raw_cfg.get("global", {}).get("message_file")
+    if msg_file and os.path.exists(msg_file):
+        with open(msg_file, "rb") as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def write_snapshot(cfg: OWSConfig, raw_cfg: CFG_DICT, path: str) -> None:
+    """
+    Write a configuration snapshot.
+
+    :param cfg: A ready OWSConfig
+    :param raw_cfg: The expanded configuration cfg was parsed from
+    :param path: The file to write the snapshot to.  Replaced atomically if it already exists.
+    """
+    if not cfg.ready:
+        raise ConfigException("Only a ready configuration can be snapshotted")
+    header = {
+        "format": SNAPSHOT_FORMAT,
+        "version": __version__,
+        "fingerprint": config_fingerprint(raw_cfg),
+    }
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix=".ows_cfg_snapshot")
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            pickle.dump(header, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(cfg, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path: str, raw_cfg: Optional[CFG_DICT] = None) -> OWSConfig:
+    """
+    Read a configuration snapshot.
+
+    The snapshot becomes the current OWS configuration.  Ranges stored in the snapshot are as of when
+    the snapshot was written - use refresh_snapshot_ranges() to bring them up to date.
+
+    :param path: The snapshot file
+    :param raw_cfg: The expanded configuration the snapshot is expected to have been made from.
+                    Defaults to the configuration identified by $DATACUBE_OWS_CFG.
+    :return: The ready OWSConfig
+    :raises: ConfigException if the snapshot is unreadable or out of date.
+    """
+    if raw_cfg is None:
+        raw_cfg = read_config()
+    try:
+        with open(path, "rb") as fp:
+            header = pickle.load(fp)
+            if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+                raise ConfigException(f"Unsupported configuration snapshot format in {path}")
+            if header.get("version") != __version__:
+                raise ConfigException(
+                    f"Configuration snapshot {path} was written by datacube-ows {header.get('version')}, "
+                    f"not {__version__}"
+                )
+            if header.get("fingerprint") != config_fingerprint(raw_cfg):
+                raise ConfigException(f"Configuration snapshot {path} does not match the current configuration")
+            cfg = pickle.load(fp)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        raise ConfigException(f"Could not read configuration snapshot {path}: {e}") from e
+    if not isinstance(cfg, OWSConfig):
+        raise ConfigException(f"Configuration snapshot {path} does not contain an OWS configuration")
+    OWSConfig.install_instance(cfg)
+    return cfg
+
+
+def refresh_snapshot_ranges(cfg: OWSConfig) -> None:
+    """
+    Bring the layer ranges of a configuration read from a snapshot up to date, with one query per range table.
+
+    Keeps the snapshot ranges if the database is not available.
+    """
+    from datacube_ows.product_ranges import PreloadedRanges
+    try:
+        with cube() as dc:
+            preloaded = PreloadedRanges(dc, cfg)
+    # pylint: disable=broad-except
+    except Exception as e:
+        _LOG.warning("Could not refresh ranges of snapshot configuration - using snapshot ranges: %s", str(e))
+        return
+    for layer in cfg.product_index.values():
+        if not layer.lazy:
+            layer.set_ranges(preloaded.get(layer))
+
+
+def load_snapshot(path: str) -> Optional[OWSConfig]:
+    """
+    Load the configuration from a snapshot at worker startup, if possible.
+
+    :param path: The snapshot file
+    :return: The ready OWSConfig, or None if the snapshot cannot be used (the configuration must then be parsed).
+    """
+    try:
+        cfg = read_snapshot(path)
+    except ConfigException as e:
+        _LOG.warning("Not using configuration snapshot: %s", str(e))
+        return None
+    refresh_snapshot_ranges(cfg)
+    _LOG.info("Configuration loaded from snapshot %s", path)
+    return cfg
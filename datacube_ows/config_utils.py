@@ -13,6 +13,7 @@ from urllib.parse import urlparse
 
 import fsspec
 from datacube.utils.masking import make_mask
+from flask_babel import get_locale
 from flask_babel import gettext as _
 from xarray import DataArray
 
@@ -197,7 +198,10 @@ class OWSConfigEntry:
         if name == "_unready_attributes":
             pass
         elif hasattr(self, "_unready_attributes") and name in self._unready_attributes:
-            raise OWSConfigNotReady(f"The following parameters have not been initialised: {self._unready_attributes}")
+            if not self.ready_on_demand() or name in self._unready_attributes:
+                raise OWSConfigNotReady(
+                    f"The following parameters have not been initialised: {self._unready_attributes}"
+                )
         return object.__getattribute__(self, name)
 
     def __setattr__(self, name: str, val: Any) -> None:
@@ -213,6 +217,17 @@ class OWSConfigEntry:
             self._unready_attributes.remove(name)
         super().__setattr__(name, val)
 
+    def ready_on_demand(self) -> bool:
+        """
+        Called when an unready attribute is accessed, to give entries that support deferred
+        initialisation a chance to make themselves ready.
+
+        The base class does not support deferred initialisation.
+
+        :return: True if the entry attempted to make itself ready.
+        """
+        return False
+
     # Validate against database and prepare for use.
     def make_ready(self, dc: "datacube.Datacube", *args, **kwargs) -> None:
         """
@@ -229,6 +244,68 @@ class OWSConfigEntry:
         if self._unready_attributes:
             raise OWSConfigNotReady(f"The following parameters have not been initialised: {self._unready_attributes}")
         self.ready = True
+        self.freeze()
+
+    # Frozen variants of config entry classes, by class.
+    _frozen_classes: MutableMapping[type, type] = {}
+
+    @classmethod
+    def frozen_namespace(cls) -> MutableMapping[str, Any]:
+        """
+        Class attributes for the frozen variant of this class.
+
+        The frozen variant uses plain attribute access, without checking for unready attributes.
+        """
+        return {
+            "__getattribute__": object.__getattribute__,
+            "__setattr__": object.__setattr__,
+            "__reduce_ex__": _reduce_frozen,
+            "frozen": True,
+        }
+
+    @classmethod
+    def frozen_class(cls) -> type:
+        if cls.__dict__.get("frozen"):
+            return cls
+        frozen = OWSConfigEntry._frozen_classes.get(cls)
+        if frozen is None:
+            namespace = cls.frozen_namespace()
+            namespace["__module__"] = cls.__module__
+            namespace["__qualname__"] = cls.__qualname__
+            frozen = type(cls.__name__, (cls,), namespace)
+            OWSConfigEntry._frozen_classes[cls] = frozen
+        return frozen
+
+    frozen = False
+
+    def freeze(self) -> None:
+        """
+        Switch a ready config entry to plain attribute access, by swapping its class for the frozen variant.
+
+        Unready attributes are no longer checked, so this is only possible once the entry is ready.
+        """
+        if self._unready_attributes:
+            raise OWSConfigNotReady(f"The following parameters have not been initialised: {self._unready_attributes}")
+        self.__class__ = self.frozen_class()
+
+    def thaw(self) -> None:
+        """
+        Undo freeze().
+        """
+        if self.frozen:
+            self.__class__ = self.__class__.__bases__[0]
+
+
+def _new_frozen(cls: type) -> OWSConfigEntry:
+    # Frozen classes are created at runtime and cannot be pickled by reference, so pickles refer
+    # to the unfrozen class instead.
+    return object.__new__(cls.frozen_class())
+
+
+def _reduce_frozen(self: OWSConfigEntry, protocol: int) -> Any:
+    # Memoised metadata depends on the message catalog of the current process.
+    state = {k: v for k, v in self.__dict__.items() if k != "_metadata_cache"}
+    return (_new_frozen, (type(self).__bases__[0],), state)
 
 #####################################################
 # Metadata separation and translation.
@@ -272,6 +349,7 @@ class OWSMetadataConfig(OWSConfigEntry):
     _inheritance_registry: MutableMapping[str, bool] = {}
 
     _msg_src: Optional["babel.messages.Catalog"] = None
+    _msg_src_version: int = 0
 
     # Inaccessible attributes to allow type checking
     abstract: str = ""
@@ -403,6 +481,15 @@ class OWSMetadataConfig(OWSConfigEntry):
         :param src: A Message Catalog object
         """
         OWSMetadataConfig._msg_src = src
+        # Invalidates metadata memoised by frozen entries.
+        OWSMetadataConfig._msg_src_version += 1
+
+    @classmethod
+    def msg_src_version(cls) -> int:
+        """
+        :return: A counter incremented every time the shared message catalog is replaced.
+        """
+        return OWSMetadataConfig._msg_src_version
 
     def read_metadata(self, lbl: str, fld: str) -> Optional[str]:
         """
@@ -486,25 +573,71 @@ class OWSMetadataConfig(OWSConfigEntry):
         """
         return cast("datacube_ows.ows_configuration.OWSConfig", self)
 
-    def __getattribute__(self, name: str) -> Any:
-        """"
-        Expose separated or internationalised metadata as attributes
+    def resolve_metadata(self, name: str) -> Any:
         """
-        if name in (FLD_TITLE, FLD_ABSTRACT, FLD_FEES,
-                    FLD_ACCESS_CONSTRAINTS, FLD_CONTACT_POSITION, FLD_CONTACT_ORGANISATION,
-                    FLD_UNITS):
-            return self.read_local_metadata(name)
-        elif name == FLD_KEYWORDS:
+        Resolve a metadata attribute, with separation and translation.
+
+        :param name: A metadata attribute name (e.g. "title" or "local_keywords")
+        :return: The attribute value
+        """
+        if name == FLD_KEYWORDS:
             kw = self.read_local_metadata(FLD_KEYWORDS)
             if kw:
                 return set(kw.split(","))
             else:
                 return set()
-        elif name == FLD_ATTRIBUTION:
-            return self.read_local_metadata(FLD_ATTRIBUTION)
+        return self.read_local_metadata(name)
+
+    def __getattribute__(self, name: str) -> Any:
+        """"
+        Expose separated or internationalised metadata as attributes
+        """
+        if name in METADATA_ATTRIBUTES:
+            return self.resolve_metadata(name)
         else:
             return super().__getattribute__(name)
 
+    @classmethod
+    def frozen_namespace(cls) -> MutableMapping[str, Any]:
+        namespace = super().frozen_namespace()
+        for name in METADATA_ATTRIBUTES:
+            namespace[name] = property(_memoised_metadata(name))
+        return namespace
+
+
+# Attributes exposing separated or internationalised metadata.
+METADATA_ATTRIBUTES = frozenset([
+    FLD_TITLE, FLD_ABSTRACT, FLD_FEES, FLD_ACCESS_CONSTRAINTS,
+    FLD_CONTACT_POSITION, FLD_CONTACT_ORGANISATION, FLD_UNITS,
+    FLD_KEYWORDS, FLD_ATTRIBUTION,
+])
+
+
+def _memoised_metadata(name: str) -> Callable[[OWSMetadataConfig], Any]:
+    """
+    Getter for a metadata attribute of a frozen config entry.
+
+    Resolved values are memoised per entry, by locale and message catalog.
+    """
+    def getter(self: OWSMetadataConfig) -> Any:
+        if self.global_config().internationalised:
+            locale: Optional[str] = str(get_locale())
+        else:
+            locale = None
+        key = (name, locale, OWSMetadataConfig.msg_src_version())
+        cache = self.__dict__.get("_metadata_cache")
+        if cache is None:
+            cache = self._metadata_cache = {}
+        try:
+            val = cache[key]
+        except KeyError:
+            val = cache[key] = self.resolve_metadata(name)
+        if name == FLD_KEYWORDS:
+            # Callers may modify the keyword set.
+            return set(val)
+        return val
+    return getter
+
 ###########################
 # Inheritable configuration
 
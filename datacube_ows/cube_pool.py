@@ -4,11 +4,14 @@
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
 import logging
+import os
+import threading
 from contextlib import contextmanager
-from threading import Lock
-from typing import Generator, MutableMapping, Optional
+from time import monotonic
+from typing import Any, Generator, List, MutableMapping, Optional, Tuple
 
 from datacube import Datacube
+from sqlalchemy import text
 
 _LOG: logging.Logger = logging.getLogger(__name__)
 
@@ -22,26 +25,73 @@ class ODCInitException(Exception):
         return "ODC initialisation failed:" + str(self.cause)
 
 
+class CubePoolTimeout(Exception):
+    """
+    Raised when no Datacube object becomes available in a cube pool before the pool timeout expires.
+    """
+
+
+def _env_number(name: str, default: float, integer: bool = False) -> float:
+    val = os.environ.get(name)
+    if val is None or val == "":
+        return default
+    try:
+        return int(val) if integer else float(val)
+    except ValueError:
+        _LOG.warning("Invalid value for $%s: %s - using default (%s)", name, val, default)
+        return default
+
+
+class PooledCube:
+    """
+    A Datacube object managed by a CubePool, with its pool bookkeeping.
+    """
+    def __init__(self, dc: Datacube) -> None:
+        self.dc = dc
+        self.created = monotonic()
+        self.last_used = self.created
+
+
 # CubePool class
 class CubePool:
     """
     A Cube pool is a thread-safe resource pool for managing Datacube objects (which map to database connections).
+
+    Datacube objects are checked out of the pool for the duration of a cube() context, and returned to it
+    afterwards.  A thread that already has a Datacube checked out gets the same object back from nested
+    cube() contexts.  If all Datacube objects are in use and the pool is at its maximum size, threads wait
+    for one to be returned.  Idle Datacube objects are validated before reuse, and are closed and replaced
+    once they reach the recycle age.
+
+    Datacube objects dedicated to a thread by the low-level get_cube() API are also taken from the pool, and
+    count towards its size until the thread exits.  Long-running threads should use cube() instead.
+
+    The pool is configured by environment variables:
+
+    $DATACUBE_OWS_CUBE_POOL_SIZE: Maximum number of Datacube objects in the pool (default 4)
+    $DATACUBE_OWS_CUBE_POOL_TIMEOUT: Seconds to wait for a Datacube object (default 30)
+    $DATACUBE_OWS_CUBE_POOL_RECYCLE: Age in seconds after which Datacube objects are replaced (default 3600)
+    $DATACUBE_OWS_CUBE_POOL_VALIDATE_IDLE: Datacube objects idle for longer than this many seconds are checked
+            with a trivial query before reuse (default 30)
     """
     # _instances, global mapping of CubePools by app name
     _instances: MutableMapping[str, "CubePool"] = {}
+    _instances_lock = threading.Lock()
 
-    _cubes_lock_: bool = False
-
-    _instance: Optional[Datacube] = None
+    # Prometheus metrics - set by datacube_ows.startup_utils.initialise_prometheus if metrics are enabled.
+    metrics: Optional[MutableMapping[str, Any]] = None
 
     def __new__(cls, app: str) -> "CubePool":
         """
         Construction of CubePools is managed. Constructing a cubepool for an app string that already has a cubepool
         constructed, returns the existing cubepool, not a new one.
         """
-        if app not in cls._instances:
-            cls._instances[app] = super(CubePool, cls).__new__(cls)
-        return cls._instances[app]
+        with cls._instances_lock:
+            if app not in cls._instances:
+                pool = super(CubePool, cls).__new__(cls)
+                pool._init_pool(app)
+                cls._instances[app] = pool
+            return cls._instances[app]
 
     def __init__(self, app: str) -> None:
         """
@@ -49,28 +99,204 @@ class CubePool:
 
         :param app: The app string used to construct any Datacube objects created by the pool.
         """
+        # Database connections cannot be shared with a forked parent process - start again.
+        if self._pid != os.getpid():
+            with self._instances_lock:
+                if self._pid != os.getpid():
+                    self._init_pool(app)
+
+    def _init_pool(self, app: str) -> None:
         self.app: str = app
-        if not self._cubes_lock_:
-            self._cubes_lock: Lock = Lock()
-            self._cubes_lock_ = True
+        self.max_size = max(int(_env_number("DATACUBE_OWS_CUBE_POOL_SIZE", 4, integer=True)), 1)
+        self.timeout = _env_number("DATACUBE_OWS_CUBE_POOL_TIMEOUT", 30.0)
+        self.recycle = _env_number("DATACUBE_OWS_CUBE_POOL_RECYCLE", 3600.0)
+        self.validate_idle = _env_number("DATACUBE_OWS_CUBE_POOL_VALIDATE_IDLE", 30.0)
+        self._cond = threading.Condition()
+        self._idle: List[PooledCube] = []
+        # Number of pooled Datacube objects - idle, in use or being created.
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._local = threading.local()
+        # Datacube objects dedicated to threads by get_cube(), by thread id.
+        self._thread_cubes: MutableMapping[int, Tuple[threading.Thread, PooledCube]] = {}
+        self._pid = os.getpid()
 
-    def get_cube(self) -> Optional[Datacube]:
+    def stats(self) -> MutableMapping[str, int]:
+        """
+        :return: Current pool usage statistics
         """
-        Return a Datacube object.  Either generating a new Datacube, or recycling an unassigned one already in the pool.
+        with self._cond:
+            return {
+                "size": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+            }
 
-        :return:  a Datacube object (or None on error).
+    def _report(self) -> None:
+        # Call with self._cond held.
+        if self.metrics is None:
+            return
+        self.metrics["in_use"].labels(self.app).set(self._in_use)
+        self.metrics["idle"].labels(self.app).set(len(self._idle))
+        self.metrics["waiting"].labels(self.app).set(self._waiting)
+
+    def _count(self, metric: str) -> None:
+        if self.metrics is not None:
+            self.metrics[metric].labels(self.app).inc()
+
+    def checkout(self) -> Datacube:
+        """
+        Check a Datacube object out of the pool.  Must be returned with checkin().
+
+        Prefer the cube() context manager over calling this directly.
+
+        :return: a Datacube object
+        :raises: ODCInitException, CubePoolTimeout
         """
-        self._cubes_lock.acquire()
+        local = self._local
+        if getattr(local, "depth", 0):
+            local.depth += 1
+            return local.entry.dc
+        thread_entry = getattr(local, "thread_entry", None)
+        if thread_entry is not None:
+            # This thread already has a Datacube object of its own.
+            local.entry = thread_entry
+            local.depth = 1
+            return thread_entry.dc
+        entry = self._acquire()
+        local.entry = entry
+        local.depth = 1
+        return entry.dc
+
+    def _acquire(self) -> PooledCube:
+        """
+        Take an idle Datacube object from the pool, or create a new one, waiting if the pool is full.
+        """
+        deadline = monotonic() + self.timeout
+        with self._cond:
+            self._reap_thread_cubes()
+            while not self._idle and self._open >= self.max_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise CubePoolTimeout(
+                        f"Timed out waiting for a Datacube object from the {self.app} pool "
+                        f"({self.max_size} in use)"
+                    )
+                self._waiting += 1
+                self._report()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                self._reap_thread_cubes()
+            if self._idle:
+                entry: Optional[PooledCube] = self._idle.pop()
+            else:
+                entry = None
+                self._open += 1
+            self._in_use += 1
+            self._report()
         try:
-            if self._instance is None:
-                self._instance = self._new_cube()
-        # pylint: disable=broad-except
+            if entry is not None and not self._usable(entry):
+                self._close(entry)
+                entry = None
+            if entry is None:
+                entry = PooledCube(self._new_cube())
+                self._count("created")
         except Exception as e:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._report()
+                self._cond.notify()
             _LOG.error("ODC initialisation failed: %s", str(e))
-            raise(ODCInitException(e))
-        finally:
-            self._cubes_lock.release()
-        return self._instance
+            raise ODCInitException(e)
+        return entry
+
+    def checkin(self, dc: Datacube) -> None:
+        """
+        Return a Datacube object obtained from checkout() to the pool.
+        """
+        local = self._local
+        if not getattr(local, "depth", 0) or local.entry.dc is not dc:
+            raise ValueError("Datacube object was not checked out of this pool by this thread")
+        local.depth -= 1
+        if local.depth:
+            return
+        entry = local.entry
+        local.entry = None
+        if entry is getattr(local, "thread_entry", None):
+            # Stays with the thread.
+            return
+        self._release(entry)
+
+    def _release(self, entry: PooledCube) -> None:
+        entry.last_used = monotonic()
+        with self._cond:
+            self._in_use -= 1
+            self._idle.append(entry)
+            self._report()
+            self._cond.notify()
+
+    def _reap_thread_cubes(self) -> None:
+        """
+        Return the Datacube objects of threads that have exited to the pool.  Call with self._cond held.
+        """
+        for ident, (thread, entry) in list(self._thread_cubes.items()):
+            if not thread.is_alive():
+                del self._thread_cubes[ident]
+                entry.last_used = monotonic()
+                self._in_use -= 1
+                self._idle.append(entry)
+
+    def _usable(self, entry: PooledCube) -> bool:
+        now = monotonic()
+        if now - entry.created > self.recycle:
+            _LOG.debug("Recycling Datacube object from %s pool", self.app)
+            return False
+        if now - entry.last_used > self.validate_idle:
+            try:
+                # pylint: disable=protected-access
+                with entry.dc.index._db.give_me_a_connection() as conn:
+                    conn.execute(text("SELECT 1"))
+            # pylint: disable=broad-except
+            except Exception as e:
+                _LOG.warning("Discarding invalid Datacube object from %s pool: %s", self.app, str(e))
+                return False
+        return True
+
+    def _close(self, entry: PooledCube) -> None:
+        self._count("discarded")
+        try:
+            entry.dc.close()
+        # pylint: disable=broad-except
+        except Exception as e:
+            _LOG.warning("Error closing Datacube object: %s", str(e))
+
+    def get_cube(self) -> Optional[Datacube]:
+        """
+        Return a Datacube object for use by the calling thread, outside of the pool's checkout/checkin cycle.
+
+        Returns the Datacube object checked out by this thread if there is one, otherwise a Datacube object
+        dedicated to the calling thread.  Dedicated Datacube objects are taken from the pool (waiting if it
+        is full) and are returned to it once the thread has exited.
+
+        :return:  a Datacube object (or None on error).
+        :raises: ODCInitException, CubePoolTimeout
+        """
+        local = self._local
+        if getattr(local, "depth", 0):
+            return local.entry.dc
+        entry = getattr(local, "thread_entry", None)
+        if entry is None:
+            entry = self._acquire()
+            local.thread_entry = entry
+            thread = threading.current_thread()
+            with self._cond:
+                self._thread_cubes[thread.ident] = (thread, entry)
+        return entry.dc
 
     def _new_cube(self) -> Datacube:
         return Datacube(app=self.app)
@@ -79,7 +305,7 @@ class CubePool:
 # Lowlevel CubePool API
 def get_cube(app: str = "ows") -> Optional[Datacube]:
     """
-    Obtain a Datacube object from the appropriate pool
+    Obtain a Datacube object for the calling thread from the appropriate pool
 
     :param app: The app pool to use - defaults to "ows".
     :return: a Datacube object (or None) in case of database error.
@@ -103,6 +329,11 @@ def cube(app: str = "ows") -> Generator[Optional["datacube.api.core.Datacube"],
 
     :param app: The pool to obtain the app from - defaults to "ows".
     :return: A Datacube context manager.
-    :raises: ODCInitException
+    :raises: ODCInitException, CubePoolTimeout
     """
-    yield get_cube(app)
+    pool = CubePool(app=app)
+    dc = pool.checkout()
+    try:
+        yield dc
+    finally:
+        pool.checkin(dc)
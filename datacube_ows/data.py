@@ -8,8 +8,10 @@ from __future__ import absolute_import
 import json
 import logging
 import re
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
 from itertools import chain
 
 import datacube
@@ -20,11 +22,11 @@ from datacube.utils import geometry
 from datacube.utils.masking import mask_to_dict
 from pandas import Timestamp
 from rasterio.features import rasterize
-from rasterio.io import MemoryFile
 from rasterio.warp import Resampling
 
 from datacube_ows.cube_pool import cube
-from datacube_ows.mv_index import MVSelectOpts, mv_search
+from datacube_ows.image_encoding import empty_png, encode_indexed, solid_png
+from datacube_ows.mv_index import MVSelectOpts, mv_search, mv_search_grouped
 from datacube_ows.ogc_exceptions import WMSException
 from datacube_ows.ogc_utils import (ConfigException, dataset_center_time,
                                     solar_date, tz_for_geometry,
@@ -33,7 +35,7 @@ from datacube_ows.ows_configuration import get_config
 from datacube_ows.query_profiler import QueryProfiler
 from datacube_ows.resource_limits import ResourceLimited
 from datacube_ows.startup_utils import CredentialManager
-from datacube_ows.utils import log_call
+from datacube_ows.utils import log_call, thread_pool
 from datacube_ows.wms_utils import (GetFeatureInfoParameters, GetMapParameters,
                                     img_coords_to_geopoint, solar_correct_data)
 
@@ -161,7 +163,11 @@ class DataStacker:
     def datasets(self, index,
                  all_flag_bands=False,
                  all_time=False, point=None,
-                 mode=MVSelectOpts.DATASETS):
+                 mode=MVSelectOpts.DATASETS,
+                 main_limit=None):
+        """
+        :param main_limit: For IDS searches, the maximum number of ids to return for the main product query.
+        """
         if mode == MVSelectOpts.EXTENT or all_time:
             # Not returning datasets - use main product only
             queries = [
@@ -191,6 +197,16 @@ class DataStacker:
             times = None
         else:
             times = self._times
+        if mode == MVSelectOpts.IDS and not all_time:
+            # All queries in one database round-trip.
+            ids = mv_search_grouped(index,
+                                    [
+                                        (query.products, None if query.ignore_time else times)
+                                        for query in queries
+                                    ],
+                                    geom=geom,
+                                    limits=[main_limit if query.main else None for query in queries])
+            return OrderedDict(zip(queries, ids))
         results = []
         for query in queries:
             if query.ignore_time:
@@ -201,7 +217,9 @@ class DataStacker:
                                sel=mode,
                                times=qry_times,
                                geom=geom,
-                               products=query.products)
+                               products=query.products,
+                               stream=mode == MVSelectOpts.DATASETS and self.cfg.data_load_stream_queries,
+                               simplify=self.extent_tolerance() if mode == MVSelectOpts.EXTENT else None)
             if mode == MVSelectOpts.DATASETS:
                 result = datacube.Datacube.group_datasets(result, self.group_by)
                 if all_time:
@@ -215,6 +233,27 @@ class DataStacker:
                 return result
         return OrderedDict(results)
 
+    def extent_tolerance(self):
+        """
+        Simplification tolerance for EXTENT searches: half a pixel, in the units of the request CRS.
+        """
+        return min(abs(res) for res in self._geobox.resolution) / 2
+
+    def datasets_for_ids(self, index, ids_by_query):
+        """
+        Convert the output of datasets(mode=MVSelectOpts.IDS) to the output of datasets(mode=MVSelectOpts.DATASETS)
+
+        All datasets are fetched from the index in a single bulk query.
+        """
+        all_ids = set(chain.from_iterable(ids_by_query.values()))
+        datasets_by_id = {str(ds.id): ds for ds in index.datasets.bulk_get(all_ids)}
+        return OrderedDict(
+            (query, datacube.Datacube.group_datasets(
+                [datasets_by_id[str(ds_id)] for ds_id in ids if str(ds_id) in datasets_by_id],
+                self.group_by))
+            for query, ids in ids_by_query.items()
+        )
+
     def create_nodata_filled_flag_bands(self, data, pbq):
         var = None
         for var in data.data_vars.variables.keys():
@@ -234,21 +273,69 @@ class DataStacker:
             data[band].attrs["flags_definition"] = pbq.products[0].measurements[band].flags_definition
         return data
 
+    def load_query(self, pbq, datasets, skip_corrections=False):
+        measurements = pbq.products[0].lookup_measurements(pbq.bands)
+        fuse_func = pbq.fuse_func
+        if pbq.manual_merge:
+            return self.manual_data_stack(datasets, measurements, pbq.bands, skip_corrections, fuse_func=fuse_func)
+        else:
+            return self.read_data(datasets, measurements, self._geobox, self._resampling, fuse_func=fuse_func)
+
+    @contextmanager
+    def query_loaders(self, datasets_by_query, skip_corrections=False):
+        """
+        Loaders for all queries, the main product query first.
+
+        Flag products are independent reads, so they are loaded on a shared thread pool while the main
+        product is loaded in the calling thread.  On exit, flag product loads that are no longer needed
+        (e.g. the main product returned no data, or an error occurred) are cancelled if not yet started,
+        and waited for otherwise, so that none outlive the request.
+
+        :return: List of (query, loader) tuples, where calling loader() returns the loaded data for the query.
+        """
+        queries = list(datasets_by_query.items())
+        n_threads = self.cfg.data_load_query_threads
+        if len(queries) < 2 or n_threads < 2:
+            # Load lazily in the calling thread.
+            yield [
+                (pbq, partial(self.load_query, pbq, datasets, skip_corrections))
+                for pbq, datasets in queries
+            ]
+            return
+        pool = thread_pool("ows-query-load", n_threads)
+        futures = OrderedDict(
+            (pbq, pool.submit(self.load_query, pbq, datasets, skip_corrections))
+            for pbq, datasets in queries[1:]
+        )
+        main_pbq, main_datasets = queries[0]
+        try:
+            yield [(main_pbq, partial(self.load_query, main_pbq, main_datasets, skip_corrections))] + [
+                (pbq, future.result) for pbq, future in futures.items()
+            ]
+        finally:
+            for pbq, future in futures.items():
+                if future.cancel():
+                    continue
+                try:
+                    future.result()
+                # pylint: disable=broad-except
+                except Exception as e:
+                    _LOG.warning("Loading flag product %s failed: %s", str(pbq), str(e))
+
     @log_call
     def data(self, datasets_by_query, skip_corrections=False):
-        # pylint: disable=too-many-locals, consider-using-enumerate
         # datasets is an XArray DataArray of datasets grouped by time.
+        with self.query_loaders(datasets_by_query, skip_corrections) as loaders:
+            return self._merge_query_data(loaders)
+
+    def _merge_query_data(self, loaders):
+        # pylint: disable=too-many-locals, consider-using-enumerate
         data = None
-        for pbq, datasets in datasets_by_query.items():
+        for pbq, loader in loaders:
             if data is not None and len(data.time) == 0:
                 # No data, so no need for masking data.
                 continue
-            measurements = pbq.products[0].lookup_measurements(pbq.bands)
-            fuse_func = pbq.fuse_func
-            if pbq.manual_merge:
-                qry_result = self.manual_data_stack(datasets, measurements, pbq.bands, skip_corrections, fuse_func=fuse_func)
-            else:
-                qry_result = self.read_data(datasets, measurements, self._geobox, self._resampling, fuse_func=fuse_func)
+            qry_result = loader()
             if data is None:
                 data = qry_result
                 continue
@@ -296,39 +383,106 @@ class DataStacker:
         else:
             non_flag_bands = bands
             flag_bands = set()
+        slice_datasets = [datasets.sel(time=dt).values.item() for dt in datasets.time.values]
+
+        def read(ds):
+            return self.read_masked_dataset(ds, measurements, non_flag_bands, skip_corrections, fuse_func)
+
         time_slices = []
-        for dt in datasets.time.values:
-            tds = datasets.sel(time=dt)
-            merged = None
-            for ds in tds.values.item():
-                d = self.read_data_for_single_dataset(ds, measurements, self._geobox, fuse_func=fuse_func)
-                # Squeeze upconverts uints to int32
-                dm = d.squeeze(["time"], drop=True)
-                extent_mask = None
-                for band in non_flag_bands:
-                    for f in self._product.extent_mask_func:
-                        if extent_mask is None:
-                            extent_mask = f(dm, band)
-                        else:
-                            extent_mask &= f(dm, band)
-                if extent_mask is not None:
-                    dm = dm.where(extent_mask)
-                if self._product.solar_correction and not skip_corrections:
-                    for band in non_flag_bands:
-                        dm[band] = solar_correct_data(dm[band], ds)
-                if merged is None:
-                    merged = dm
-                else:
-                    merged = merged.combine_first(dm)
-            for band in flag_bands:
-                # REVISIT: not sure about type converting one band like this?
-                merged[band] = merged[band].astype('uint16', copy=True)
-                merged[band].attrs = d[band].attrs
-            time_slices.append(merged)
+        n_threads = self.cfg.data_load_manual_merge_threads
+        if n_threads < 2:
+            for slice_dss in slice_datasets:
+                time_slices.append(self.merge_time_slice([partial(read, ds) for ds in slice_dss], flag_bands))
+        else:
+            pool = thread_pool("ows-dataset-load", n_threads)
+            # Only the time slice being merged and the next one are read at a time, so memory use
+            # does not grow with the number of time slices.
+            pending = deque()
+
+            def submit(i):
+                if i < len(slice_datasets):
+                    pending.append([pool.submit(read, ds) for ds in slice_datasets[i]])
+            submit(0)
+            try:
+                for i in range(len(slice_datasets)):
+                    submit(i + 1)
+                    time_slices.append(self.merge_time_slice([f.result for f in pending[0]], flag_bands))
+                    pending.popleft()
+            finally:
+                # On error, cancel the reads not yet started and wait for the rest.
+                for futures in pending:
+                    for future in futures:
+                        if not future.cancel():
+                            future.exception()
 
         result = xarray.concat(time_slices, datasets.time)
         return result
 
+    def merge_time_slice(self, loaders, flag_bands):
+        """
+        Mosaic the datasets of a single time slice.
+
+        :param loaders: Callables returning the results of read_masked_dataset for each dataset, in priority order.
+        :return: The merged data for the time slice.
+        """
+        merged = None
+        d = None
+        for load in loaders:
+            dm, d = load()
+            if merged is None:
+                # Mosaic buffer for this time slice.
+                merged = dm.copy(deep=True)
+            else:
+                self.mosaic_into(merged, dm)
+        for band in flag_bands:
+            # REVISIT: not sure about type converting one band like this?
+            merged[band] = merged[band].astype('uint16', copy=True)
+            merged[band].attrs = d[band].attrs
+        return merged
+
+    def read_masked_dataset(self, ds, measurements, non_flag_bands, skip_corrections, fuse_func):
+        """
+        Read a single dataset for manual merging, applying extent masks and solar correction.
+
+        :return: A tuple containing the masked/corrected data with time squeezed out, and the raw data.
+        """
+        d = self.read_data_for_single_dataset(ds, measurements, self._geobox, fuse_func=fuse_func)
+        # Squeeze upconverts uints to int32
+        dm = d.squeeze(["time"], drop=True)
+        extent_mask = None
+        for band in non_flag_bands:
+            for f in self._product.extent_mask_func:
+                if extent_mask is None:
+                    extent_mask = f(dm, band)
+                else:
+                    extent_mask &= f(dm, band)
+        if extent_mask is not None:
+            dm = dm.where(extent_mask)
+        if self._product.solar_correction and not skip_corrections:
+            for band in non_flag_bands:
+                dm[band] = solar_correct_data(dm[band], ds)
+        return dm, d
+
+    @staticmethod
+    def mosaic_into(merged, dm):
+        """
+        Fill gaps in merged from dm, in place.
+
+        Equivalent to merged = merged.combine_first(dm) for data loaded to the same geobox,
+        without copying the accumulated data on each step.
+        """
+        for band in dm.data_vars:
+            if band not in merged.data_vars:
+                merged[band] = dm[band]
+                continue
+            buf = merged[band].values
+            if buf.dtype.kind not in "fc":
+                # No NaNs in integer data, so nothing to fill
+                continue
+            gaps = numpy.isnan(buf)
+            if gaps.any():
+                numpy.copyto(buf, dm[band].values, casting="unsafe", where=gaps)
+
     # Read data for given datasets and measurements per the output_geobox
     @log_call
     def read_data(self, datasets, measurements, geobox, resampling=Resampling.nearest, fuse_func=None):
@@ -391,6 +545,42 @@ def user_date_sorter(odc_dates, geom, user_dates):
     )
     return xrresult
 
+def build_extent_mask(data, style, layer):
+    """
+    Build the extent mask for loaded data.
+
+    Extent mask functions (or the NaN mask for manually merged layers) are evaluated once
+    over the whole time-stacked dataset.
+
+    :param data: The loaded data, as returned by DataStacker.data()
+    :param style: The style being rendered
+    :param layer: The layer being rendered
+    :return: A boolean DataArray with the same dimensions as the data bands.
+    """
+    extent_mask = None
+    band = ""
+    for band in style.needed_bands:
+        if band not in style.flag_bands:
+            if layer.data_manual_merge:
+                if extent_mask is None:
+                    extent_mask = ~numpy.isnan(data[band])
+                else:
+                    extent_mask &= ~numpy.isnan(data[band])
+            else:
+                for f in layer.extent_mask_func:
+                    if extent_mask is None:
+                        extent_mask = f(data, band)
+                    else:
+                        extent_mask &= f(data, band)
+    if extent_mask is None:
+        extent_mask = xarray.DataArray(
+            numpy.ones(data[band].shape, dtype=numpy.bool_),
+            coords=data[band].coords,
+            dims=data[band].dims
+        )
+    return extent_mask
+
+
 class EmptyResponse(Exception):
     pass
 
@@ -417,9 +607,20 @@ def get_map(args):
             stacker = DataStacker(params.product, params.geobox, params.times, params.resampling, style=params.style)
             qprof["zoom_factor"] = params.zf
             qprof.start_event("count-datasets")
-            n_datasets = stacker.datasets(dc.index, mode=MVSelectOpts.COUNT)
+            # Dataset ids for all queries (main product and flag products) in one round trip.
+            # The ids are only needed if the request is within the dataset limit, so at most one more
+            # than the limit is fetched for the main product - enough to tell if the limit is exceeded -
+            # and the flag products are not searched at all if it is.
+            max_datasets = params.product.resource_limits.max_datasets_wms
+            ids_by_query = stacker.datasets(dc.index, mode=MVSelectOpts.IDS,
+                                            main_limit=max_datasets + 1 if max_datasets > 0 else None)
+            n_datasets = sum(len(ids) for q, ids in ids_by_query.items() if q.main)
+            if qprof.active and 0 < max_datasets < n_datasets:
+                # The count is capped at the limit - report the full count.
+                qprof["n_datasets"] = stacker.datasets(dc.index, mode=MVSelectOpts.COUNT)
+            else:
+                qprof["n_datasets"] = n_datasets
             qprof.end_event("count-datasets")
-            qprof["n_datasets"] = n_datasets
             qprof["zoom_level_base"] = params.resources.base_zoom_level
             qprof["zoom_level_adjusted"] = params.resources.load_adjusted_zoom_level
             try:
@@ -428,7 +629,7 @@ def get_map(args):
                 stacker.resource_limited = True
                 qprof["resource_limited"] = str(e)
             if qprof.active:
-                qprof["datasets"] = {str(q): ids for q, ids in stacker.datasets(dc.index, mode=MVSelectOpts.IDS).items()}
+                qprof["datasets"] = {str(q): ids for q, ids in ids_by_query.items()}
             if stacker.resource_limited and not params.product.low_res_product_names:
                 qprof.start_event("extent-in-query")
                 extent = stacker.datasets(dc.index, mode=MVSelectOpts.EXTENT)
@@ -454,7 +655,11 @@ def get_map(args):
                     qprof["n_summary_datasets"] = stacker.datasets(dc.index, mode=MVSelectOpts.COUNT)
                     qprof.end_event("count-summary-datasets")
                 qprof.start_event("fetch-datasets")
-                datasets = stacker.datasets(dc.index)
+                if stacker.resource_limited:
+                    # Switched to low-res products, so the ids already fetched do not apply.
+                    datasets = stacker.datasets(dc.index)
+                else:
+                    datasets = stacker.datasets_for_ids(dc.index, ids_by_query)
                 for flagband, dss in datasets.items():
                     if not dss.any():
                         _LOG.warning("Flag band %s returned no data", str(flagband))
@@ -468,36 +673,7 @@ def get_map(args):
                 qprof.end_event("load-data")
                 _LOG.debug("load stop %s %s", datetime.now().time(), args["requestid"])
                 qprof.start_event("build-masks")
-                td_masks = []
-                for npdt in data.time.values:
-                    td = data.sel(time=npdt)
-                    td_ext_mask = None
-                    band = ""
-                    for band in params.style.needed_bands:
-                        if band not in params.style.flag_bands:
-                            if params.product.data_manual_merge:
-                                if td_ext_mask is None:
-                                    td_ext_mask = ~numpy.isnan(td[band])
-                                else:
-                                    td_ext_mask &= ~numpy.isnan(td[band])
-                            else:
-                                for f in params.product.extent_mask_func:
-                                    if td_ext_mask is None:
-                                        td_ext_mask = f(td, band)
-                                    else:
-                                        td_ext_mask &= f(td, band)
-                    if params.product.data_manual_merge:
-                        td_ext_mask = xarray.DataArray(td_ext_mask)
-                    if td_ext_mask is None:
-                        td_ext_mask = xarray.DataArray(
-                                            ~numpy.zeros(
-                                                        td[band].values.shape,
-                                                        dtype=numpy.bool_
-                                            ),
-                                            td[band].coords
-                        )
-                    td_masks.append(td_ext_mask)
-                extent_mask = xarray.concat(td_masks, dim=data.time)
+                extent_mask = build_extent_mask(data, params.style, params.product)
                 qprof.end_event("build-masks")
                 if not data:
                     qprof["write_action"] = "No Data: Write Empty"
@@ -546,26 +722,19 @@ def _write_png(data, style, extent_mask, qprof):
     # If time dimension is present animate over it.
     # Verified using : https://docs.dea.ga.gov.au/notebooks/Frequently_used_code/Animated_timeseries.html
     mdh = style.get_multi_date_handler(img_data)
+    png_encoding = style.product.png_encoding
     if mdh:
-        image = xarray_image_as_png(img_data, loop_over='time', animate=True, frame_duration=mdh.frame_duration)
+        image = xarray_image_as_png(img_data, loop_over='time', animate=True, frame_duration=mdh.frame_duration,
+                                    png_encoding=png_encoding)
     else:
-        image = xarray_image_as_png(img_data)
+        image = xarray_image_as_png(img_data, png_encoding=png_encoding, palette=style.image_palette())
     qprof.end_event("write")
     return image
 
 
 @log_call
 def _write_empty(geobox):
-    with MemoryFile() as memfile:
-        with memfile.open(driver='PNG',
-                          width=geobox.width,
-                          height=geobox.height,
-                          count=1,
-                          transform=None,
-                          nodata=0,
-                          dtype='uint8') as thing:
-            pass
-        return memfile.read()
+    return empty_png(geobox.width, geobox.height)
 
 
 def get_coordlist(geo, layer_name):
@@ -592,28 +761,18 @@ def get_coordlist(geo, layer_name):
 
 @log_call
 def _write_polygon(geobox, polygon, zoom_fill, layer):
+    zoom_fill = tuple(zoom_fill)
     geobox_ext = geobox.extent
     if geobox_ext.within(polygon):
-        data = numpy.full([geobox.height, geobox.width], fill_value=1, dtype="uint8")
-    else:
-        data = numpy.zeros([geobox.height, geobox.width], dtype="uint8")
-        data = rasterize(shapes=[polygon],
-                          fill=0,
-                          default_value=2,
-                          out=data,
-                          transform=geobox.affine
-                        )
-    with MemoryFile() as memfile:
-        with memfile.open(driver='PNG',
-                          width=geobox.width,
-                          height=geobox.height,
-                          count=4,
-                          transform=None,
-                          nodata=0,
-                          dtype='uint8') as thing:
-            for idx, fill in enumerate(zoom_fill, start=1):
-                thing.write_band(idx, data * fill)
-        return memfile.read()
+        return solid_png(geobox.width, geobox.height, zoom_fill)
+    data = numpy.zeros([geobox.height, geobox.width], dtype="uint8")
+    data = rasterize(shapes=[polygon],
+                     fill=0,
+                     default_value=1,
+                     out=data,
+                     transform=geobox.affine
+                     )
+    return encode_indexed(data, [(0, 0, 0, 0), zoom_fill])
 
 
 @log_call
@@ -0,0 +1,163 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import logging
+import zlib
+from functools import lru_cache
+from io import BytesIO
+from typing import Any, Iterable, MutableMapping, Optional, Tuple, cast
+
+import numpy
+from PIL import Image
+
+from datacube_ows.config_utils import CFG_DICT, OWSConfigEntry
+from datacube_ows.ogc_utils import ConfigException
+
+_LOG = logging.getLogger(__name__)
+
+RGBA = Tuple[int, int, int, int]
+
+
+class PNGEncoding(OWSConfigEntry):
+    """
+    PNG output encoding options, from the "png_encoding" entry of the wms section or of a layer.
+
+    Layer options override the global options, which override the defaults.
+    """
+    # zlib compression strategies, by config name.
+    strategies = {
+        "default": zlib.Z_DEFAULT_STRATEGY,
+        "filtered": zlib.Z_FILTERED,
+        "huffman_only": zlib.Z_HUFFMAN_ONLY,
+        "rle": zlib.Z_RLE,
+        "fixed": zlib.Z_FIXED,
+    }
+
+    def __init__(self, cfg: CFG_DICT, defaults: Optional["PNGEncoding"] = None, context: str = "wms section") -> None:
+        """
+        :param cfg: The png_encoding configuration.
+        :param defaults: The encoding options to inherit unspecified values from (e.g. the global options for a layer)
+        :param context: The context (e.g. layer name) for reporting validation errors.
+        """
+        if defaults is not None:
+            cfg = dict(cast(CFG_DICT, defaults._raw_cfg), **cfg)
+        super().__init__(cfg)
+        cfg = cast(CFG_DICT, self._raw_cfg)
+        try:
+            self.compression_level = int(cast(int, cfg.get("compression_level", 6)))
+        except (ValueError, TypeError):
+            raise ConfigException(f"png_encoding compression_level must be an integer in {context}")
+        if self.compression_level < 0 or self.compression_level > 9:
+            raise ConfigException(f"png_encoding compression_level must be between 0 and 9 in {context}")
+        self.strategy = cast(str, cfg.get("strategy", "default"))
+        if self.strategy not in self.strategies:
+            raise ConfigException(
+                f"Invalid png_encoding strategy {self.strategy} in {context} - "
+                f"must be one of {', '.join(self.strategies)}"
+            )
+        self.palette = bool(cfg.get("palette", True))
+
+    def save_kwargs(self) -> MutableMapping[str, Any]:
+        """
+        :return: Keyword arguments for Pillow's PNG writer.
+        """
+        return {
+            "compress_level": self.compression_level,
+            "compress_type": self.strategies[self.strategy],
+        }
+
+    def encode(self, rgba: numpy.ndarray, palette: Optional[Iterable[RGBA]] = None) -> bytes:
+        """
+        Encode an image as a PNG.
+
+        :param rgba: A (height, width, 4) uint8 RGBA image array
+        :param palette: The colours the image is known to be drawn from (e.g. from the style), if any.
+                    If supplied, palette encoding is enabled and the colours (plus transparent) fit in 256
+                    entries, the image is written as an indexed-colour PNG.
+        :return: The encoded PNG
+        """
+        im = None
+        if self.palette and palette is not None:
+            im = palette_image(rgba, palette)
+        if im is None:
+            im = Image.fromarray(rgba, "RGBA")
+        img_io = BytesIO()
+        im.save(img_io, "PNG", **self.save_kwargs())
+        return img_io.getvalue()
+
+
+def pack_rgba(rgba: numpy.ndarray) -> numpy.ndarray:
+    """
+    Pack the trailing RGBA axis of a uint8 array into uint32 values.
+    """
+    return numpy.ascontiguousarray(rgba, dtype="uint8").view("uint32")[..., 0]
+
+
+def palette_image(rgba: numpy.ndarray, palette: Iterable[RGBA]) -> Optional[Image.Image]:
+    """
+    Convert an RGBA image to an indexed-colour Pillow image.
+
+    All fully transparent pixels are treated as a single transparent colour.
+
+    :param rgba: A (height, width, 4) uint8 RGBA image array
+    :param palette: The colours the image is expected to be drawn from.
+    :return: A mode "P" Pillow image, or None if the palette is too large or the image contains pixels
+            that are not in the palette.
+    """
+    colours = numpy.array(
+        [c if c[3] else (0, 0, 0, 0) for c in palette] + [(0, 0, 0, 0)],
+        dtype="uint8"
+    )
+    packed_palette = numpy.unique(pack_rgba(colours))
+    if len(packed_palette) > 256:
+        return None
+    packed = pack_rgba(rgba)
+    packed = numpy.where(rgba[..., 3] == 0, numpy.uint32(0), packed)
+    idx = numpy.searchsorted(packed_palette, packed)
+    numpy.clip(idx, 0, len(packed_palette) - 1, out=idx)
+    if not numpy.array_equal(packed_palette[idx], packed):
+        _LOG.debug("Image contains colours outside the style palette - writing RGBA PNG")
+        return None
+    entries = packed_palette.view("uint8").reshape(-1, 4)
+    im = Image.fromarray(idx.astype("uint8"), "P")
+    im.putpalette(entries[:, :3].tobytes(), rawmode="RGB")
+    im.info["transparency"] = entries[:, 3].tobytes()
+    return im
+
+
+def encode_indexed(idx: numpy.ndarray, colours: Iterable[RGBA]) -> bytes:
+    """
+    Encode a palette index array as an indexed-colour PNG.
+
+    :param idx: A (height, width) uint8 array of indexes into colours
+    :param colours: The RGBA palette
+    :return: The encoded PNG
+    """
+    entries = numpy.array(list(colours), dtype="uint8")
+    im = Image.fromarray(idx, "P")
+    im.putpalette(entries[:, :3].tobytes(), rawmode="RGB")
+    img_io = BytesIO()
+    im.save(img_io, "PNG", transparency=entries[:, 3].tobytes())
+    return img_io.getvalue()
+
+
+@lru_cache(maxsize=64)
+def solid_png(width: int, height: int, colour: RGBA = (0, 0, 0, 0)) -> bytes:
+    """
+    A PNG of a single solid colour.  Cached per size and colour.
+
+    :param width: Image width
+    :param height: Image height
+    :param colour: RGBA fill colour.  Defaults to fully transparent.
+    :return: The encoded PNG
+    """
+    return encode_indexed(numpy.zeros((height, width), dtype="uint8"), [colour])
+
+
+def empty_png(width: int, height: int) -> bytes:
+    """
+    A fully transparent PNG.  Cached per size.
+    """
+    return solid_png(width, height)
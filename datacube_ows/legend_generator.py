@@ -8,7 +8,6 @@ from __future__ import absolute_import
 import io
 import logging
 
-import matplotlib
 import numpy as np
 # from flask import make_response
 from PIL import Image
@@ -17,10 +16,6 @@ from datacube_ows.ogc_exceptions import WMSException
 from datacube_ows.ogc_utils import resp_headers
 from datacube_ows.wms_utils import GetLegendGraphicParameters
 
-# Do not use X Server backend
-
-matplotlib.use('Agg')
-
 _LOG = logging.getLogger(__name__)
 
 
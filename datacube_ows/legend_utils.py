@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0
 import io
 import logging
+from functools import lru_cache
 from typing import Optional
 
 import requests
@@ -15,6 +16,34 @@ from datacube_ows.ogc_exceptions import WMSException
 _LOG = logging.getLogger(__name__)
 
 
+# Matplotlib is slow to import, and only needed for rendering legends and reading Matplotlib colour ramps,
+# so it is only imported on first use.
+
+@lru_cache()
+def pyplot():
+    """
+    Import matplotlib.pyplot, using the non-interactive Agg backend (i.e. no X server).
+
+    :return: The matplotlib.pyplot module
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    return plt
+
+
+def get_mpl_cmap(name: str) -> "matplotlib.colors.Colormap":
+    """
+    Look up a named Matplotlib colour map, without importing matplotlib.pyplot.
+
+    :param name: The name of the Matplotlib colour map
+    :return: The colour map
+    :raises: KeyError if there is no colour map of that name.
+    """
+    import matplotlib
+    return matplotlib.colormaps[name]
+
+
 def get_image_from_url(url: str) -> Optional[Image.Image]:
     """
     Fetch image a png from external URL, and return it as an Image.
@@ -5,13 +5,20 @@
 # SPDX-License-Identifier: Apache-2.0
 import datetime
 import json
+import threading
+from collections import OrderedDict
 from enum import Enum
-from typing import Any, Iterable, Optional, Tuple, Union, cast
+from functools import lru_cache
+from time import monotonic
+from typing import (Any, Iterable, Iterator, List, MutableMapping, Optional,
+                    Sequence, Tuple, Union, cast)
 
 from datacube.utils.geometry import Geometry as ODCGeom
 from geoalchemy2 import Geometry
 from psycopg2.extras import DateTimeTZRange
-from sqlalchemy import SMALLINT, Column, MetaData, Table, or_, select, text
+from sqlalchemy import (SMALLINT, Column, Float, Integer, MetaData, Table,
+                        bindparam, func, literal, literal_column, or_, select,
+                        text, union_all)
 from sqlalchemy.dialects.postgresql import TSTZRANGE, UUID
 from sqlalchemy.sql.functions import count
 
@@ -40,7 +47,7 @@ class MVSelectOpts(Enum):
     IDS: return list of database_ids only.
     DATASETS: return list of ODC dataset objects
     COUNT: return a count of matching datasets
-    EXTENT: return full extent of query result as a Geometry
+    EXTENT: return full extent of query result as a Geometry (clipped to the search geometry, in its CRS)
     """
     ALL = 0
     IDS = 1
@@ -61,11 +68,281 @@ class MVSelectOpts(Enum):
         assert False
 
 
+def _search_filters(stv: Table,
+                    n_times: int,
+                    has_geom: bool,
+                    prefix: str = "") -> List["sqlalchemy.sql.elements.ClauseElement"]:
+    """
+    Build search filters with bound parameters.  Parameter values are supplied by _search_params().
+
+    :param stv: The space_time_view table
+    :param n_times: Number of time ranges to filter by (0 for no time filter)
+    :param has_geom: Whether to filter by geometry
+    :param prefix: Prefix for the product and time parameter names (for combining several searches in one statement)
+    """
+    filters = [stv.c.dataset_type_ref.in_(bindparam(f"{prefix}prod_ids", expanding=True))]
+    if n_times:
+        filters.append(
+            or_(
+                *[
+                    stv.c.temporal_extent.op("&&")(bindparam(f"{prefix}time_{i}", type_=TSTZRANGE))
+                    for i in range(n_times)
+                ]
+            )
+        )
+    if has_geom:
+        # Cheap index-only bounding box test first, then the exact intersection test.
+        filters.append(
+            stv.c.spatial_extent.op("&&")(
+                func.ST_MakeEnvelope(
+                    *[bindparam(f"bbox_{coord}", type_=Float) for coord in ("left", "bottom", "right", "top")],
+                    literal_column("4326")
+                )
+            )
+        )
+        filters.append(func.ST_Intersects(_spatial_extent(stv), _geom_param(stv)))
+    return filters
+
+
+def _spatial_extent(stv: Table) -> "sqlalchemy.sql.elements.ClauseElement":
+    """
+    The spatial extent column, as EPSG:4326.
+
+    Views created before OWS set the SRID of the extent polygons may have extents with SRID 0, which
+    PostGIS refuses to compare with (or transform from) EPSG:4326.  The index-only && test does not
+    check SRIDs, so it is applied to the raw column.
+    """
+    return func.ST_SetSRID(stv.c.spatial_extent, literal_column("4326"))
+
+
+def _geom_param(stv: Table) -> "sqlalchemy.sql.elements.ClauseElement":
+    return func.ST_SetSRID(bindparam("geom", type_=stv.c.spatial_extent.type), literal_column("4326"))
+
+
+def _geom_params(geom: ODCGeom) -> MutableMapping[str, Any]:
+    """
+    Search parameters for a geometry filter.
+
+    :param geom: The search geometry, in EPSG:4326
+    """
+    bbox = geom.boundingbox
+    return {
+        "geom": json.dumps(geom.json),
+        "bbox_left": bbox.left,
+        "bbox_bottom": bbox.bottom,
+        "bbox_right": bbox.right,
+        "bbox_top": bbox.top,
+    }
+
+
+def _extent_column(stv: Table, has_geom: bool,
+                   transform: bool, simplify: bool) -> "sqlalchemy.sql.elements.ClauseElement":
+    """
+    Select column for an EXTENT search, clipped to the search geometry, reprojected and simplified in the database.
+
+    :param has_geom: Clip to the search geometry
+    :param transform: Reproject to the SRID in the "srid" parameter
+    :param simplify: Simplify with the tolerance in the "tolerance" parameter (in the units of the output CRS)
+    """
+    extent = func.ST_Union(_spatial_extent(stv))
+    if has_geom:
+        # Polygonal part of the intersection only - an empty MultiPolygon if there is none.
+        extent = func.ST_CollectionExtract(func.ST_Intersection(extent, _geom_param(stv)), literal_column("3"))
+    if transform:
+        extent = func.ST_Transform(extent, bindparam("srid", type_=Integer))
+    if simplify:
+        extent = func.ST_SimplifyPreserveTopology(extent, bindparam("tolerance", type_=Float))
+    return func.ST_AsGeoJSON(extent)
+
+
+def _search_params(products: Optional[Iterable["datacube.model.DatasetType"]],
+                   times: Optional[Sequence[Tuple[datetime.datetime, datetime.datetime]]],
+                   prefix: str = "") -> MutableMapping[str, Any]:
+    if products is None:
+        raise Exception("Must filter by product/layer")
+    params: MutableMapping[str, Any] = {f"{prefix}prod_ids": [p.id for p in products]}
+    for i, t in enumerate(times or []):
+        params[f"{prefix}time_{i}"] = DateTimeTZRange(*t)
+    return params
+
+
+@lru_cache(maxsize=256)
+def _search_statement(sel: MVSelectOpts, n_times: int, has_geom: bool,
+                      transform: bool = False, simplify: bool = False) -> "sqlalchemy.sql.Select":
+    """
+    The (cached) select statement for a search.  Statements only vary by selection mode, number of time ranges,
+    whether there is a geometry filter and (for EXTENT searches) whether the extent is reprojected and
+    simplified - everything else is a bound parameter.
+    """
+    if sel == MVSelectOpts.EXTENT:
+        columns = [_extent_column(st_view, has_geom, transform, simplify)]
+    else:
+        columns = sel.sel(st_view)
+    return select(columns).where(*_search_filters(st_view, n_times, has_geom))
+
+
+@lru_cache(maxsize=256)
+def _grouped_search_statement(query_n_times: Tuple[int, ...], has_geom: bool,
+                              query_limited: Optional[Tuple[bool, ...]] = None) -> "sqlalchemy.sql.Select":
+    """
+    The (cached) select statement for a grouped search.
+
+    :param query_n_times: The number of time ranges for each query in the group
+    :param query_limited: Whether each query in the group has a limit (in the "q<n>_limit" parameter).
+                Queries without a limit only return results if all limited queries are within their limits.
+    """
+    stv = st_view
+    limited = {}
+    for i, n_times in enumerate(query_n_times):
+        if query_limited and query_limited[i]:
+            limited[i] = select(
+                [literal(i).label("qry"), stv.c.id]
+            ).where(
+                *_search_filters(stv, n_times, has_geom, f"q{i}_")
+            ).limit(bindparam(f"q{i}_limit", type_=Integer)).cte(f"q{i}")
+    within_limits = [
+        select([count()]).select_from(cte).scalar_subquery() < bindparam(f"q{i}_limit", type_=Integer)
+        for i, cte in limited.items()
+    ]
+    selects = []
+    for i, n_times in enumerate(query_n_times):
+        if i in limited:
+            sel = select([limited[i].c.qry, limited[i].c.id])
+        else:
+            sel = select([literal(i).label("qry"), stv.c.id]).where(
+                *_search_filters(stv, n_times, has_geom, f"q{i}_"), *within_limits
+            )
+        selects.append(sel)
+    if len(selects) == 1:
+        return selects[0]
+    return union_all(*selects)
+
+
+def _geom_4326(geom: Optional[ODCGeom]) -> Optional[ODCGeom]:
+    if geom is not None and str(geom.crs) != "EPSG:4326":
+        geom = geom.to_crs("EPSG:4326")
+    return geom
+
+
+SEARCH_KEY = Tuple[str, Tuple[int, ...], Optional[Tuple[Tuple[str, str], ...]], Optional[str]]
+
+
+class SearchCache:
+    """
+    In-process TTL/LRU cache of small (IDS and COUNT) space_time_view search results.
+
+    Disabled (ttl of zero) until configured - see OWSConfig.parse_data_loading.
+    """
+    # Decimal places geometry coordinates (in degrees) are rounded to for cache keys.
+    geom_precision = 9
+
+    def __init__(self, ttl: float = 0, max_entries: int = 10000) -> None:
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[SEARCH_KEY, Tuple[float, Any]]" = OrderedDict()
+        self.configure(ttl, max_entries)
+
+    def configure(self, ttl: float, max_entries: int) -> None:
+        """
+        :param ttl: Maximum age of cached results in seconds.  Zero disables the cache.
+        :param max_entries: Maximum number of cached results.  Least recently used results are evicted first.
+        """
+        with self._lock:
+            self.ttl = ttl
+            self.max_entries = max_entries
+            self._entries.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @classmethod
+    def key(cls, sel: MVSelectOpts,
+            products: Optional[Iterable["datacube.model.DatasetType"]],
+            times: Optional[Sequence[Tuple[datetime.datetime, datetime.datetime]]],
+            geom: Optional[ODCGeom]) -> SEARCH_KEY:
+        """
+        Cache key for a search.
+
+        :param geom: Search geometry, in EPSG:4326.
+        """
+        if products is None:
+            raise Exception("Must filter by product/layer")
+        prod_ids = tuple(sorted(set(p.id for p in products)))
+        norm_times = None
+        if times:
+            norm_times = tuple(sorted(set((cls._norm_time(t[0]), cls._norm_time(t[1])) for t in times)))
+        geom_key = None
+        if geom is not None:
+            geom_key = json.dumps(cls._round_coords(geom.json), sort_keys=True)
+        return (sel.name, prod_ids, norm_times, geom_key)
+
+    @staticmethod
+    def _norm_time(t: datetime.datetime) -> str:
+        if t.tzinfo is not None:
+            t = t.astimezone(datetime.timezone.utc)
+        return t.isoformat()
+
+    @classmethod
+    def _round_coords(cls, obj: Any) -> Any:
+        if isinstance(obj, float):
+            return round(obj, cls.geom_precision)
+        if isinstance(obj, (list, tuple)):
+            return [cls._round_coords(o) for o in obj]
+        if isinstance(obj, dict):
+            return {k: cls._round_coords(v) for k, v in obj.items()}
+        return obj
+
+    def get(self, key: SEARCH_KEY) -> Optional[Any]:
+        """
+        :return: The cached result, or None if not cached (or expired).
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: SEARCH_KEY, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, product_ids: Optional[Iterable[int]] = None) -> None:
+        """
+        Discard cached results.
+
+        :param product_ids: Only discard results for searches including these ODC product ids.
+                    Default: discard all results.
+        """
+        with self._lock:
+            if product_ids is None:
+                self._entries.clear()
+                return
+            stale = set(product_ids)
+            for key in [k for k in self._entries if stale.intersection(k[1])]:
+                del self._entries[key]
+
+
+search_cache = SearchCache()
+
+
 def mv_search(index: "datacube.index.Index",
               sel: MVSelectOpts = MVSelectOpts.IDS,
-              times: Optional[Iterable[Tuple[datetime.datetime, datetime.datetime]]] = None,
+              times: Optional[Sequence[Tuple[datetime.datetime, datetime.datetime]]] = None,
               geom: Optional[ODCGeom] = None,
-              products: Optional[Iterable["datacube.model.DatasetType"]] = None) -> Union[
+              products: Optional[Iterable["datacube.model.DatasetType"]] = None,
+              stream: bool = False,
+              simplify: Optional[float] = None) -> Union[
         Iterable[Iterable[Any]],
         Iterable[str],
         Iterable["datacube.model.Dataset"],
@@ -81,56 +358,164 @@ def mv_search(index: "datacube.index.Index",
     :param sel: Selection mode - a MVSelectOpts enum. Defaults to IDS.
     :param times: A list of pairs of datetimes (with time zone)
     :param geom: A datacube.utils.geometry.Geometry object
+    :param stream: If true, ALL, IDS and DATASETS results are returned as a generator reading from a server-side
+                cursor.  The database connection is held until the generator is exhausted or closed.
+    :param simplify: For EXTENT searches, simplify the returned extent with this tolerance, in the units of the
+                CRS of geom.
 
     :return: See MVSelectOpts doc
     """
-    engine = get_sqlalc_engine(index)
-    stv = st_view
-    if products is None:
-        raise Exception("Must filter by product/layer")
-    prod_ids = [p.id for p in products]
-
-    s = select(sel.sel(stv)).where(stv.c.dataset_type_ref.in_(prod_ids))
+    if products is not None:
+        products = list(products)
     if times is not None:
-        s = s.where(
-            or_(
-                *[
-                    stv.c.temporal_extent.op("&&")(DateTimeTZRange(*t))
-                    for t in times
-                ]
-            )
-        )
+        times = list(times)
     orig_crs = None
     if geom is not None:
         orig_crs = geom.crs
-        if str(geom.crs) != "EPSG:4326":
-            geom = geom.to_crs("EPSG:4326")
-        geom_js = json.dumps(geom.json)
-        s = s.where(stv.c.spatial_extent.intersects(geom_js))
-    # print(s) # Print SQL Statement
-    conn = engine.connect()
-    if sel == MVSelectOpts.ALL:
-        return conn.execute(s)
+        geom = _geom_4326(geom)
+    cache_key = None
+    if not stream and sel in (MVSelectOpts.IDS, MVSelectOpts.COUNT) and search_cache.enabled:
+        cache_key = search_cache.key(sel, products, times, geom)
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return list(cached) if sel == MVSelectOpts.IDS else cached
+    params = _search_params(products, times)
+    if geom is not None:
+        params.update(_geom_params(geom))
+    # EXTENT searches are clipped, reprojected and simplified in the database where possible.
+    sql_transform = False
+    sql_simplify = False
+    if sel == MVSelectOpts.EXTENT and geom is not None and orig_crs.epsg is not None:
+        if orig_crs.epsg != 4326:
+            sql_transform = True
+            params["srid"] = orig_crs.epsg
+        if simplify:
+            sql_simplify = True
+            params["tolerance"] = simplify
+    s = _search_statement(sel, len(times) if times else 0, geom is not None, sql_transform, sql_simplify)
+    if stream and sel in (MVSelectOpts.ALL, MVSelectOpts.IDS, MVSelectOpts.DATASETS):
+        return _stream_search(index, sel, s, params)
+    with get_sqlalc_engine(index).connect() as conn:
+        if sel == MVSelectOpts.ALL:
+            return conn.execute(s, params).fetchall()
+        if sel in (MVSelectOpts.IDS, MVSelectOpts.DATASETS):
+            result = [r[0] for r in conn.execute(s, params)]
+        else:
+            result = conn.execute(s, params).scalar()
+    # Connection released before any further queries.
     if sel == MVSelectOpts.IDS:
-        return [r[0] for r in conn.execute(s)]
-    if sel in (MVSelectOpts.COUNT, MVSelectOpts.EXTENT):
-        for r in conn.execute(s):
-            if sel == MVSelectOpts.COUNT:
-                return r[0]
-            if sel == MVSelectOpts.EXTENT:
-                geojson = r[0]
-                if geojson is None:
-                    return None
-                uniongeom = ODCGeom(json.loads(geojson), crs="EPSG:4326")
-                if geom:
-                    intersect = uniongeom.intersection(geom)
-                    if intersect.wkt == 'POLYGON EMPTY':
-                        return None
-                    if orig_crs and orig_crs != "EPSG:4326":
-                        intersect = intersect.to_crs(orig_crs)
-                else:
-                    intersect = uniongeom
-                return intersect
+        if cache_key is not None:
+            search_cache.put(cache_key, tuple(result))
+        return result
     if sel == MVSelectOpts.DATASETS:
-        ids = [r[0] for r in conn.execute(s)]
-        return index.datasets.bulk_get(ids)
+        return index.datasets.bulk_get(result)
+    if sel == MVSelectOpts.COUNT:
+        if cache_key is not None:
+            search_cache.put(cache_key, result)
+        return result
+    if sel == MVSelectOpts.EXTENT:
+        geojson = result
+        if geojson is None:
+            return None
+        if geom is None:
+            return ODCGeom(json.loads(geojson), crs="EPSG:4326")
+        if sql_transform:
+            extent = ODCGeom(json.loads(geojson), crs=orig_crs)
+        else:
+            extent = ODCGeom(json.loads(geojson), crs="EPSG:4326")
+        if extent.is_empty:
+            return None
+        if orig_crs.epsg is None:
+            # CRS has no EPSG code - cannot be reprojected by PostGIS.
+            extent = extent.to_crs(orig_crs)
+            if simplify:
+                extent = extent.simplify(simplify)
+        return extent
+    assert False
+
+
+# Number of rows fetched per round-trip when streaming search results.
+STREAM_BATCH_SIZE = 1000
+
+
+def _stream_search(index: "datacube.index.Index",
+                   sel: MVSelectOpts,
+                   s: "sqlalchemy.sql.Select",
+                   params: MutableMapping[str, Any]) -> Iterator[Any]:
+    with get_sqlalc_engine(index).connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=STREAM_BATCH_SIZE).execute(s, params)
+        while True:
+            rows = result.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            if sel == MVSelectOpts.ALL:
+                yield from rows
+            elif sel == MVSelectOpts.IDS:
+                yield from (r[0] for r in rows)
+            else:
+                yield from index.datasets.bulk_get([r[0] for r in rows])
+
+
+def mv_search_grouped(index: "datacube.index.Index",
+                      queries: Sequence[Tuple[
+                          Iterable["datacube.model.DatasetType"],
+                          Optional[Iterable[Tuple[datetime.datetime, datetime.datetime]]]
+                      ]],
+                      geom: Optional[ODCGeom] = None,
+                      limits: Optional[Sequence[Optional[int]]] = None) -> List[List[str]]:
+    """
+    Perform several dataset id queries via the space_time_view in a single database round-trip.
+
+    The dataset count for each query is the length of the corresponding id list.
+
+    :param index: A datacube index (required)
+    :param queries: A sequence of (products, times) pairs - see mv_search for details.
+    :param geom: A datacube.utils.geometry.Geometry object, applied to all queries.
+    :param limits: Optional maximum number of ids to return for each query (None for no limit).
+                A query that returns exactly its limit may have more matching datasets.  If any query
+                reaches its limit, queries without a limit are skipped and return no ids.
+
+    :return: A list of dataset id lists, one per query and in the same order as the queries.
+    """
+    results: List[List[str]] = [[] for _ in queries]
+    if not queries:
+        return results
+    geom = _geom_4326(geom)
+    queries = [
+        (list(products) if products is not None else None, list(times) if times is not None else None)
+        for products, times in queries
+    ]
+    # Only query for results not already in the search cache
+    to_query = []
+    cache_keys = []
+    for i, (products, times) in enumerate(queries):
+        if search_cache.enabled:
+            cache_key = search_cache.key(MVSelectOpts.IDS, products, times, geom)
+            cached = search_cache.get(cache_key)
+            if cached is not None:
+                results[i] = list(cached)
+                continue
+            cache_keys.append(cache_key)
+        to_query.append(i)
+    if not to_query:
+        return results
+    query_n_times = tuple(len(queries[i][1] or []) for i in to_query)
+    query_limits = [limits[i] if limits else None for i in to_query]
+    s = _grouped_search_statement(query_n_times, geom is not None, tuple(lim is not None for lim in query_limits))
+    params: MutableMapping[str, Any] = {}
+    for qry, i in enumerate(to_query):
+        products, times = queries[i]
+        params.update(_search_params(products, times, f"q{qry}_"))
+        if query_limits[qry] is not None:
+            params[f"q{qry}_limit"] = query_limits[qry]
+    if geom is not None:
+        params.update(_geom_params(geom))
+    with get_sqlalc_engine(index).connect() as conn:
+        for qry, ds_id in conn.execute(s, params):
+            results[to_query[qry]].append(ds_id)
+    limit_reached = any(limit is not None and len(results[i]) >= limit for i, limit in zip(to_query, query_limits))
+    for cache_key, i, limit in zip(cache_keys, to_query, query_limits):
+        # Results cut off by their limit, or skipped because a limit was reached, are incomplete
+        if (limit is None and not limit_reached) or (limit is not None and len(results[i]) < limit):
+            search_cache.put(cache_key, tuple(results[i]))
+    return results
@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0
 import datetime
 import logging
+from functools import partial
 from importlib import import_module
 from io import BytesIO
 from itertools import chain
@@ -277,6 +278,7 @@ def capture_headers(req: "flask.Request",
     args_dict['requestid'] = req.environ.get("FLASK_REQUEST_ID")
     args_dict['host'] = req.headers.get('Host', None)
     args_dict['url_root'] = req.url_root
+    args_dict['if-none-match'] = req.headers.get('If-None-Match', None)
 
     return args_dict
 
@@ -290,6 +292,11 @@ class ConfigException(Exception):
 # Function wrapper for configurable functional elements
 
 
+def _map_style_band(b_idx, delocaliser, band):
+    # A module-level function (rather than a lambda) so function wrappers can be pickled.
+    return b_idx.band(delocaliser(band))
+
+
 class FunctionWrapper:
     """
     Function wrapper for configurable functional elements
@@ -346,7 +353,7 @@ class FunctionWrapper:
                     style = cast("datacube_ows.styles.StyleDef", product_or_style_cfg)
                     b_idx = style.product.band_idx
                     delocaliser = style.local_band
-                    self.band_mapper = lambda b: b_idx.band(delocaliser(b))
+                    self.band_mapper = partial(_map_style_band, b_idx, delocaliser)
             else:
                 self.band_mapper = None
 
@@ -516,7 +523,7 @@ def create_geobox(
     return geometry.GeoBox(width, height, affine, crs)
 
 
-def xarray_image_as_png(img_data, loop_over=None, animate=False, frame_duration=1000):
+def xarray_image_as_png(img_data, loop_over=None, animate=False, frame_duration=1000, png_encoding=None, palette=None):
     """
     Render an Xarray image as a PNG.
 
@@ -524,11 +531,13 @@ def xarray_image_as_png(img_data, loop_over=None, animate=False, frame_duration=
     :param loop_over: Optional name of a dimension on img_data.  If set, xarray_image_as_png is called in a loop
                 over all coordinate values for the named dimension.
     :param animate: Optional generate animated PNG
+    :param png_encoding: Optional PNG encoding options (a datacube_ows.image_encoding.PNGEncoding)
+    :param palette: Optional list of the RGBA colours the image is drawn from, allowing indexed-colour output
     :return: A list of bytes representing a PNG image file. (Or a list of lists of bytes, if loop_over was set.)
     """
     if loop_over and not animate:
         return [
-            xarray_image_as_png(img_data.sel(**{loop_over: coord}))
+            xarray_image_as_png(img_data.sel(**{loop_over: coord}), png_encoding=png_encoding, palette=palette)
             for coord in img_data.coords[loop_over].values
         ]
     xcoord = None
@@ -558,7 +567,9 @@ def xarray_image_as_png(img_data, loop_over=None, animate=False, frame_duration=
         for t_slice in time_slices_array:
             im = Image.fromarray(t_slice, "RGBA")
             images.append(im)
-        images[0].save(img_io, "PNG", save_all=True, default_image=True, loop=0, duration=frame_duration, append_images=images)
+        save_kwargs = png_encoding.save_kwargs() if png_encoding is not None else {}
+        images[0].save(img_io, "PNG", save_all=True, default_image=True, loop=0, duration=frame_duration,
+                       append_images=images, **save_kwargs)
         img_io.seek(0)
         return img_io.read()
 
@@ -569,6 +580,9 @@ def xarray_image_as_png(img_data, loop_over=None, animate=False, frame_duration=
     if not loop_over and animate:
         return pillow_data
    
+    if png_encoding is not None:
+        return png_encoding.encode(pillow_data, palette)
+
     # Change PNG rendering to Pillow
     im_final = Image.fromarray(pillow_data, "RGBA")
     im_final.save(img_io, "PNG")
@@ -1420,6 +1420,35 @@ ows_cfg = {
             "wmts": True,
             "wcs": True
         },
+        # Make layers ready on first use, rather than at startup.  Optional - defaults to False.
+        "lazy_layers": False,
+        # Layers always made ready at startup, even with lazy_layers.  Optional - defaults to none.
+        "warm_layers": [],
+        # Controls how raster data is loaded.
+        # Optional - all entries default as shown.
+        "data_loading": {
+            # Maximum number of threads (per worker process) for loading the flag products of a request
+            # concurrently with the main product.  1 means load one after the other.
+            "query_threads": 4,
+            # Maximum number of threads (per worker process) for reading datasets concurrently
+            # for layers using manual merge (e.g. solar corrected layers).  1 means read one after the other.
+            "manual_merge_threads": 4,
+            # Read dataset search results from a server-side cursor in batches.  Defaults to False.
+            "stream_dataset_queries": False,
+            # Maximum age in seconds of cached dataset id/count search results. 0 disables caching.
+            "search_cache_ttl": 60,
+            # Maximum number of cached search results (per worker process).
+            "search_cache_max_entries": 10000,
+        },
+        # Controls how the ranges of dynamic layers are refreshed.
+        # Optional - all entries default as shown.
+        "dynamic_ranges": {
+            # Seconds between background refreshes of dynamic layer ranges (per worker process).
+            # 0 means re-read the ranges from the database every time they are used.
+            "refresh_interval": 30,
+            # Also refresh as soon as datacube-ows-update sends a notification.
+            "listen": False,
+        },
         # Service title - appears e.g. in Terria catalog (required)
         "title": "Open web-services for the Open Data Cube",
         # Service URL.
@@ -1540,7 +1569,17 @@ ows_cfg = {
             # The authorities dictionary maps names to authority urls.
             "auth": "https://authoritative-authority.com",
             "idsrus": "https://www.identifiers-r-us.com",
-        }
+        },
+        # PNG encoding options for GetMap/GetTile responses.  May be overridden per layer.
+        # Optional - all entries default as shown.
+        "png_encoding": {
+            # zlib compression level (0-9)
+            "compression_level": 6,
+            # zlib strategy: one of "default", "filtered", "huffman_only", "rle", "fixed"
+            "strategy": "default",
+            # Write indexed-colour PNGs for styles with a palette of up to 256 colours (e.g. value_map styles)
+            "palette": True,
+        },
     }, ####  End of "wms" section.
 
     # Config items in the "wmts" section apply to the WMTS service only.
@@ -1593,7 +1632,20 @@ ows_cfg = {
                 # So tiles side by side (2x1) (then 4x2, 8x4, 16x8, etc.)
                 "matrix_exponent_initial_offsets": (1, 0),
             },
-        }
+        },
+        # Persistent cache of rendered GetTile responses, shared between worker processes.
+        # Optional - defaults to no tile caching.
+        # Cached tiles for a layer are discarded whenever datacube-ows-update updates the ranges for that layer.
+        # "tile_cache": {
+        #     # "filesystem" (one file per tile) or "sqlite" (a single database file).  Defaults to "filesystem"
+        #     "backend": "filesystem",
+        #     # Directory (filesystem backend) or database file (sqlite backend).  Required.
+        #     "path": "/var/cache/datacube-ows/tiles",
+        #     # Least-recently-used tiles are evicted when the cache exceeds this size. Defaults to 1024MB.
+        #     "max_size_mb": 1024,
+        #     # Optional limit on number of cached tiles. Defaults to no limit.
+        #     "max_entries": 1000000,
+        # },
     },
 
     # Config items in the "wcs" section apply to the WCS service to all WCS coverages
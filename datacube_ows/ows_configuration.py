@@ -16,6 +16,7 @@ import json
 import logging
 import math
 import os
+import threading
 from collections.abc import Mapping
 from importlib import import_module
 from typing import Optional
@@ -27,25 +28,40 @@ from datacube.utils import geometry
 from ows import Version
 from slugify import slugify
 
+from datacube_ows.capabilities_cache import (capabilities_cache,
+                                             description_cache)
 from datacube_ows.config_utils import (FlagProductBands, OWSConfigEntry,
                                        OWSEntryNotFound,
                                        OWSExtensibleConfigEntry, OWSFlagBand,
                                        OWSMetadataConfig, cfg_expand,
                                        get_file_loc, import_python_obj,
                                        load_json_obj)
-from datacube_ows.cube_pool import ODCInitException, cube, get_cube
+from datacube_ows.cube_pool import ODCInitException, cube
+from datacube_ows.image_encoding import PNGEncoding
+from datacube_ows.mv_index import search_cache
 from datacube_ows.ogc_utils import (ConfigException, FunctionWrapper,
                                     create_geobox, day_summary_date_range,
                                     local_solar_date_range, month_date_range,
                                     year_date_range)
+from datacube_ows.range_refresher import range_refresher
 from datacube_ows.resource_limits import (OWSResourceManagementRules,
                                           parse_cache_age)
 from datacube_ows.styles import StyleDef
+from datacube_ows.tile_cache import TileCache
 from datacube_ows.tile_matrix_sets import TileMatrixSet
 from datacube_ows.utils import group_by_statistical
 
 _LOG = logging.getLogger(__name__)
 
+# Serialise on-demand readying of each lazy layer, by layer name.
+_lazy_ready_locks = {}
+_lazy_ready_locks_lock = threading.Lock()
+
+
+def _lazy_ready_lock(name):
+    with _lazy_ready_locks_lock:
+        return _lazy_ready_locks.setdefault(name, threading.Lock())
+
 
 def read_config(path=None):
     cwd = None
@@ -286,6 +302,10 @@ class OWSFolder(OWSLayer):
     def make_ready(self, dc, *args, **kwargs):
         still_unready = []
         for lyr in self.unready_layers:
+            if lyr.named and self.global_cfg.defer_layer(lyr.name):
+                lyr.defer_ready()
+                self.child_layers.append(lyr)
+                continue
             try:
                 lyr.make_ready(dc, *args, **kwargs)
                 self.child_layers.append(lyr)
@@ -319,6 +339,10 @@ class OWSNamedLayer(OWSExtensibleConfigEntry, OWSLayer):
         self.name = name
         cfg = self._raw_cfg
         self.hide = False
+        # True while make_ready is deferred until first use.
+        self.lazy = False
+        # The id of the thread making a lazy layer ready.
+        self._readying_thread = None
         try:
             self.parse_product_names(cfg)
             if len(self.low_res_product_names) not in (0, len(self.product_names)):
@@ -397,6 +421,7 @@ class OWSNamedLayer(OWSExtensibleConfigEntry, OWSLayer):
         self.declare_unready("resolution_x")
         self.declare_unready("resolution_y")
         self.resource_limits = OWSResourceManagementRules(self.global_cfg, cfg.get("resource_limits", {}), f"Layer {self.name}")
+        self.png_encoding = PNGEncoding(cfg.get("png_encoding", {}), self.global_cfg.png_encoding, f"Layer {self.name}")
         try:
             self.parse_flags(cfg.get("flags", {}))
             self.declare_unready("all_flag_band_names")
@@ -443,6 +468,50 @@ class OWSNamedLayer(OWSExtensibleConfigEntry, OWSLayer):
             return f"{start.isoformat()}/{end.isoformat()}/P{self.time_axis_interval}D"
         return ""
 
+    def defer_ready(self):
+        """
+        Defer make_ready until the layer is first used.
+
+        The layer is made ready (with a Datacube object from the pool) the first time an attribute that
+        requires the database is accessed.  Whether the layer is ready or hidden is not known until then,
+        so "ready" and "hide" are also treated as unready attributes.
+        """
+        self.lazy = True
+        self.declare_unready("hide")
+        self.declare_unready("ready")
+
+    def ready_on_demand(self):
+        if not self.__dict__.get("lazy"):
+            return False
+        if self._readying_thread == threading.get_ident():
+            # Attributes accessed by make_ready itself before they are initialised.
+            return True
+        # The cube is checked out before taking the layer's lock, so that a thread waiting for the lock
+        # never holds up a thread that is waiting for a cube.  Database errors propagate, leaving the
+        # layer to be readied on its next use.
+        with cube() as dc:
+            with _lazy_ready_lock(self.name):
+                # Another thread may have readied the layer while this one was waiting.
+                if self.lazy:
+                    self._readying_thread = threading.get_ident()
+                    try:
+                        self.ready = False
+                        self.hide = False
+                        self.make_ready(dc)
+                    except ConfigException as e:
+                        _LOG.error("Could not load layer %s: %s", self.name, str(e))
+                        self.hide = True
+                        if self.parent_layer and self in self.parent_layer.child_layers:
+                            self.parent_layer.child_layers.remove(self)
+                            self.parent_layer.unready_layers.append(self)
+                        self.lazy = False
+                        capabilities_cache.invalidate()
+                    else:
+                        self.lazy = False
+                    finally:
+                        self._readying_thread = None
+        return True
+
     # pylint: disable=attribute-defined-outside-init
     def make_ready(self, dc, *args, **kwargs):
         self.products = []
@@ -750,39 +819,72 @@ class OWSNamedLayer(OWSExtensibleConfigEntry, OWSLayer):
         raise NotImplementedError()
 
     def force_range_update(self, ext_dc=None):
-        if ext_dc:
-            dc = ext_dc
-        else:
-            dc = get_cube()
-        self.hide = False
-        self._ranges = None
         try:
             from datacube_ows.product_ranges import get_ranges
-            self._ranges = get_ranges(dc, self)
-            if self._ranges is None:
+            if ext_dc:
+                ranges = get_ranges(ext_dc, self)
+            else:
+                with cube() as dc:
+                    ranges = get_ranges(dc, self)
+        # pylint: disable=broad-except
+        except Exception as a:
+            if not self.global_cfg.called_from_update_ranges:
+                _LOG.warning("get_ranges failed for layer %s: %s", self.name, str(a))
+            self.set_ranges(None, report=False)
+            return
+        self.set_ranges(ranges)
+
+    def set_ranges(self, ranges, report=True):
+        """
+        Replace the layer's ranges, and everything derived from them.
+
+        The new values are all calculated before any are replaced, so concurrent requests
+        never see a layer without ranges while they are being updated.
+
+        :param ranges: The new ranges, or None if no ranges are available (hides the layer).
+        :param report: Log a warning if the layer is hidden.
+        """
+        # _ranges is still "unready" on the first update, from make_ready.
+        old_ranges = self.__dict__.get("_ranges")
+        try:
+            if ranges is None:
                 raise Exception("Null product range")
-            self.bboxes = self.extract_bboxes()
+            bboxes = self.extract_bboxes(ranges)
             if self.default_time_rule == DEF_TIME_EARLIEST:
-                self.default_time = self._ranges["start_time"]
+                default_time = ranges["start_time"]
             elif isinstance(self.default_time_rule,
-                            datetime.date) and self.default_time_rule in self._ranges["time_set"]:
-                self.default_time = self.default_time_rule
+                            datetime.date) and self.default_time_rule in ranges["time_set"]:
+                default_time = self.default_time_rule
             elif isinstance(self.default_time_rule, datetime.date):
                 _LOG.warning("default_time for named_layer %s is explicit date (%s) that is "
                              " not available for the layer. Using most recent available date instead.",
                                     self.name,
                                     self.default_time_rule.isoformat()
                 )
-                self.default_time = self._ranges["end_time"]
+                default_time = ranges["end_time"]
             else:
-                self.default_time = self._ranges["end_time"]
-
+                default_time = ranges["end_time"]
         # pylint: disable=broad-except
         except Exception as a:
-            if not self.global_cfg.called_from_update_ranges:
+            if report and not self.global_cfg.called_from_update_ranges:
                 _LOG.warning("get_ranges failed for layer %s: %s", self.name, str(a))
+            self._ranges = None
             self.hide = True
             self.bboxes = {}
+            if old_ranges is not None:
+                capabilities_cache.invalidate()
+                description_cache.invalidate(self.name)
+            return
+        self.bboxes = bboxes
+        self.default_time = default_time
+        self._ranges = ranges
+        self.hide = False
+        if old_ranges != ranges:
+            capabilities_cache.invalidate()
+            description_cache.invalidate(self.name)
+            if old_ranges is not None:
+                # Cached dataset searches for this layer may be out of date.
+                search_cache.invalidate(p.id for p in self.products + self.low_res_products)
 
     def time_range(self, ranges=None):
         if ranges is None:
@@ -799,15 +901,17 @@ class OWSNamedLayer(OWSExtensibleConfigEntry, OWSLayer):
 
     @property
     def ranges(self):
-        if self.dynamic:
+        if self.dynamic and not range_refresher.ensure_running(self.global_cfg):
             self.force_range_update()
         return self._ranges
 
-    def extract_bboxes(self):
-        if self._ranges is None:
+    def extract_bboxes(self, ranges=None):
+        if ranges is None:
+            ranges = self._ranges
+        if ranges is None:
             return {}
         bboxes = {}
-        for crs_id, bbox in self._ranges["bboxes"].items():
+        for crs_id, bbox in ranges["bboxes"].items():
             if crs_id in self.global_cfg.published_CRSs:
                 # Assume we've already handled coordinate swapping for
                 # Vertical-coord first CRSs.   Top is top, left is left.
@@ -1014,29 +1118,29 @@ class WCSFormat:
         return self.renderers[version]
 
 
+class Address(OWSConfigEntry):
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.type = cfg.get("type")
+        self.address = cfg.get("address")
+        self.city = cfg.get("city")
+        self.state = cfg.get("state")
+        self.postcode = cfg.get("postcode")
+        self.country = cfg.get("country")
+
+    @classmethod
+    def parse(cls, cfg):
+        if not cfg:
+            return None
+        else:
+            return cls(cfg)
+
+
 class ContactInfo(OWSConfigEntry):
     def __init__(self, cfg, global_cfg):
         super().__init__(cfg)
         self.global_cfg = global_cfg
         self.person = cfg.get("person")
-
-        class Address(OWSConfigEntry):
-            def __init__(self, cfg):
-                super().__init__(cfg)
-                self.type = cfg.get("type")
-                self.address = cfg.get("address")
-                self.city = cfg.get("city")
-                self.state = cfg.get("state")
-                self.postcode = cfg.get("postcode")
-                self.country = cfg.get("country")
-
-            @classmethod
-            def parse(cls, cfg):
-                if not cfg:
-                    return None
-                else:
-                    return cls(cfg)
-
         self.address = Address.parse(cfg.get("address"))
         self.telephone = cfg.get("telephone")
         self.fax = cfg.get("fax")
@@ -1061,12 +1165,35 @@ class ContactInfo(OWSConfigEntry):
 class OWSConfig(OWSMetadataConfig):
     _instance = None
     initialised = False
+    # Bulk-loaded layer ranges, only available while the config is being made ready.
+    preloaded_ranges = None
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance or kwargs.get("refresh"):
             cls._instance = super().__new__(cls)
         return cls._instance
 
+    @classmethod
+    def has_instance(cls):
+        """
+        :return: True if the configuration singleton has been created (or installed).
+        """
+        return cls._instance is not None
+
+    @classmethod
+    def install_instance(cls, cfg):
+        """
+        Make an existing configuration object (e.g. one read from a snapshot) the configuration singleton.
+        """
+        cls._instance = cfg
+
+    def __setstate__(self, state):
+        # Loaded from a configuration snapshot - reapply process-wide settings made while parsing.
+        self.__dict__.update(state)
+        search_cache.configure(self.search_cache_ttl, self.search_cache_max_entries)
+        if self.ready:
+            self.set_msg_src(self.msg_catalog)
+
     METADATA_KEYWORDS = True
     METADATA_ATTRIBUTIONS = True
     METADATA_FEES = True
@@ -1132,17 +1259,36 @@ class OWSConfig(OWSMetadataConfig):
 
     #pylint: disable=attribute-defined-outside-init
     def make_ready(self, dc, *args, **kwargs):
+        self.msg_catalog = None
         if self.msg_file_name:
             try:
                 with open(self.msg_file_name, "rb") as fp:
-                    self.set_msg_src(read_po(fp, locale=self.default_locale, domain=self.message_domain))
+                    self.msg_catalog = read_po(fp, locale=self.default_locale, domain=self.message_domain)
             except FileNotFoundError:
                 _LOG.warning("Message file %s does not exist - using metadata from config file", self.msg_file_name)
-        else:
-            self.set_msg_src(None)
+        self.set_msg_src(self.msg_catalog)
         self.native_product_index = {}
-        self.root_layer_folder.make_ready(dc, *args, **kwargs)
+        self.preload_ranges(dc)
+        try:
+            self.root_layer_folder.make_ready(dc, *args, **kwargs)
+        finally:
+            self.preloaded_ranges = None
         super().make_ready(dc, *args, **kwargs)
+        capabilities_cache.invalidate()
+        description_cache.invalidate()
+
+    def preload_ranges(self, dc):
+        # Read all layer ranges with one query per table, rather than one query per layer.
+        self.preloaded_ranges = None
+        if not self.product_index:
+            return
+        try:
+            from datacube_ows.product_ranges import PreloadedRanges
+            self.preloaded_ranges = PreloadedRanges(dc, self)
+        # pylint: disable=broad-except
+        except Exception as e:
+            if not self.called_from_update_ranges:
+                _LOG.warning("Bulk loading of layer ranges failed - falling back to per-layer queries: %s", str(e))
 
     def export_metadata(self):
         if self.catalog is None:
@@ -1198,6 +1344,10 @@ class OWSConfig(OWSMetadataConfig):
         self.info_url = cfg["info_url"]
         self.contact_info = ContactInfo.parse(cfg.get("contact_info"), self)
         self.attribution = AttributionCfg.parse(cfg.get("attribution"), self)
+        self.parse_data_loading(cfg.get("data_loading", {}))
+        self.parse_dynamic_ranges(cfg.get("dynamic_ranges", {}))
+        self.lazy_layers = bool(cfg.get("lazy_layers", False))
+        self.warm_layers = set(cfg.get("warm_layers", []))
 
         def make_gml_name(name):
             if name.startswith("EPSG:"):
@@ -1252,6 +1402,43 @@ class OWSConfig(OWSMetadataConfig):
             self.published_CRSs[alias]["gml_name"] = make_gml_name(alias)
             self.published_CRSs[alias]["alias_of"] = target_crs
 
+    def parse_data_loading(self, cfg):
+        def positive_int(entry, default):
+            try:
+                val = int(cfg.get(entry, default))
+            except ValueError:
+                raise ConfigException(f"{entry} in data_loading section must be an integer: {cfg[entry]}")
+            if val < 1:
+                raise ConfigException(f"{entry} in data_loading section must be positive: {cfg[entry]}")
+            return val
+        self.data_load_query_threads = positive_int("query_threads", 4)
+        self.data_load_manual_merge_threads = positive_int("manual_merge_threads", 4)
+        self.data_load_stream_queries = bool(cfg.get("stream_dataset_queries", False))
+        try:
+            self.search_cache_ttl = float(cfg.get("search_cache_ttl", 60))
+        except (ValueError, TypeError):
+            raise ConfigException(f"search_cache_ttl in data_loading section must be a number: {cfg['search_cache_ttl']}")
+        if self.search_cache_ttl < 0:
+            raise ConfigException(f"search_cache_ttl in data_loading section cannot be negative: {cfg['search_cache_ttl']}")
+        self.search_cache_max_entries = positive_int("search_cache_max_entries", 10000)
+        search_cache.configure(self.search_cache_ttl, self.search_cache_max_entries)
+
+    def defer_layer(self, name):
+        """
+        :param name: A layer name
+        :return: True if making the named layer ready should be deferred until it is first used.
+        """
+        return self.lazy_layers and not self.called_from_update_ranges and name not in self.warm_layers
+
+    def parse_dynamic_ranges(self, cfg):
+        try:
+            self.range_refresh_interval = float(cfg.get("refresh_interval", 30))
+        except (ValueError, TypeError):
+            raise ConfigException(f"refresh_interval in dynamic_ranges section must be a number: {cfg['refresh_interval']}")
+        if self.range_refresh_interval < 0:
+            raise ConfigException(f"refresh_interval in dynamic_ranges section cannot be negative: {cfg['refresh_interval']}")
+        self.range_refresh_listen = bool(cfg.get("listen", False))
+
     def parse_wms(self, cfg):
         if not self.wms and not self.wmts:
             cfg = {}
@@ -1272,6 +1459,7 @@ class OWSConfig(OWSMetadataConfig):
         self.authorities = cfg.get("authorities", {})
         self.user_band_math_extension = cfg.get("user_band_math_extension", False)
         self.wms_cap_cache_age = parse_cache_age(cfg, "caps_cache_maxage", "wms")
+        self.png_encoding = PNGEncoding(cfg.get("png_encoding", {}))
         if "attribution" in cfg:
             _LOG.warning("Attribution entry in top level 'wms' section will be ignored. Attribution should be moved to the 'global' section")
 
@@ -1318,6 +1506,7 @@ class OWSConfig(OWSMetadataConfig):
             if identifier in self.tile_matrix_sets:
                 raise ConfigException(f"Tile matrix set identifiers must be unique: {identifier}")
             self.tile_matrix_sets[identifier] = TileMatrixSet(identifier, tms, self)
+        self.tile_cache = TileCache.from_config(cfg.get("tile_cache"))
 
     def parse_layers(self, cfg):
         self.folder_index = {}
@@ -1363,6 +1552,12 @@ class OWSConfig(OWSMetadataConfig):
 
 
 def get_config(refresh=False, called_from_update_ranges=False):
+    snapshot = os.environ.get("DATACUBE_OWS_CFG_SNAPSHOT")
+    if snapshot and not OWSConfig.has_instance() and not refresh and not called_from_update_ranges:
+        from datacube_ows.config_snapshot import load_snapshot
+        cfg = load_snapshot(snapshot)
+        if cfg is not None:
+            return cfg
     cfg = OWSConfig(refresh=refresh, called_from_update_ranges=called_from_update_ranges)
     if not cfg.ready:
         try:
@@ -7,13 +7,19 @@
 #pylint: skip-file
 
 import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
+from time import monotonic
 
 import datacube
+import numpy
 from psycopg2.extras import Json
+from sqlalchemy import text
 
 from datacube_ows.ogc_utils import NoTimezoneException, tz_for_coord
 from datacube_ows.ows_configuration import get_config
+from datacube_ows.range_refresher import notify_ranges_updated
 from datacube_ows.utils import get_sqlconn
 
 
@@ -144,7 +150,7 @@ def create_multiprod_range_entry(dc, product, crses):
     return
 
 
-def create_range_entry(dc, product, crses, summary_product=False):
+def create_range_entry(dc, product, crses, summary_product=False, sql_solar_dates=True):
   print("Updating range for ODC product %s..." % product.name)
   # NB. product is an ODC product
   conn = get_sqlconn(dc)
@@ -215,29 +221,10 @@ def create_range_entry(dc, product, crses, summary_product=False):
                    }
       )
   else:
-      # Loop over dates
-      dates = set()
-
-      results = conn.execute(
-          """
-          select
-                lower(temporal_extent), upper(temporal_extent),
-                ST_X(ST_Centroid(spatial_extent)),
-                ST_Y(ST_Centroid(spatial_extent))
-          from public.space_time_view
-          WHERE dataset_type_ref = %(p_id)s
-          """ %
-          {"p_id": prodid}
-      )
-      for result in results:
-          dt1, dt2, lon, lat = result
-          try:
-              tz = tz_for_coord(lon, lat)
-          except NoTimezoneException:
-              offset = round(lon / 15.0)
-              tz = timezone(timedelta(hours=offset))
-          dates.add(dt1.astimezone(tz).date())
-      dates = sorted(dates)
+      if sql_solar_dates:
+          dates = solar_dates_sql(conn, prodid)
+      else:
+          dates = solar_dates_python(conn, prodid)
 
       conn.execute("""
            UPDATE wms.product_ranges
@@ -282,6 +269,92 @@ def create_range_entry(dc, product, crses, summary_product=False):
   conn.close()
 
 
+def solar_dates_python(conn, prodid):
+    """
+    Local solar dates of all datasets of a product, calculated in Python.
+
+    The timezone of each dataset is looked up from its centroid (falling back to the nearest whole-hour
+    offset from the longitude).  Slow for products with many datasets.
+
+    :param conn: A database connection, with the timezone set to UTC
+    :param prodid: The ODC product id
+    :return: A sorted list of dates
+    """
+    dates = set()
+    results = conn.execute(
+        """
+        select
+              lower(temporal_extent), upper(temporal_extent),
+              ST_X(ST_Centroid(spatial_extent)),
+              ST_Y(ST_Centroid(spatial_extent))
+        from public.space_time_view
+        WHERE dataset_type_ref = %(p_id)s
+        """ %
+        {"p_id": prodid}
+    )
+    for result in results:
+        dt1, dt2, lon, lat = result
+        try:
+            tz = tz_for_coord(lon, lat)
+        except NoTimezoneException:
+            offset = round(lon / 15.0)
+            tz = timezone(timedelta(hours=offset))
+        dates.add(dt1.astimezone(tz).date())
+    return sorted(dates)
+
+
+def timezone_polygons_loaded(conn):
+    """
+    :return: True if the optional wms.timezone_polygons table exists and is populated.
+    """
+    if not conn.execute("SELECT to_regclass('wms.timezone_polygons') IS NOT NULL").scalar():
+        return False
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM wms.timezone_polygons)").scalar()
+
+
+def solar_dates_sql(conn, prodid):
+    """
+    Local solar dates of all datasets of a product, calculated in the database.
+
+    The timezone of each dataset is looked up from its centroid in the wms.timezone_polygons table if it
+    is populated.  Otherwise (or if the centroid is outside all the timezone polygons) the nearest
+    whole-hour offset from the longitude is used.  Only the distinct dates are returned from the database.
+    Extents are treated as EPSG:4326, as views created by older versions of OWS may have extents with SRID 0.
+
+    :param conn: A database connection
+    :param prodid: The ODC product id
+    :return: A sorted list of dates
+    """
+    lon_offset_date = """
+        (lower(stv.temporal_extent) AT TIME ZONE 'UTC'
+            + make_interval(hours => round(ST_X(ST_Centroid(stv.spatial_extent)) / 15.0)::integer))::date
+    """
+    if timezone_polygons_loaded(conn):
+        results = conn.execute(f"""
+            SELECT DISTINCT
+                coalesce((lower(stv.temporal_extent) AT TIME ZONE tz.tzid)::date, {lon_offset_date})
+            FROM public.space_time_view stv
+            LEFT JOIN LATERAL (
+                SELECT tzp.tzid
+                FROM wms.timezone_polygons tzp
+                WHERE ST_Intersects(tzp.geom, ST_Centroid(ST_SetSRID(stv.spatial_extent, 4326)))
+                LIMIT 1
+            ) tz ON TRUE
+            WHERE stv.dataset_type_ref = %(p_id)s
+            """,
+            {"p_id": prodid}
+        )
+    else:
+        results = conn.execute(f"""
+            SELECT DISTINCT {lon_offset_date}
+            FROM public.space_time_view stv
+            WHERE stv.dataset_type_ref = %(p_id)s
+            """,
+            {"p_id": prodid}
+        )
+    return sorted(r[0] for r in results)
+
+
 def bbox_projections(starting_box, crses):
    result = {}
    for crsid, crs in crses.items():
@@ -324,7 +397,7 @@ def datasets_exist(dc, product_name):
   return list(results)[0][0] > 0
 
 
-def add_ranges(dc, product_names, summary=False, merge_only=False):
+def add_ranges(dc, product_names, summary=False, merge_only=False, sql_solar_dates=True, jobs=1):
     odc_products = {}
     ows_multiproducts = []
     errors = False
@@ -358,31 +431,228 @@ def add_ranges(dc, product_names, summary=False, merge_only=False):
                 errors = True
                 continue
 
+    crses = get_crses()
+    updated_ids = []
     if ows_multiproducts and merge_only:
         print("Merge-only: Skipping range update of products:", repr(list(odc_products.keys())))
+        for mp in ows_multiproducts:
+            create_multiprod_range_entry(dc, mp, crses)
     else:
+        product_jobs = []
         for pname, ows_prods in odc_products.items():
-            dc_product = dc.index.products.get_by_name(pname)
-            if dc_product is None:
-                print("Could not find ODC product:", pname)
-                errors = True
-            elif datasets_exist(dc, dc_product.name):
-                prod_summary = summary
-                for ows_prod in ows_prods["ows"]:
-                    if ows_prod:
-                        prod_summary = not ows_prod.is_raw_time_res
-                        break
-                create_range_entry(dc, dc_product, get_crses(), prod_summary)
-            else:
-                print("Could not find any datasets for: ", pname)
-    for mp in ows_multiproducts:
-        create_multiprod_range_entry(dc, mp, get_crses())
+            prod_summary = summary
+            for ows_prod in ows_prods["ows"]:
+                if ows_prod:
+                    prod_summary = not ows_prod.is_raw_time_res
+                    break
+            product_jobs.append((pname, prod_summary))
+        if jobs > 1:
+            errors = _add_ranges_parallel(dc, product_jobs, ows_multiproducts, crses,
+                                          sql_solar_dates, jobs, updated_ids) or errors
+        else:
+            for i, (pname, prod_summary) in enumerate(product_jobs, 1):
+                print(f"[{i}/{len(product_jobs)}] {pname}")
+                status, prod_id = update_product_range(dc, pname, prod_summary, crses, sql_solar_dates)
+                if status == "not found":
+                    errors = True
+                elif status == "updated":
+                    updated_ids.append(prod_id)
+            for mp in ows_multiproducts:
+                create_multiprod_range_entry(dc, mp, crses)
+    conn = get_sqlconn(dc)
+    try:
+        notify_ranges_updated(conn, ",".join(sorted(odc_products.keys())))
+    finally:
+        conn.close()
+
+    tile_cache = get_config().tile_cache
+    if tile_cache is not None:
+        updated = set(odc_products.keys())
+        stale_layers = set(mp.name for mp in ows_multiproducts)
+        for layer in get_config().product_index.values():
+            if updated.intersection(layer.product_names):
+                stale_layers.add(layer.name)
+        tile_cache.invalidate_layers(sorted(stale_layers))
 
     print("Done.")
     return errors
 
+
+def update_product_range(dc, pname, summary_product, crses, sql_solar_dates=True):
+    """
+    Update the range table entry for an ODC product, if it has any datasets.
+
+    :return: A (status, product id) tuple.  Status is one of "updated", "no datasets" or "not found".
+    """
+    dc_product = dc.index.products.get_by_name(pname)
+    if dc_product is None:
+        print("Could not find ODC product:", pname)
+        return "not found", None
+    if not datasets_exist(dc, dc_product.name):
+        print("Could not find any datasets for: ", pname)
+        return "no datasets", dc_product.id
+    create_range_entry(dc, dc_product, crses, summary_product, sql_solar_dates)
+    return "updated", dc_product.id
+
+
+# Datacube object for range update worker processes.
+_worker_dc = None
+
+
+def _init_range_worker():
+    global _worker_dc
+    _worker_dc = datacube.Datacube(app="ows_update_ranges")
+
+
+def _range_worker(pname, summary_product, crses, sql_solar_dates):
+    # Runs in a worker process.  Failures are reported back rather than raised, so one product
+    # cannot stop the others from being updated.
+    start = monotonic()
+    try:
+        status, prod_id = update_product_range(_worker_dc, pname, summary_product, crses, sql_solar_dates)
+    except Exception as e:
+        return pname, "failed", None, f"{type(e).__name__}: {e}", monotonic() - start
+    return pname, status, prod_id, None, monotonic() - start
+
+
+def _add_ranges_parallel(dc, product_jobs, multiproducts, crses, sql_solar_dates, jobs, updated_ids):
+    """
+    Update product ranges concurrently in worker processes.
+
+    Each multiproduct is merged (in this process) as soon as all of its constituent products are done,
+    unless any of them failed.
+
+    :param product_jobs: A list of (ODC product name, summary product flag) tuples.
+    :param updated_ids: A list to append the ids of updated products to.
+    :return: True if there were any errors.
+    """
+    errors = False
+    pending_mps = {mp.name: (mp, set(mp.product_names)) for mp in multiproducts}
+    failed = set()
+    total = len(product_jobs)
+    print(f"Updating {total} products with {jobs} worker processes")
+    # Worker processes are spawned rather than forked, so they do not share this process's database connections.
+    with ProcessPoolExecutor(max_workers=jobs,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_range_worker) as executor:
+        futures = [
+            executor.submit(_range_worker, pname, prod_summary, crses, sql_solar_dates)
+            for pname, prod_summary in product_jobs
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            pname, status, prod_id, err, elapsed = future.result()
+            print(f"[{done}/{total}] {pname}: {status} ({elapsed:.1f}s)" + (f" - {err}" if err else ""))
+            if status in ("failed", "not found"):
+                errors = True
+                failed.add(pname)
+            elif status == "updated":
+                updated_ids.append(prod_id)
+            for mp_name, (mp, waiting) in list(pending_mps.items()):
+                waiting.discard(pname)
+                if waiting:
+                    continue
+                del pending_mps[mp_name]
+                mp_failed = failed.intersection(mp.product_names)
+                if mp_failed:
+                    print(f"Skipping merge of multiproduct {mp_name}: failed to update {', '.join(sorted(mp_failed))}")
+                    errors = True
+                else:
+                    create_multiprod_range_entry(dc, mp, crses)
+    return errors
+
+
+def parse_range_dates(date_lists):
+    """
+    Parse the date strings of several range entries in a single vectorised pass.
+
+    :param date_lists: A sequence of lists of ISO format date strings (or None), one per range entry.
+    :return: A list of lists of datetime.date objects, one per range entry, with the Nones removed.
+    """
+    dates = [[d for d in dl if d is not None] for dl in date_lists]
+    flat = numpy.array([d for dl in dates for d in dl], dtype="datetime64[D]").astype(object)
+    offsets = numpy.cumsum([0] + [len(dl) for dl in dates])
+    return [list(flat[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def ranges_from_row(cfg, row, times):
+    if not times:
+        return None
+    return {
+        "lat": {
+            "min": float(row["lat_min"]),
+            "max": float(row["lat_max"]),
+        },
+        "lon": {
+            "min": float(row["lon_min"]),
+            "max": float(row["lon_max"]),
+        },
+        "times": times,
+        "start_time": times[0],
+        "end_time": times[-1],
+        "time_set": set(times),
+        "bboxes": cfg.alias_bboxes(row["bboxes"])
+    }
+
+
+class PreloadedRanges:
+    """
+    The contents of the product_ranges and multiproduct_ranges tables, read in bulk.
+
+    Used while the configuration is being made ready, so that each layer does not have to
+    query its own ranges.
+    """
+    def __init__(self, dc, cfg, layers=None):
+        """
+        :param dc: A Datacube object
+        :param cfg: The OWS configuration
+        :param layers: Only read the ranges for these layers (default: read all ranges)
+        """
+        self.cfg = cfg
+        self.products = {}
+        self.multiproducts = {}
+        conn = get_sqlconn(dc)
+        try:
+            if layers is None:
+                self.products = self._read(conn.execute("SELECT * FROM wms.product_ranges"), "id")
+                self.multiproducts = self._read(conn.execute("SELECT * FROM wms.multiproduct_ranges"),
+                                                "wms_product_name")
+            else:
+                prod_ids = [layer.product.id for layer in layers if not layer.multi_product]
+                multi_names = [layer.name for layer in layers if layer.multi_product]
+                # Each list is bound as a single array parameter.
+                if prod_ids:
+                    self.products = self._read(
+                        conn.execute(text("SELECT * FROM wms.product_ranges WHERE id = ANY(:ids)"),
+                                     {"ids": prod_ids}),
+                        "id")
+                if multi_names:
+                    self.multiproducts = self._read(
+                        conn.execute(text("SELECT * FROM wms.multiproduct_ranges WHERE wms_product_name = ANY(:names)"),
+                                     {"names": multi_names}),
+                        "wms_product_name")
+        finally:
+            conn.close()
+
+    def _read(self, results, key_col):
+        rows = list(results)
+        all_times = parse_range_dates([row["dates"] for row in rows])
+        return {
+            row[key_col]: ranges_from_row(self.cfg, row, times)
+            for row, times in zip(rows, all_times)
+        }
+
+    def get(self, product, is_dc_product=False):
+        if not is_dc_product and product.multi_product:
+            return self.multiproducts.get(product.name)
+        if is_dc_product:
+            return self.products.get(product.id)
+        return self.products.get(product.product.id)
+
+
 def get_ranges(dc, product, path=None, is_dc_product=False):
     cfg = product.global_cfg
+    if path is None and cfg.preloaded_ranges is not None:
+        return cfg.preloaded_ranges.get(product, is_dc_product)
     conn = get_sqlconn(dc)
     if not is_dc_product and product.multi_product:
         if path is not None:
@@ -415,21 +685,5 @@ def get_ranges(dc, product, path=None, is_dc_product=False):
     for result in results:
         conn.close()
         times = [datetime.strptime(d, "%Y-%m-%d").date() for d in result["dates"] if d is not None]
-        if not times:
-            return None
-        return {
-            "lat": {
-                "min": float(result["lat_min"]),
-                "max": float(result["lat_max"]),
-            },
-            "lon": {
-                "min": float(result["lon_min"]),
-                "max": float(result["lon_max"]),
-            },
-            "times": times,
-            "start_time": times[0],
-            "end_time": times[-1],
-            "time_set": set(times),
-            "bboxes": cfg.alias_bboxes(result["bboxes"])
-        }
+        return ranges_from_row(cfg, result, times)
     return None
@@ -0,0 +1,159 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import logging
+import os
+import select
+import threading
+from typing import Optional
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from datacube_ows.cube_pool import cube
+from datacube_ows.mv_index import search_cache
+
+_LOG = logging.getLogger(__name__)
+
+# PostgreSQL notification channel used by datacube-ows-update to announce range updates.
+RANGES_CHANNEL = "datacube_ows_ranges"
+# PostgreSQL limits notification payloads to 8000 bytes.
+MAX_PAYLOAD = 4000
+
+
+def notify_ranges_updated(conn, payload: str = "") -> None:
+    """
+    Notify listening OWS worker processes that the range tables or space-time views have been updated.
+
+    :param conn: A SQLAlchemy database connection.
+    :param payload: Optional notification payload (e.g. the names of the updated products)
+    """
+    if len(payload) > MAX_PAYLOAD:
+        payload = ""
+    # Notifications are only delivered when the transaction commits.
+    with conn.begin():
+        conn.execute("SELECT pg_notify(%s, %s)", RANGES_CHANNEL, payload)
+
+
+class RangeRefresher:
+    """
+    Background thread that keeps the ranges of dynamic layers up to date.
+
+    Each worker process runs its own thread, started lazily the first time the ranges of a dynamic layer
+    are read.  The thread re-reads the ranges of all dynamic layers every refresh interval, or as soon as
+    datacube-ows-update sends a notification if listening is enabled, and swaps the new ranges into the layers.
+    Requests therefore never query the range tables themselves.  Notifications also discard the process's
+    cached dataset searches, as they may be out of date.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    def running(self) -> bool:
+        return self._thread is not None and self._pid == os.getpid() and self._thread.is_alive()
+
+    def ensure_running(self, cfg) -> bool:
+        """
+        Start the refresh thread for the current process, if required and not already running.
+
+        :param cfg: The OWS configuration
+        :return: True if the refresh thread is running, False if background refreshes are disabled.
+        """
+        if cfg.range_refresh_interval <= 0:
+            return False
+        if self.running():
+            return True
+        with self._lock:
+            # Threads do not survive a fork, so a forked worker process starts its own.
+            if not self.running():
+                self._stop = threading.Event()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, args=(cfg, self._stop),
+                                                name="ows-range-refresher", daemon=True)
+                self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stop.set()
+            if self.running():
+                self._thread.join()
+            self._thread = None
+
+    def refresh(self, cfg, dc) -> None:
+        """
+        Re-read the ranges of all dynamic layers with one query per range table and swap them into the layers.
+        """
+        from datacube_ows.product_ranges import PreloadedRanges
+
+        # Lazy layers not yet made ready get their ranges when they are made ready.
+        layers = [layer for layer in cfg.product_index.values()
+                  if layer.dynamic and not layer.lazy and layer.ready]
+        if not layers:
+            return
+        preloaded = PreloadedRanges(dc, cfg, layers)
+        for layer in layers:
+            layer.set_ranges(preloaded.get(layer))
+
+    def _listen(self, dc):
+        # A connection of its own, detached from the SQLAlchemy pool as it is held for the life of the thread.
+        # The Datacube object it was obtained from goes back to the cube pool.
+        # pylint: disable=protected-access
+        conn = dc.index._db._engine.raw_connection()
+        conn.detach()
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {RANGES_CHANNEL}")
+        return conn
+
+    def _wait(self, listener, stop: threading.Event, timeout: float) -> bool:
+        """
+        Wait for the refresh interval, or a notification if listening.
+
+        :return: True if a notification was received.
+        """
+        if listener is None:
+            stop.wait(timeout)
+            return False
+        ready, _, _ = select.select([listener], [], [], timeout)
+        if not ready:
+            return False
+        listener.poll()
+        notified = bool(listener.notifies)
+        if notified:
+            _LOG.debug("Range update notification received: %s", listener.notifies[-1].payload)
+        listener.notifies.clear()
+        return notified
+
+    def _run(self, cfg, stop: threading.Event) -> None:
+        listener = None
+        while not stop.is_set():
+            try:
+                if cfg.range_refresh_listen and listener is None:
+                    with cube() as dc:
+                        listener = self._listen(dc)
+                if self._wait(listener, stop, cfg.range_refresh_interval):
+                    search_cache.invalidate()
+                if not stop.is_set():
+                    # Only hold a Datacube object from the pool while refreshing.
+                    with cube() as dc:
+                        self.refresh(cfg, dc)
+            # pylint: disable=broad-except
+            except Exception as e:
+                _LOG.warning("Background range refresh failed: %s", str(e))
+                if listener is not None:
+                    try:
+                        listener.close()
+                    # pylint: disable=broad-except
+                    except Exception:
+                        pass
+                    listener = None
+                stop.wait(cfg.range_refresh_interval)
+        if listener is not None:
+            listener.close()
+
+
+range_refresher = RangeRefresher()
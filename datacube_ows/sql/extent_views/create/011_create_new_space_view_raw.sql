@@ -65,9 +65,9 @@ eo_geoms as
    and metadata #>> '{grid_spatial, projection, valid_data}' is not null
    and substr(metadata #>> '{grid_spatial, projection, spatial_reference}', 1, 5) = 'EPSG:'
 )
-select id,format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
+select id,ST_SetSRID(format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
                  lon_begin, lat_begin, lon_end, lat_begin,  lon_end, lat_end,
-                 lon_begin, lat_end, lon_begin, lat_begin)::geometry
+                 lon_begin, lat_end, lon_begin, lat_begin)::geometry, 4326)
 as spatial_extent
 from eo3_ranges
 where valid_geom is null
@@ -76,9 +76,9 @@ select id,valid_geom as spatial_extent
 from eo3_ranges
 where valid_geom is not null
 UNION
-select id,format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
+select id,ST_SetSRID(format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
                  ll_lon, ll_lat, lr_lon, lr_lat,  ur_lon, ur_lat,
-                 ul_lon, ul_lat, ll_lon, ll_lat)::geometry as spatial_extent
+                 ul_lon, ul_lat, ll_lon, ll_lat)::geometry, 4326) as spatial_extent
 from eo_corners
 UNION
 select id, valid_data as spatial_extent
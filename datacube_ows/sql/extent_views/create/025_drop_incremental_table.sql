@@ -0,0 +1,10 @@
+-- Dropping incrementally updated space-time table, if present (OWS down)
+
+DO $$
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('space_time_view')) IN ('r', 'p') THEN
+    DROP TABLE space_time_view;
+  END IF;
+  DROP TABLE IF EXISTS space_time_view_watermark;
+END
+$$
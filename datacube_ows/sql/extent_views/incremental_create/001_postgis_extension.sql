@@ -0,0 +1,3 @@
+-- Installing Postgis extensions on public schema
+
+create extension if not exists postgis
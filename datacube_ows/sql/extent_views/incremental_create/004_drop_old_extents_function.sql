@@ -0,0 +1,3 @@
+-- Dropping superseded space-time extent function
+
+DROP FUNCTION IF EXISTS space_time_extents(TIMESTAMPTZ, SMALLINT)
@@ -0,0 +1,137 @@
+-- Creating space-time extent function
+
+-- Extents of all active datasets added after added_since (optionally for a single product, or only for
+-- the listed datasets), calculated as for the materialised views.
+CREATE OR REPLACE FUNCTION space_time_extents(added_since TIMESTAMPTZ, product_ref SMALLINT DEFAULT NULL,
+                                              dataset_ids UUID[] DEFAULT NULL)
+RETURNS TABLE (id UUID, dataset_type_ref SMALLINT, spatial_extent geometry, temporal_extent tstzrange)
+LANGUAGE sql STABLE
+SET timezone = 'Etc/UTC'
+AS $func$
+  with
+  metadata_lookup as (
+    select id,name from agdc.metadata_type
+  ),
+  new_dataset as (
+    select ds.* from agdc.dataset ds
+    where ds.added > added_since
+      and ds.archived is null
+      and (product_ref is null or ds.dataset_type_ref = product_ref)
+      and (dataset_ids is null or ds.id = any(dataset_ids))
+  ),
+  time_extents as (
+  select
+    dataset_type_ref, id,
+    case
+      when metadata -> 'extent' ->> 'from_dt' is null then
+        tstzrange(
+          (metadata -> 'extent' ->> 'center_dt') :: timestamp,
+          (metadata -> 'extent' ->> 'center_dt') :: timestamp,
+          '[]'
+        )
+      else
+        tstzrange(
+          (metadata -> 'extent' ->> 'from_dt') :: timestamp,
+          (metadata -> 'extent' ->> 'to_dt') :: timestamp,
+          '[]'
+        )
+    end as temporal_extent
+  from new_dataset where
+    metadata_type_ref in (select id from metadata_lookup where name in ('eo','eo_s2_nrt', 'gqa_eo','eo_plus'))
+  UNION
+  select
+    dataset_type_ref, id,tstzrange(
+      coalesce(metadata->'properties'->>'dtr:start_datetime', metadata->'properties'->>'datetime'):: timestamp,
+      coalesce((metadata->'properties'->>'dtr:end_datetime'):: timestamp,(metadata->'properties'->>'datetime'):: timestamp),
+      '[]'
+     ) as temporal_extent
+  from new_dataset where
+      metadata_type_ref in (select id from metadata_lookup where name in ('eo3_landsat_ard','eo3'))
+  ),
+  eo3_ranges as
+  (select id,
+    (metadata #>> '{extent, lat, begin}') as lat_begin,
+    (metadata #>> '{extent, lat, end}') as lat_end,
+    (metadata #>> '{extent, lon, begin}') as lon_begin,
+    (metadata #>> '{extent, lon, end}') as lon_end,
+    ST_Transform(
+      ST_SetSRID(
+        ST_GeomFromGeoJSON(
+          metadata #>> '{geometry}'),
+          substr(
+            metadata #>> '{crs}',6)::integer
+          ),
+          4326
+        ) as valid_geom
+     from new_dataset where
+        metadata_type_ref in (select id from metadata_lookup where name='eo3')
+    ),
+  eo_corners as
+  (select id,
+    (metadata #>> '{extent, coord, ll, lat}') as ll_lat,
+    (metadata #>> '{extent, coord, ll, lon}') as ll_lon,
+    (metadata #>> '{extent, coord, lr, lat}') as lr_lat,
+    (metadata #>> '{extent, coord, lr, lon}') as lr_lon,
+    (metadata #>> '{extent, coord, ul, lat}') as ul_lat,
+    (metadata #>> '{extent, coord, ul, lon}') as ul_lon,
+    (metadata #>> '{extent, coord, ur, lat}') as ur_lat,
+    (metadata #>> '{extent, coord, ur, lon}') as ur_lon
+     from new_dataset
+     where metadata_type_ref in (select id from metadata_lookup where name in ('eo','eo_s2_nrt','gqa_eo','eo_plus', 'boku'))
+     and (metadata #>> '{grid_spatial, projection, valid_data}' is null
+         or
+          substr(metadata #>> '{grid_spatial, projection, spatial_reference}', 1, 4) <> 'EPSG'
+     )
+  ),
+  eo_geoms as
+  (select id,
+    ST_Transform(
+      ST_SetSRID(
+        ST_GeomFromGeoJSON(
+          metadata #>> '{grid_spatial, projection, valid_data}'),
+          substr(
+            metadata #>> '{grid_spatial, projection, spatial_reference}',6)::integer
+          ),
+          4326
+        ) as valid_data
+     from new_dataset where
+          metadata_type_ref in (select id from metadata_lookup where name in ('eo','eo_s2_nrt','gqa_eo','eo_plus', 'boku'))
+     and metadata #>> '{grid_spatial, projection, valid_data}' is not null
+     and substr(metadata #>> '{grid_spatial, projection, spatial_reference}', 1, 5) = 'EPSG:'
+  ),
+  space_extents as (
+  select id,ST_SetSRID(format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
+                   lon_begin, lat_begin, lon_end, lat_begin,  lon_end, lat_end,
+                   lon_begin, lat_end, lon_begin, lat_begin)::geometry, 4326)
+  as spatial_extent
+  from eo3_ranges
+  where valid_geom is null
+  UNION
+  select id,valid_geom as spatial_extent
+  from eo3_ranges
+  where valid_geom is not null
+  UNION
+  select id,ST_SetSRID(format('POLYGON(( %s %s, %s %s, %s %s, %s %s, %s %s))',
+                   ll_lon, ll_lat, lr_lon, lr_lat,  ur_lon, ur_lat,
+                   ul_lon, ul_lat, ll_lon, ll_lat)::geometry, 4326) as spatial_extent
+  from eo_corners
+  UNION
+  select id, valid_data as spatial_extent
+  from eo_geoms
+  UNION
+  select id,
+    ST_Transform(
+      ST_SetSRID(
+        ST_GeomFromGeoJSON(
+          metadata #>> '{geometry}'),
+          substr(
+            metadata #>> '{crs}',6)::integer
+          ),
+          4326
+        ) as spatial_extent
+   from new_dataset where
+          metadata_type_ref in (select id from metadata_lookup where name in ('eo3_landsat_ard'))
+  )
+  select distinct on (space_extents.id) space_extents.id, dataset_type_ref, spatial_extent, temporal_extent
+  from space_extents join time_extents on space_extents.id=time_extents.id
+$func$
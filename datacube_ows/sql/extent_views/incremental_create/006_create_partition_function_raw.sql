@@ -0,0 +1,31 @@
+-- Creating space-time table partitioning function
+
+-- Creates a list partition for every product that does not have one yet (if the table is partitioned),
+-- moving any rows for the product out of the default partition.
+CREATE OR REPLACE FUNCTION space_time_view_create_partitions(parent TEXT)
+RETURNS void
+LANGUAGE plpgsql
+AS $func$
+DECLARE
+  prod RECORD;
+  part TEXT;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(parent)) IS DISTINCT FROM 'p' THEN
+    RETURN;
+  END IF;
+  EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I DEFAULT', parent || '_default', parent);
+  FOR prod IN SELECT id FROM agdc.dataset_type ORDER BY id LOOP
+    part := parent || '_p' || prod.id;
+    CONTINUE WHEN to_regclass(part) IS NOT NULL;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', part, parent);
+    -- Matches the partition constraint, so attaching does not need to scan the new partition.
+    EXECUTE format('ALTER TABLE %I ADD CHECK (dataset_type_ref IS NOT NULL AND dataset_type_ref = %s)',
+                   part, prod.id);
+    EXECUTE format(
+      'WITH moved AS (DELETE FROM %I WHERE dataset_type_ref = %s RETURNING *) INSERT INTO %I SELECT * FROM moved',
+      parent || '_default', prod.id, part
+    );
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%s)', parent, part, prod.id);
+  END LOOP;
+END
+$func$
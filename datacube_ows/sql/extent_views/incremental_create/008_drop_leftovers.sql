@@ -0,0 +1,11 @@
+-- Dropping leftovers from any interrupted schema update
+
+DO $$
+BEGIN
+  CASE (SELECT relkind FROM pg_class WHERE oid = to_regclass('space_time_view_new'))
+    WHEN 'm' THEN DROP MATERIALIZED VIEW space_time_view_new;
+    WHEN 'r', 'p' THEN DROP TABLE space_time_view_new;
+    ELSE NULL;
+  END CASE;
+END
+$$
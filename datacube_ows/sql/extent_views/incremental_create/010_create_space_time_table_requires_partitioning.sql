@@ -0,0 +1,8 @@
+-- Creating NEW incrementally updated SPACE-TIME table (same columns as the materialised view)
+
+CREATE TABLE space_time_view_new (
+  id UUID NOT NULL,
+  dataset_type_ref SMALLINT NOT NULL,
+  spatial_extent geometry,
+  temporal_extent tstzrange
+) {partitioning}
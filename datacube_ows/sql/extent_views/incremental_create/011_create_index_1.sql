@@ -0,0 +1,5 @@
+-- Creating NEW space-time table Index 1/4
+
+CREATE INDEX space_time_view_geom_idx_new
+  ON space_time_view_new
+  USING GIST (spatial_extent)
@@ -0,0 +1,6 @@
+-- Creating NEW space-time table Index 4/4
+
+-- Includes the partition key, as required for partitioned tables.
+CREATE UNIQUE INDEX space_time_view_idx_new
+  ON space_time_view_new
+  USING BTREE(id, dataset_type_ref)
@@ -0,0 +1,3 @@
+-- Creating NEW space-time table partitions (if partitioned)
+
+SELECT space_time_view_create_partitions('space_time_view_new')
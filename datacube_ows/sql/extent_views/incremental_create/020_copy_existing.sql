@@ -0,0 +1,12 @@
+-- Copying extents from existing space-time view or table (OWS remains up)
+
+DO $$
+BEGIN
+  IF to_regclass('space_time_view') IS NOT NULL THEN
+    INSERT INTO space_time_view_new (id, dataset_type_ref, spatial_extent, temporal_extent)
+    SELECT DISTINCT ON (id) id, dataset_type_ref, ST_SetSRID(spatial_extent, 4326), temporal_extent
+    FROM space_time_view
+    WHERE dataset_type_ref IS NOT NULL;
+  END IF;
+END
+$$
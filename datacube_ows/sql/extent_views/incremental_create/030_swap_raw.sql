@@ -0,0 +1,41 @@
+-- Replacing space-time view with NEW space-time table (OWS briefly down)
+
+DO $$
+DECLARE
+  part RECORD;
+  idx RECORD;
+BEGIN
+  CASE (SELECT relkind FROM pg_class WHERE oid = to_regclass('space_time_view'))
+    WHEN 'm' THEN DROP MATERIALIZED VIEW space_time_view;
+    WHEN 'r', 'p' THEN DROP TABLE space_time_view;
+    ELSE NULL;
+  END CASE;
+  DROP MATERIALIZED VIEW IF EXISTS space_time_view_old;
+  DROP MATERIALIZED VIEW IF EXISTS space_view;
+  DROP MATERIALIZED VIEW IF EXISTS space_view_new;
+  DROP MATERIALIZED VIEW IF EXISTS time_view;
+  DROP MATERIALIZED VIEW IF EXISTS time_view_new;
+  -- Partition indexes are named after their partitions.
+  FOR idx IN
+    SELECT ic.relname FROM pg_inherits i
+    JOIN pg_index x ON x.indrelid = i.inhrelid
+    JOIN pg_class ic ON ic.oid = x.indexrelid
+    WHERE i.inhparent = 'space_time_view_new'::regclass AND ic.relname LIKE 'space\_time\_view\_new%'
+  LOOP
+    EXECUTE format('ALTER INDEX %I RENAME TO %I', idx.relname,
+                   regexp_replace(idx.relname, '^space_time_view_new', 'space_time_view'));
+  END LOOP;
+  FOR part IN
+    SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'space_time_view_new'::regclass
+  LOOP
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', part.relname,
+                   regexp_replace(part.relname, '^space_time_view_new', 'space_time_view'));
+  END LOOP;
+  ALTER TABLE space_time_view_new RENAME TO space_time_view;
+  ALTER INDEX space_time_view_geom_idx_new RENAME TO space_time_view_geom_idx;
+  ALTER INDEX space_time_view_time_idx_new RENAME TO space_time_view_time_idx;
+  ALTER INDEX space_time_view_ds_idx_new RENAME TO space_time_view_ds_idx;
+  ALTER INDEX space_time_view_idx_new RENAME TO space_time_view_idx;
+END
+$$
@@ -0,0 +1,11 @@
+-- Creating space-time table watermark
+
+-- added/archived: Dataset added/archived timestamps processed up to.
+-- next_added/next_archived: Timestamps the current incremental update will advance the watermark to.
+CREATE TABLE IF NOT EXISTS space_time_view_watermark (
+  id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+  added TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+  archived TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+  next_added TIMESTAMPTZ NOT NULL DEFAULT '-infinity',
+  next_archived TIMESTAMPTZ NOT NULL DEFAULT '-infinity'
+)
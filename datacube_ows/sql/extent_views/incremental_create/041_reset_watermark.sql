@@ -0,0 +1,9 @@
+-- Resetting space-time table watermark (next update reprocesses all datasets)
+
+INSERT INTO space_time_view_watermark (id, added, archived, next_added, next_archived)
+VALUES (1, '-infinity', '-infinity', '-infinity', '-infinity')
+ON CONFLICT (id) DO UPDATE SET
+  added = EXCLUDED.added,
+  archived = EXCLUDED.archived,
+  next_added = EXCLUDED.next_added,
+  next_archived = EXCLUDED.next_archived
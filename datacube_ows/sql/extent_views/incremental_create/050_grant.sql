@@ -0,0 +1,3 @@
+-- Granting read permission to public
+
+GRANT SELECT ON space_time_view TO public;
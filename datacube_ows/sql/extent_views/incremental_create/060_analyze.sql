@@ -0,0 +1,3 @@
+-- Analysing space-time table
+
+ANALYZE space_time_view
@@ -0,0 +1,3 @@
+-- Creating space-time table partitions for new products (if partitioned)
+
+SELECT space_time_view_create_partitions('space_time_view')
@@ -0,0 +1,5 @@
+-- Finding latest dataset changes
+
+UPDATE space_time_view_watermark SET
+  next_added = coalesce((SELECT max(added) FROM agdc.dataset), '-infinity'),
+  next_archived = coalesce((SELECT max(archived) FROM agdc.dataset), '-infinity')
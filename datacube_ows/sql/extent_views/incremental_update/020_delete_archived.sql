@@ -0,0 +1,7 @@
+-- Removing recently archived datasets from SPACE-TIME table
+
+-- Rescan an hour before the watermark to catch changes committed late by long-running transactions.
+DELETE FROM space_time_view stv
+USING agdc.dataset ds, space_time_view_watermark wm
+WHERE stv.id = ds.id
+  AND ds.archived > wm.archived - interval '1 hour'
@@ -0,0 +1,10 @@
+-- Adding recently added datasets to SPACE-TIME table
+
+-- Rescan an hour before the watermark to catch changes committed late by long-running transactions.
+INSERT INTO space_time_view (id, dataset_type_ref, spatial_extent, temporal_extent)
+SELECT extents.*
+FROM space_time_view_watermark wm,
+  LATERAL space_time_extents(wm.added - interval '1 hour') extents
+ON CONFLICT (id, dataset_type_ref) DO UPDATE SET
+  spatial_extent = EXCLUDED.spatial_extent,
+  temporal_extent = EXCLUDED.temporal_extent
@@ -0,0 +1,11 @@
+-- Adding restored datasets to SPACE-TIME table
+
+-- Datasets that are un-archived keep their original added time, so are not picked up by the added watermark.
+INSERT INTO space_time_view (id, dataset_type_ref, spatial_extent, temporal_extent)
+SELECT extents.*
+FROM space_time_extents('-infinity', NULL, ARRAY(
+  SELECT ds.id FROM agdc.dataset ds
+  WHERE ds.archived IS NULL
+    AND NOT EXISTS (SELECT 1 FROM space_time_view stv WHERE stv.id = ds.id)
+)) extents
+ON CONFLICT (id, dataset_type_ref) DO NOTHING
@@ -0,0 +1,5 @@
+-- Advancing space-time table watermark
+
+UPDATE space_time_view_watermark SET
+  added = next_added,
+  archived = next_archived
@@ -0,0 +1,5 @@
+-- Creating timezone polygon table (optional, for solar date calculation)
+
+create table if not exists wms.timezone_polygons (
+    tzid varchar(64) not null,
+    geom geometry(Geometry, 4326) not null);
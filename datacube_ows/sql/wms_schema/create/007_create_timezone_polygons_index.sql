@@ -0,0 +1,5 @@
+-- Creating timezone polygon table index
+
+create index if not exists timezone_polygons_geom_idx
+    on wms.timezone_polygons
+    using gist (geom);
@@ -9,17 +9,17 @@ import logging
 import os
 import warnings
 
-import sentry_sdk
 from botocore.credentials import RefreshableCredentials
 from datacube.utils.aws import configure_s3_access
 from flask import Flask, request
 from flask_babel import Babel
 from flask_log_request_id import RequestID, RequestIDLogFilter
+from prometheus_client import Counter, Gauge
 from prometheus_flask_exporter.multiprocess import \
     GunicornInternalPrometheusMetrics
 from rasterio.errors import NotGeoreferencedWarning
-from sentry_sdk.integrations.flask import FlaskIntegration
 
+from datacube_ows.cube_pool import CubePool
 from datacube_ows.ows_configuration import get_config
 
 __all__ = [
@@ -32,6 +32,7 @@ __all__ = [
     'parse_config_file',
     'initialise_flask',
     'initialise_prometheus',
+    'initialise_cube_pool_metrics',
     'generate_locale_selector',
     'CredentialManager',
 ]
@@ -66,6 +67,9 @@ def initialise_debugging(log=None):
 
 def initialise_sentry(log=None):
     if os.environ.get("SENTRY_KEY") and os.environ.get("SENTRY_PROJECT"):
+        # Only imported when Sentry is enabled, as it is slow to import.
+        import sentry_sdk
+        from sentry_sdk.integrations.flask import FlaskIntegration
         SENTRY_ENV_TAG = os.environ.get("SENTRY_ENV_TAG") if os.environ.get("SENTRY_ENV_TAG") else "dev"
         sentry_sdk.init(
             dsn="https://%s@sentry.io/%s" % (os.environ["SENTRY_KEY"], os.environ["SENTRY_PROJECT"]),
@@ -203,11 +207,27 @@ def initialise_prometheus(app, log=None):
     # Prometheus
     if os.environ.get("prometheus_multiproc_dir", False):
         metrics = GunicornInternalPrometheusMetrics(app)
+        initialise_cube_pool_metrics()
         if log:
             log.info("Prometheus metrics enabled")
         return metrics
     return FakeMetrics()
 
+def initialise_cube_pool_metrics():
+    if CubePool.metrics is not None:
+        return
+    CubePool.metrics = {
+        "in_use": Gauge("ows_cube_pool_in_use", "Datacube objects checked out of the cube pool",
+                        ["app"], multiprocess_mode="livesum"),
+        "idle": Gauge("ows_cube_pool_idle", "Idle Datacube objects in the cube pool",
+                      ["app"], multiprocess_mode="livesum"),
+        "waiting": Gauge("ows_cube_pool_waiting", "Threads waiting for a Datacube object from the cube pool",
+                         ["app"], multiprocess_mode="livesum"),
+        "created": Counter("ows_cube_pool_created", "Datacube objects created", ["app"]),
+        "discarded": Counter("ows_cube_pool_discarded", "Datacube objects recycled or discarded as invalid",
+                             ["app"]),
+    }
+
 def request_extractor():
     qreq = request.args.get('request')
     return qreq
@@ -3,6 +3,7 @@
 #
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
+import copyreg
 import io
 import logging
 from typing import (Any, Iterable, List, Mapping, MutableMapping, Optional,
@@ -11,6 +12,7 @@ from typing import (Any, Iterable, List, Mapping, MutableMapping, Optional,
 import datacube.model
 import numpy as np
 import xarray as xr
+from colour import Color
 from flask_babel import get_locale
 from PIL import Image
 
@@ -29,6 +31,18 @@ from datacube_ows.ogc_utils import ConfigException, FunctionWrapper
 _LOG: logging.Logger = logging.getLogger(__name__)
 
 
+def _reduce_color(color: Color):
+    # colour.Color objects hold a lambda, so cannot be pickled by default (e.g. in a configuration snapshot).
+    return (Color, (), {"_hsl": color.hsl})
+
+
+copyreg.pickle(Color, _reduce_color)
+
+
+def _identity(x: Any) -> Any:
+    return x
+
+
 class LegendBase(OWSConfigEntry):
     """
     Legend base class.
@@ -383,6 +397,15 @@ class StyleDefBase(OWSExtensibleConfigEntry, OWSMetadataConfig):
         """
         raise NotImplementedError()
 
+    def image_palette(self) -> Optional[List[Tuple[int, int, int, int]]]:
+        """
+        The RGBA colours single-date images rendered by this style are drawn from, if known in advance.
+        Allows images to be written with indexed colour.  Over-ridden by subclasses.
+
+        :return: A list of RGBA uint8 tuples, or None
+        """
+        return None
+
     def render_legend(self, dates: Union[int, List[Any]]) -> Optional["PIL.Image.Image"]:
         """
         Render legend, if possible
@@ -517,7 +540,7 @@ class StyleDefBase(OWSExtensibleConfigEntry, OWSMetadataConfig):
                                                   cast(CFG_DICT, cfg["aggregator_function"]),
                                                                              stand_alone=self.style.stand_alone)
             elif self.animate:
-                self.aggregator = FunctionWrapper(style.product, lambda x: x, stand_alone=True)
+                self.aggregator = FunctionWrapper(style.product, _identity, stand_alone=True)
                 self.frame_duration = cast(int, cfg.get("frame_duration", 1000))
             else:
                 self.aggregator = None
@@ -6,18 +6,18 @@
 import io
 import logging
 from datetime import datetime
-from typing import Callable, List, MutableMapping, Optional, Union, cast
+from typing import (Any, Callable, List, Mapping, MutableMapping, Optional,
+                    Tuple, Union, cast)
 
 import numpy
 import xarray
 from colour import Color
 from datacube.utils.masking import make_mask
-from matplotlib import patches as mpatches
-from matplotlib import pyplot as plt
 from xarray import DataArray, Dataset
 
 from datacube_ows.config_utils import (CFG_DICT, AbstractMaskRule,
                                        ConfigException, OWSMetadataConfig)
+from datacube_ows.legend_utils import pyplot
 from datacube_ows.styles.base import StyleDefBase
 
 _LOG = logging.getLogger(__name__)
@@ -227,9 +227,160 @@ def convert_to_uint8(fval):
     return clipped
 
 
+class ValueMapLUT:
+    """
+    The value map rules for a band, compiled to an RGBA lookup table over every possible value of an integer dtype.
+    """
+    # Largest integer dtype (in bytes) that LUTs are built for.
+    max_itemsize = 2
+
+    def __init__(self, rules: List[AbstractValueMapRule], dtype: numpy.dtype, attrs: Mapping[str, Any]) -> None:
+        """
+        Compile a lookup table.  Use ValueMapLUT.compile()
+
+        :param rules: The value map rules for the band
+        :param dtype: The integer dtype of the band data
+        :param attrs: The attributes of the band data (e.g. flags_definition)
+        """
+        info = numpy.iinfo(dtype)
+        self.dtype = dtype
+        self.offset = -int(info.min)
+        domain = DataArray(numpy.arange(info.min, info.max + 1, dtype=dtype), dims=["value"], attrs=dict(attrs))
+        self.rgba = numpy.zeros((len(domain), 4), dtype="uint8")
+        self.matched = numpy.zeros(len(domain), dtype="bool")
+        # Earlier rules take precedence, as in apply_value_map.
+        for rule in reversed(rules):
+            mask = numpy.asarray(rule.create_mask(domain))
+            self.rgba[mask] = [
+                convert_to_uint8(rule.rgb.red),
+                convert_to_uint8(rule.rgb.green),
+                convert_to_uint8(rule.rgb.blue),
+                convert_to_uint8(rule.alpha),
+            ]
+            self.matched |= mask
+
+    @classmethod
+    def compile(cls, rules: List[AbstractValueMapRule],
+                dtype: numpy.dtype, attrs: Mapping[str, Any]) -> Optional["ValueMapLUT"]:
+        """
+        Compile a lookup table.
+
+        :return: A lookup table, or None if the rules cannot be compiled for this dtype.
+        """
+        if dtype.kind not in "ui" or dtype.itemsize > cls.max_itemsize:
+            return None
+        try:
+            return cls(rules, dtype, attrs)
+        except Exception as e: # pylint: disable=broad-except
+            # E.g. flag rules that cannot be evaluated for this dtype - fall back to rule-by-rule evaluation
+            _LOG.debug("Could not compile value map LUT for %s: %s", str(dtype), str(e))
+            return None
+
+    @classmethod
+    def lut_dtype(cls, values: numpy.ndarray) -> Optional[numpy.dtype]:
+        """
+        The dtype to look up values in, or None if values are not suitable for LUT lookup.
+
+        Wider integer types are narrowed if all values fit in a 16 bit type.
+        """
+        if values.dtype.kind not in "ui":
+            return None
+        if values.dtype.itemsize <= cls.max_itemsize:
+            return values.dtype
+        if values.size == 0:
+            return None
+        vmin, vmax = values.min(), values.max()
+        if vmin >= 0 and vmax <= 65535:
+            return numpy.dtype("uint16")
+        if vmin >= -32768 and vmax <= 32767:
+            return numpy.dtype("int16")
+        return None
+
+    def lookup(self, values: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Look up values
+
+        :param values: Integer data
+        :return: A tuple of an (..., 4) uint8 rgba array and a boolean array, True where a rule matched.
+        """
+        idx = values.astype(self.dtype, copy=False)
+        if self.offset:
+            idx = idx.astype("int32") + self.offset
+        return self.rgba.take(idx, axis=0), self.matched.take(idx)
+
+
+def lut_value_map(value_map: MutableMapping[str, List[AbstractValueMapRule]],
+                  data: Dataset,
+                  band_mapper: Callable[[str], str],
+                  luts: MutableMapping[Tuple[str, str], Optional[ValueMapLUT]]) -> Optional[Dataset]:
+    """
+    Apply a value map using compiled lookup tables.
+
+    :param luts: Cache of compiled LUTs, keyed by (band, dtype)
+    :return: As for apply_value_map, or None if the value map cannot be applied by lookup table for this data.
+    """
+    band_lookups = []
+    for cfg_band, rules in value_map.items():
+        bdata = cast(DataArray, data[band_mapper(cfg_band)])
+        if bdata.dtype.kind == 'f':
+            # Convert back to int for bitmasking
+            bdata = ColorMapStyleDef.reint(bdata)
+        lut_dtype = ValueMapLUT.lut_dtype(bdata.values)
+        if lut_dtype is None:
+            return None
+        key = (cfg_band, lut_dtype.str)
+        if key not in luts:
+            luts[key] = ValueMapLUT.compile(rules, lut_dtype, bdata.attrs)
+        lut = luts[key]
+        if lut is None:
+            return None
+        band_lookups.append((bdata, lut))
+    if not band_lookups or any(bdata.dims != band_lookups[0][0].dims for bdata, lut in band_lookups):
+        return None
+    rgba: Optional[numpy.ndarray] = None
+    for bdata, lut in band_lookups:
+        band_rgba, matched = lut.lookup(bdata.values)
+        if rgba is None:
+            rgba = band_rgba
+        else:
+            rgba[matched] = band_rgba[matched]
+    bdata = band_lookups[0][0]
+    coords = {k: v for k, v in bdata.coords.items() if k != "time" or "time" in bdata.dims}
+    return Dataset({
+        channel: DataArray(rgba[..., i], dims=bdata.dims, coords=coords)
+        for i, channel in enumerate(("red", "green", "blue", "alpha"))
+    })
+
+
+def value_map_palette(value_map: MutableMapping[str, List[AbstractValueMapRule]]) -> List[Tuple[int, int, int, int]]:
+    """
+    The RGBA colours an image rendered from a value map can contain.
+
+    :param value_map: A value map
+    :return: A list of RGBA uint8 tuples, including transparent for unmatched pixels.
+    """
+    palette = [(0, 0, 0, 0)]
+    for rules in value_map.values():
+        for rule in rules:
+            colour = (
+                convert_to_uint8(rule.rgb.red),
+                convert_to_uint8(rule.rgb.green),
+                convert_to_uint8(rule.rgb.blue),
+                convert_to_uint8(rule.alpha),
+            )
+            if colour not in palette:
+                palette.append(colour)
+    return palette
+
+
 def apply_value_map(value_map: MutableMapping[str, List[AbstractValueMapRule]],
                     data: Dataset,
-                    band_mapper: Callable[[str], str]) -> Dataset:
+                    band_mapper: Callable[[str], str],
+                    luts: Optional[MutableMapping[Tuple[str, str], Optional[ValueMapLUT]]] = None) -> Dataset:
+    if luts is not None:
+        imgdata = lut_value_map(value_map, data, band_mapper, luts)
+        if imgdata is not None:
+            return imgdata
     imgdata = Dataset(coords={k: v for k, v in data.coords.items() if k != "time"})
     shape = list(imgdata.dims.values())
     for channel in ("red", "green", "blue", "alpha"):
@@ -282,6 +433,8 @@ class ColorMapLegendBase(StyleDefBase.Legend, OWSMetadataConfig):
         self.parse_metadata(self._raw_cfg)
 
     def render(self, bytesio: io.BytesIO) -> None:
+        from matplotlib import patches as mpatches
+        plt = pyplot()
         patches = [
             mpatches.Patch(color=pt.colour, label=self.patch_label(pt.idx))
             for pt in self.patches
@@ -336,6 +489,34 @@ class ColorMapStyleDef(StyleDefBase):
             mdh.legend_cfg.register_value_map(mdh.value_map)
         for band in self.value_map.keys():
             self.raw_needed_bands.add(band)
+        self.value_map_luts: MutableMapping[Tuple[str, str], Optional[ValueMapLUT]] = {}
+        self.palette = value_map_palette(self.value_map)
+
+    def image_palette(self) -> Optional[List[Tuple[int, int, int, int]]]:
+        return self.palette
+
+    def make_ready(self, dc: "datacube.Datacube", *args, **kwargs) -> None:
+        super().make_ready(dc, *args, **kwargs)
+        if not self.stand_alone:
+            self.compile_value_map_luts()
+
+    def compile_value_map_luts(self) -> None:
+        """
+        Compile lookup tables for the value map for the native dtypes of the layer's bands.
+
+        LUTs for other dtypes (e.g. after masking or aggregation) are compiled on first use.
+        """
+        band_idx = self.product.band_idx
+        for cfg_band, rules in self.value_map.items():
+            dtype = band_idx.dtype_val(cfg_band)
+            key = (cfg_band, dtype.str)
+            if key in self.value_map_luts:
+                continue
+            attrs = {}
+            flags_def = band_idx.native_bands.loc[band_idx.band(cfg_band)].get("flags_definition")
+            if isinstance(flags_def, Mapping):
+                attrs["flags_definition"] = flags_def
+            self.value_map_luts[key] = ValueMapLUT.compile(rules, dtype, attrs)
 
     @staticmethod
     def reint(data: DataArray) -> DataArray:
@@ -380,7 +561,7 @@ class ColorMapStyleDef(StyleDefBase):
         #            data[band] = data[band].where(extent_mask, other=data[band].attrs['nodata'])
         #        except AttributeError:
         #            data[band] = data[band].where(extent_mask)
-        return apply_value_map(self.value_map, data, self.product.band_idx.band)
+        return apply_value_map(self.value_map, data, self.product.band_idx.band, self.value_map_luts)
 
     class Legend(ColorMapLegendBase):
         pass
@@ -398,6 +579,7 @@ class ColorMapStyleDef(StyleDefBase):
             """
             super().__init__(style, cfg)
             self._value_map: Optional[MutableMapping[str, AbstractValueMapRule]] = None
+            self.value_map_luts: MutableMapping[Tuple[str, str], Optional[ValueMapLUT]] = {}
             if self.animate:
                 if "value_map" in self._raw_cfg:
                     raise ConfigException("Multidate value maps not supported for animation handlers")
@@ -419,10 +601,16 @@ class ColorMapStyleDef(StyleDefBase):
             :return: RGBA image xarray.  May have a time dimension
             """
             if self.aggregator is None:
-                return apply_value_map(self.value_map, data, self.style.product.band_idx.band)
+                if self.value_map is self.style.value_map:
+                    # Animated - share the style's value map and LUTs.
+                    luts = self.style.value_map_luts
+                else:
+                    # Multi-date value map rules are not compiled.
+                    luts = None
+                return apply_value_map(self.value_map, data, self.style.product.band_idx.band, luts)
             else:
                 agg = self.aggregator(data)
-                return apply_value_map(self.value_map, agg, self.style.product.band_idx.band)
+                return apply_value_map(self.value_map, agg, self.style.product.band_idx.band, self.value_map_luts)
 
         class Legend(ColorMapLegendBase):
             pass
@@ -11,7 +11,7 @@ from datacube_ows.config_utils import CFG_DICT
 from datacube_ows.ogc_utils import ConfigException
 from datacube_ows.styles.base import StyleDefBase
 from datacube_ows.styles.component import ComponentStyleDef
-from datacube_ows.styles.ramp import ColorRampDef
+from datacube_ows.styles.ramp import RGBA_CHANNELS, ColorRampDef
 
 
 class HybridStyleDef(ColorRampDef, ComponentStyleDef):
@@ -54,8 +54,9 @@ class HybridStyleDef(ColorRampDef, ComponentStyleDef):
         imgdata = Dataset(coords=data)
 
         d: DataArray = data['index_function']
+        ramp_rgba = self.color_ramp.get_8bit_values(d)
         for band, intensity in self.rgb_components.items():
-            rampdata = DataArray(self.color_ramp.get_value(d, band),
+            rampdata = DataArray(ramp_rgba[..., RGBA_CHANNELS.index(band)],
                                  coords=d.coords,
                                  dims=d.dims)
             component_band_data: Optional[DataArray] = None
@@ -70,7 +71,7 @@ class HybridStyleDef(ColorRampDef, ComponentStyleDef):
                     component_band_data = imgband_component_data
                 if band != "alpha":
                     component_band_data = self.compress_band(band, component_band_data)
-            img_band_data = (rampdata * 255.0 * (1.0 - self.component_ratio)
+            img_band_data = (rampdata * (1.0 - self.component_ratio)
                              + self.component_ratio * cast(DataArray,
                                                            component_band_data))
             imgdata[band] = (d.dims, img_band_data.astype("uint8").data)
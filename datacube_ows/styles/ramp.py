@@ -11,11 +11,8 @@ from math import isclose
 from typing import (Any, Hashable, List, MutableMapping, Optional, Tuple,
                     Union, cast)
 
-import matplotlib
 import numpy
 from colour import Color
-from matplotlib import pyplot as plt
-from matplotlib.colors import LinearSegmentedColormap, to_hex
 
 try:
     from numpy.typing import NDArray
@@ -25,15 +22,17 @@ except ImportError:
 from xarray import Dataset
 
 from datacube_ows.config_utils import CFG_DICT, OWSMetadataConfig
+from datacube_ows.legend_utils import get_mpl_cmap, pyplot
 from datacube_ows.ogc_utils import ConfigException, FunctionWrapper
 from datacube_ows.styles.base import StyleDefBase
 from datacube_ows.styles.expression import Expression
 
 _LOG = logging.getLogger(__name__)
-matplotlib.use('Agg')
 
 RAMP_SPEC = List[CFG_DICT]
 
+RGBA_CHANNELS = ("red", "green", "blue", "alpha")
+
 UNSCALED_DEFAULT_RAMP = cast(RAMP_SPEC,
                              [
                                 {
@@ -139,9 +138,10 @@ def read_mpl_ramp(mpl_ramp: str) -> RAMP_SPEC:
     :param mpl_ramp: The name of Matplotlib colour ramp
     :return: A normalised ramp specification.
     """
+    from matplotlib.colors import to_hex
     unscaled_cmap = cast(RAMP_SPEC, [])
     try:
-        cmap = plt.get_cmap(mpl_ramp)
+        cmap = get_mpl_cmap(mpl_ramp)
     except:
         raise ConfigException(f"Invalid Matplotlib name: {mpl_ramp}")
     val_range = numpy.arange(0.1, 1.1, 0.1)
@@ -188,6 +188,10 @@ class ColorRamp:
 
         self.values = cast(List[float], [])
         self.components = cast(MutableMapping[str, List[float]], {})
+        self.lut: Optional[NDArray] = None
+        self.lut_origin: Optional[float] = None
+        self.lut_scale: Optional[float] = None
+        self.lut_size: Optional[int] = None
         self.crack_ramp()
 
         # Handle the mutual interdepencies between the ramp and the legend
@@ -240,6 +244,10 @@ class ColorRamp:
             if not leg_end_in_ramp or not leg_begin_in_ramp:
                 self.crack_ramp()
 
+    # Bounds on the number of entries in the precomputed lookup table.
+    min_lut_size = 256
+    max_lut_size = 65536
+
     def crack_ramp(self) -> None:
         values, r, g, b, a = crack_ramp(self.ramp)
         self.values = values
@@ -249,6 +257,70 @@ class ColorRamp:
             "blue": b,
             "alpha": a
         }
+        self.build_lut()
+
+    def build_lut(self) -> None:
+        """
+        Precompute a dense, quantised RGBA lookup table over the value range of the ramp.
+
+        The table is sized so that no channel changes by more than one 8-bit level between adjacent
+        entries (up to max_lut_size entries).  Values are mapped to the first entry at or above them,
+        so steps in the ramp (e.g. the -1e-24/0.0 step in the default ramp) fall on the correct side,
+        and the entries that the ramp's breakpoints map to are set to the exact breakpoint colours.
+        Separate entries hold the colours that values below and above the ramp are clamped to, and a final
+        fully transparent entry is used for NaN.
+        """
+        self.lut = None
+        values = numpy.array(self.values, dtype="float64")
+        if len(values) < 2 or not numpy.all(numpy.isfinite(values)):
+            return
+        widths = numpy.diff(values)
+        if numpy.any(widths < 0):
+            return
+        v_range = values[-1] - values[0]
+        if v_range <= 0:
+            return
+        components = numpy.array([self.components[band] for band in RGBA_CHANNELS],
+                                 dtype="float64")
+        # Segments too narrow to resolve are treated as steps.
+        resolvable = widths > v_range / self.max_lut_size
+        if numpy.any(resolvable):
+            slopes = numpy.abs(numpy.diff(components, axis=1))[:, resolvable] / widths[resolvable]
+            size = int(numpy.ceil(v_range * slopes.max() * 255)) + 1
+        else:
+            size = self.min_lut_size
+        size = min(max(size, self.min_lut_size), self.max_lut_size)
+        self.lut_origin = values[0]
+        self.lut_scale = (size - 1) / v_range
+        self.lut_size = size
+        # Below range, grid, above range, NaN
+        points = numpy.concatenate([
+            values[:1] - 1.0,
+            numpy.linspace(values[0], values[-1], size),
+            values[-1:] + 1.0,
+        ])
+        lut = numpy.zeros((size + 3, 4), dtype="uint8")
+        for i, channel in enumerate(components):
+            lut[:-1, i] = (numpy.interp(points, values, channel) * 255).astype("uint8")
+        # Make sure the ramp's own breakpoints map to exactly the colour they map to without the table.
+        bp_idx = self.lut_index(values)
+        for i, channel in enumerate(components):
+            lut[bp_idx, i] = (numpy.interp(values, values, channel) * 255).astype("uint8")
+        self.lut = lut
+
+    def lut_index(self, data: "xarray.DataArray") -> NDArray:
+        """
+        Map data values to lookup table indexes.
+        """
+        idx = numpy.asarray(data, dtype="float64") - self.lut_origin
+        idx *= self.lut_scale
+        below = idx < 0
+        numpy.ceil(idx, out=idx)
+        numpy.clip(idx, 0, self.lut_size, out=idx)
+        idx += 1
+        idx[below] = 0
+        idx[numpy.isnan(idx)] = self.lut_size + 2
+        return idx.astype("intp")
 
     def get_value(self, data: Union[float, "xarray.DataArray"], band: str) -> NDArray:
         return numpy.interp(data, self.values, self.components[band])
@@ -258,10 +330,25 @@ class ColorRamp:
         val = cast(NDArray, val * 255)
         return val.astype("uint8")
 
+    def get_8bit_values(self, data: "xarray.DataArray") -> NDArray:
+        """
+        Map data values to 8 bit RGBA.
+
+        :param data: Index values
+        :return: A uint8 array with the shape of data plus a trailing RGBA axis of length 4.
+        """
+        if self.lut is None:
+            return numpy.stack(
+                [self.get_8bit_value(data, band) for band in RGBA_CHANNELS],
+                axis=-1
+            )
+        return self.lut[self.lut_index(data)]
+
     def apply(self, data: "xarray.DataArray") -> "xarray.Dataset":
+        rgba = self.get_8bit_values(data)
         imgdata = cast(MutableMapping[Hashable, Any], {})
-        for band in self.components:
-            imgdata[band] = (data.dims, self.get_8bit_value(data, band))
+        for i, band in enumerate(RGBA_CHANNELS):
+            imgdata[band] = (data.dims, rgba[..., i])
         imgdataset = Dataset(imgdata, coords=data.coords)
         return imgdataset
 
@@ -471,6 +558,9 @@ class RampLegendBase(StyleDefBase.Legend, OWSMetadataConfig):
         return f"{self.style.product.name}_{self.style.name}"
 
     def render(self, bytesio: io.BytesIO) -> None:
+        from matplotlib.colorbar import ColorbarBase
+        from matplotlib.colors import LinearSegmentedColormap
+        plt = pyplot()
         cdict, ticks = self.create_cdict_ticks()
         plt.rcdefaults()
         if self.mpl_rcparams:
@@ -478,7 +568,7 @@ class RampLegendBase(StyleDefBase.Legend, OWSMetadataConfig):
         fig = plt.figure(figsize=(self.width, self.height))
         ax = fig.add_axes(self.strip_location)
         custom_map = LinearSegmentedColormap(self.plot_name(), cdict)
-        color_bar = matplotlib.colorbar.ColorbarBase(
+        color_bar = ColorbarBase(
             ax,
             cmap=custom_map,
             orientation="horizontal")
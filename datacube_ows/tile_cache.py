@@ -0,0 +1,344 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from typing import Iterable, Mapping, MutableMapping, Optional, Tuple
+from urllib.parse import quote
+
+from datacube_ows.config_utils import CFG_DICT, OWSConfigEntry
+from datacube_ows.ogc_utils import ConfigException
+
+_LOG = logging.getLogger(__name__)
+
+TILE_KEY = Tuple[str, str, str, str, str, str, str, str]
+CACHED_TILE = Tuple[bytes, MutableMapping[str, str]]
+
+
+class TileCache(OWSConfigEntry, metaclass=ABCMeta):
+    """
+    Persistent cache of rendered WMTS tiles.
+
+    Tiles are keyed by (layer, style, tile matrix set, tile matrix, row, col, time, format) and
+    are shared between all worker processes using the same backing store.  The cache is size
+    bounded, evicting least-recently-used tiles first, and is invalidated per layer whenever
+    the layer's ranges are updated.
+
+    Eviction runs in a background thread, so writing a tile never waits for it.  Each process
+    keeps a running total of the size and number of tiles, as of its last eviction pass plus
+    its own writes since, and starts an eviction pass when the total exceeds the size limits or
+    every eviction_check_interval writes (to allow for tiles written by other processes).
+    """
+    backends: MutableMapping[str, type] = {}
+
+    # Check size limits at least every n writes (per process)
+    eviction_check_interval = 100
+    # Evict down to this fraction of the size limits.
+    eviction_low_water = 0.9
+
+    def __init__(self, cfg: CFG_DICT) -> None:
+        super().__init__(cfg)
+        self.path = cfg.get("path")
+        if not self.path:
+            raise ConfigException("Tile cache configuration must specify a path")
+        try:
+            self.max_size = int(float(cfg.get("max_size_mb", 1024)) * 1024 * 1024)
+            max_entries = cfg.get("max_entries")
+            self.max_entries: Optional[int] = int(max_entries) if max_entries is not None else None
+        except (ValueError, TypeError):
+            raise ConfigException("Tile cache max_size_mb and max_entries must be numeric")
+        if self.max_size <= 0 or (self.max_entries is not None and self.max_entries <= 0):
+            raise ConfigException("Tile cache max_size_mb and max_entries must be positive")
+        self._puts_since_check = 0
+        self._size = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._eviction_thread: Optional[threading.Thread] = None
+
+    def __reduce__(self):
+        # Locks and database connections cannot be pickled (e.g. in a configuration snapshot),
+        # so pickled tile caches are recreated from their configuration.
+        return (TileCache.from_config, (self._raw_cfg,))
+
+    @classmethod
+    def register_backend(cls, name: str, backend: type) -> None:
+        cls.backends[name] = backend
+
+    @classmethod
+    def from_config(cls, cfg: Optional[CFG_DICT]) -> Optional["TileCache"]:
+        """
+        Create a tile cache from the "tile_cache" entry of the wmts section.
+
+        :param cfg: The tile_cache configuration.  None means tile caching is disabled.
+        :return: A tile cache or None
+        """
+        if not cfg:
+            return None
+        backend = cfg.get("backend", "filesystem")
+        if backend not in cls.backends:
+            raise ConfigException(f"Unknown tile cache backend: {backend}")
+        return cls.backends[backend](cfg)
+
+    @staticmethod
+    def tile_key(layer: str, style: str, tms: str, tile_matrix: int, row: int, col: int,
+                 time_: str, fmt: str) -> TILE_KEY:
+        return (layer, style, tms, str(tile_matrix), str(row), str(col), time_, fmt)
+
+    @staticmethod
+    def key_hash(key: TILE_KEY) -> str:
+        return hashlib.sha1("\x1f".join(key).encode("utf-8")).hexdigest()
+
+    @abstractmethod
+    def fetch(self, key: TILE_KEY) -> Optional[CACHED_TILE]:
+        """
+        Fetch a tile from the cache.
+
+        :param key: A tile key, as returned by tile_key()
+        :return: A (body, headers) tuple or None if the tile is not cached.
+        """
+
+    def put(self, key: TILE_KEY, body: bytes, headers: Mapping[str, str]) -> None:
+        """
+        Write a rendered tile to the cache, and start an eviction pass in the background if one is due.
+
+        :param key: A tile key, as returned by tile_key()
+        :param body: The encoded image
+        :param headers: The response headers to return with the image
+        """
+        if not self._write(key, body, headers):
+            return
+        with self._lock:
+            self._size += len(body)
+            self._count += 1
+            self._puts_since_check += 1
+            if (self._puts_since_check < self.eviction_check_interval
+                    and not self._over_limits(self._size, self._count)):
+                return
+            if self._eviction_thread is not None and self._eviction_thread.is_alive():
+                return
+            self._puts_since_check = 0
+            self._eviction_thread = threading.Thread(target=self._background_evict,
+                                                     name="tile-cache-eviction", daemon=True)
+            self._eviction_thread.start()
+
+    def _background_evict(self) -> None:
+        try:
+            self.evict()
+        except Exception as e:  # pylint: disable=broad-except
+            _LOG.warning("Tile cache eviction failed for %s: %s", self.path, str(e))
+
+    @abstractmethod
+    def invalidate(self, layer: str) -> None:
+        """
+        Remove all cached tiles for a layer.
+        """
+
+    def invalidate_layers(self, layers: Iterable[str]) -> None:
+        for layer in layers:
+            _LOG.info("Invalidating cached tiles for layer %s", layer)
+            self.invalidate(layer)
+
+    def evict(self) -> None:
+        """
+        Remove least recently used tiles until the cache is within its size limits.
+        """
+        size, count = self._evict()
+        with self._lock:
+            self._size, self._count = size, count
+
+    @abstractmethod
+    def _evict(self) -> Tuple[int, int]:
+        """
+        Remove least recently used tiles until the cache is within its size limits.
+
+        :return: The total size and number of the remaining tiles
+        """
+
+    @abstractmethod
+    def _write(self, key: TILE_KEY, body: bytes, headers: Mapping[str, str]) -> bool:
+        """
+        :return: True if the tile was written
+        """
+
+    def _targets(self) -> Tuple[int, Optional[int]]:
+        max_entries = None
+        if self.max_entries is not None:
+            max_entries = int(self.max_entries * self.eviction_low_water)
+        return int(self.max_size * self.eviction_low_water), max_entries
+
+    def _over_limits(self, size: int, count: int) -> bool:
+        return size > self.max_size or (self.max_entries is not None and count > self.max_entries)
+
+
+class FilesystemTileCache(TileCache):
+    """
+    Tile cache stored as one file per tile under a directory per layer.
+
+    File modification times are used as access times for LRU eviction.
+    """
+    def __init__(self, cfg: CFG_DICT) -> None:
+        super().__init__(cfg)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _layer_dir(self, layer: str) -> str:
+        return os.path.join(self.path, quote(layer, safe=""))
+
+    def _tile_path(self, key: TILE_KEY) -> str:
+        khash = self.key_hash(key)
+        return os.path.join(self._layer_dir(key[0]), khash[:2], khash + ".tile")
+
+    def fetch(self, key: TILE_KEY) -> Optional[CACHED_TILE]:
+        path = self._tile_path(key)
+        try:
+            with open(path, "rb") as fp:
+                headers = json.loads(fp.readline())
+                body = fp.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return body, headers
+
+    def _write(self, key: TILE_KEY, body: bytes, headers: Mapping[str, str]) -> bool:
+        path = self._tile_path(key)
+        tile_dir = os.path.dirname(path)
+        try:
+            os.makedirs(tile_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=tile_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(json.dumps(dict(headers)).encode("utf-8"))
+                fp.write(b"\n")
+                fp.write(body)
+            # Atomic on POSIX - concurrent readers see either the old or new tile, never a partial one.
+            os.replace(tmp_path, path)
+        except OSError as e:
+            _LOG.warning("Could not write to tile cache %s: %s", self.path, str(e))
+            return False
+        return True
+
+    def invalidate(self, layer: str) -> None:
+        shutil.rmtree(self._layer_dir(layer), ignore_errors=True)
+
+    def _evict(self) -> Tuple[int, int]:
+        tiles = []
+        total_size = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for fname in filenames:
+                if not fname.endswith(".tile"):
+                    continue
+                path = os.path.join(dirpath, fname)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                tiles.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        count = len(tiles)
+        if not self._over_limits(total_size, count):
+            return total_size, count
+        target_size, target_count = self._targets()
+        tiles.sort()
+        for _, size, path in tiles:
+            if total_size <= target_size and (target_count is None or count <= target_count):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+            count -= 1
+        return total_size, count
+
+
+class SQLiteTileCache(TileCache):
+    """
+    Tile cache stored in a single SQLite database file.
+    """
+    # Only record a new access time if the recorded one is older than this (seconds)
+    touch_resolution = 60
+
+    def __init__(self, cfg: CFG_DICT) -> None:
+        super().__init__(cfg)
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tiles (
+                    key TEXT PRIMARY KEY,
+                    layer TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_layer ON tiles(layer)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles(accessed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads (or forked processes)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def fetch(self, key: TILE_KEY) -> Optional[CACHED_TILE]:
+        khash = self.key_hash(key)
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT headers, data, accessed FROM tiles WHERE key = ?", (khash,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[2] > self.touch_resolution:
+                conn.execute("UPDATE tiles SET accessed = ? WHERE key = ?", (now, khash))
+        except sqlite3.Error as e:
+            _LOG.warning("Could not read from tile cache %s: %s", self.path, str(e))
+            return None
+        return bytes(row[1]), json.loads(row[0])
+
+    def _write(self, key: TILE_KEY, body: bytes, headers: Mapping[str, str]) -> bool:
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO tiles(key, layer, headers, data, size, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key_hash(key), key[0], json.dumps(dict(headers)), sqlite3.Binary(body), len(body), time.time())
+            )
+        except sqlite3.Error as e:
+            _LOG.warning("Could not write to tile cache %s: %s", self.path, str(e))
+            return False
+        return True
+
+    def invalidate(self, layer: str) -> None:
+        self._conn().execute("DELETE FROM tiles WHERE layer = ?", (layer,))
+
+    def _evict(self) -> Tuple[int, int]:
+        conn = self._conn()
+        count, total_size = conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM tiles").fetchone()
+        if not self._over_limits(total_size, count):
+            return total_size, count
+        target_size, target_count = self._targets()
+        doomed = []
+        for khash, size in conn.execute("SELECT key, size FROM tiles ORDER BY accessed"):
+            if total_size <= target_size and (target_count is None or count <= target_count):
+                break
+            doomed.append((khash,))
+            total_size -= size
+            count -= 1
+        conn.executemany("DELETE FROM tiles WHERE key = ?", doomed)
+        return total_size, count
+
+
+TileCache.register_backend("filesystem", FilesystemTileCache)
+TileCache.register_backend("sqlite", SQLiteTileCache)
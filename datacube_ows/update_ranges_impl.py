@@ -19,20 +19,25 @@ from psycopg2.sql import SQL
 from datacube_ows import __version__
 from datacube_ows.ows_configuration import get_config
 from datacube_ows.product_ranges import add_ranges, get_sqlconn
+from datacube_ows.range_refresher import notify_ranges_updated
 from datacube_ows.startup_utils import initialise_debugging
 
 
 @click.command()
 @click.option("--views", is_flag=True, default=False, help="Refresh the ODC spatio-temporal materialised views.")
 @click.option("--schema", is_flag=True, default=False, help="Create or update the OWS database schema, including the spatio-temporal materialised views.")
+@click.option("--incremental", is_flag=True, default=False, help="Use an incrementally updated spatio-temporal table instead of materialised views. With --schema, (re)create the table. Otherwise update it with datasets added or archived since the last update.")
+@click.option("--partitioned", is_flag=True, default=False, help="With --schema --incremental, partition the spatio-temporal table by product.")
 @click.option("--role", default=None, help="Role to grant database permissions to")
 @click.option("--summary", is_flag=True, default=False, help="Treat any named ODC products with no corresponding configured OWS Layer as summary products")
+@click.option("--solar-dates", type=click.Choice(["sql", "python"]), default="sql", help="Calculate local solar dates in the database (default, fast), or by looking up the timezone of every dataset in Python (slow).")
+@click.option("--jobs", type=click.IntRange(min=1), default=1, help="Number of worker processes to update product ranges with concurrently (default 1).")
 @click.option("--merge-only/--no-merge-only", default=False, help="When used with a multiproduct layer, the ranges for underlying datacube products are not updated.")
 @click.option("--version", is_flag=True, default=False, help="Print version string and exit")
 @click.argument("layers", nargs=-1)
 def main(layers,
-         merge_only, summary,
-         schema, views, role, version):
+         merge_only, summary, solar_dates, jobs,
+         schema, views, incremental, partitioned, role, version):
     """Manage datacube-ows range tables.
 
     Valid invocations:
@@ -40,8 +45,19 @@ def main(layers,
     * update_ranges.py --schema --role myrole
         Create (re-create) the OWS schema (including materialised views) and grants permission to role myrole
 
+    * update_ranges.py --schema --incremental [--partitioned] --role myrole
+        As above, but create an incrementally updated spatio-temporal table (optionally partitioned by product)
+        instead of materialised views
+
     * update_ranges.py --views
-        Refresh the materialised views
+        Refresh the materialised views (or incrementally update the spatio-temporal table)
+
+    * update_ranges.py --incremental
+        Incrementally update the spatio-temporal table with datasets added or archived since the last update
+
+    * update_ranges.py --incremental LAYERS
+        Rebuild the spatio-temporal table entries for the products of the specified LAYERS, then update
+        ranges for the LAYERS
 
     * One or more OWS or ODC layer names
         Update ranges for the specified LAYERS
@@ -66,6 +82,9 @@ def main(layers,
     elif views and layers:
         print("Sorry, cannot update the materialised views and ranges in the same invocation.")
         sys.exit(1)
+    elif partitioned and not (schema and incremental):
+        print("Sorry, partitioning only makes sense for creating an incremental schema, use: '--schema --incremental --partitioned'")
+        sys.exit(1)
     elif schema and not role:
         print("Sorry, cannot update schema without specifying a role, use: '--schema --role myrole'")
         sys.exit(1)
@@ -81,21 +100,42 @@ def main(layers,
         print("Checking schema....")
         print("Creating or replacing WMS database schema...")
         create_schema(dc, role)
-        print("Creating or replacing materialised views...")
-        create_views(dc)
-        print("Done")
-        return 0
-    elif views:
-        print("Refreshing materialised views...")
-        refresh_views(dc)
+        if incremental:
+            print("Creating incrementally updated space-time table...")
+            create_views(dc, incremental=True, partitioned=partitioned)
+        else:
+            print("Creating or replacing materialised views...")
+            create_views(dc)
         print("Done")
         return 0
+    elif views or incremental:
+        if views_are_incremental(dc):
+            if layers:
+                products = odc_products(dc, layers)
+                if products is None:
+                    sys.exit(1)
+                print("Rebuilding space-time table for products:", ", ".join(p.name for p in products))
+                refresh_product_extents(dc, products)
+            else:
+                print("Incrementally updating space-time table...")
+                refresh_views(dc)
+                print("Done")
+                return 0
+        elif incremental:
+            print("Sorry, the incrementally updated space-time table does not exist. "
+                  "Create it with: '--schema --incremental --role myrole'")
+            sys.exit(1)
+        else:
+            print("Refreshing materialised views...")
+            refresh_views(dc)
+            print("Done")
+            return 0
 
     print("Deriving extents from materialised views")
     if not layers:
         layers = list(cfg.product_index.keys())
     try:
-        errors = add_ranges(dc, layers, summary, merge_only)
+        errors = add_ranges(dc, layers, summary, merge_only, sql_solar_dates=solar_dates == "sql", jobs=jobs)
     except (psycopg2.errors.UndefinedColumn,
             sqlalchemy.exc.ProgrammingError):
         print("ERROR: OWS schema or extent materialised views appear to be missing",
@@ -109,7 +149,15 @@ def main(layers,
     return 0
 
 
-def create_views(dc):
+def create_views(dc, incremental=False, partitioned=False):
+    if incremental:
+        # Create the table (copying any existing extents), then bring it up to date with an incremental
+        # update from scratch.
+        run_sql(dc, "extent_views/incremental_create",
+                partitioning="PARTITION BY LIST (dataset_type_ref)" if partitioned else "")
+        run_sql(dc, "extent_views/incremental_update")
+        notify_views_updated(dc)
+        return
     try:
         from datacube.config import LocalConfig
         odc_cfg = LocalConfig.find()
@@ -117,10 +165,87 @@ def create_views(dc):
     except ImportError:
         dbname = os.environ.get("DB_DATABASE")
     run_sql(dc, "extent_views/create", database=dbname)
+    notify_views_updated(dc)
+
+
+def views_are_incremental(dc):
+    """
+    :return: True if space_time_view is an incrementally updated table rather than a materialised view.
+    """
+    conn = get_sqlconn(dc)
+    relkind = conn.execute(
+        sqlalchemy.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('space_time_view')")
+    ).scalar()
+    conn.close()
+    return relkind in ("r", "p")
+
+
+def odc_products(dc, names):
+    """
+    Look up the ODC products for a list of OWS layer and/or ODC product names.
+
+    :return: A list of ODC products, or None if any names are not recognised.
+    """
+    cfg = get_config()
+    products = {}
+    for name in names:
+        ows_product = cfg.product_index.get(name) or cfg.native_product_index.get(name)
+        if ows_product:
+            dc_names = list(ows_product.product_names) + list(ows_product.low_res_product_names)
+        else:
+            dc_names = [name]
+        for dc_name in dc_names:
+            dc_product = dc.index.products.get_by_name(dc_name)
+            if dc_product is None:
+                print("Unrecognised product name:", dc_name)
+                return None
+            products[dc_product.id] = dc_product
+    return list(products.values())
+
+
+def refresh_product_extents(dc, products):
+    """
+    Rebuild the incrementally updated space-time table entries for the nominated ODC products.
+
+    Each product is rebuilt in its own transaction, so other products (and other partitions of a partitioned
+    table) are not affected.
+    """
+    conn = get_sqlconn(dc)
+    conn.execute(sqlalchemy.text("SELECT space_time_view_create_partitions('space_time_view')"))
+    for product in products:
+        print(f"Rebuilding space-time extents for {product.name}")
+        with conn.begin():
+            conn.execute(sqlalchemy.text("DELETE FROM space_time_view WHERE dataset_type_ref = :prod"),
+                         prod=product.id)
+            conn.execute(
+                sqlalchemy.text(
+                    "INSERT INTO space_time_view (id, dataset_type_ref, spatial_extent, temporal_extent) "
+                    "SELECT * FROM space_time_extents('-infinity', CAST(:prod AS SMALLINT))"
+                ),
+                prod=product.id
+            )
+    conn.close()
+    notify_views_updated(dc, [product.name for product in products])
 
 
 def refresh_views(dc):
-    run_sql(dc, "extent_views/refresh")
+    if views_are_incremental(dc):
+        run_sql(dc, "extent_views/incremental_update")
+    else:
+        run_sql(dc, "extent_views/refresh")
+    notify_views_updated(dc)
+
+
+def notify_views_updated(dc, product_names=()):
+    """
+    Notify listening OWS worker processes that the space-time views have changed, so they discard
+    cached dataset searches.
+    """
+    conn = get_sqlconn(dc)
+    try:
+        notify_ranges_updated(conn, ",".join(sorted(product_names)))
+    finally:
+        conn.close()
 
 
 def create_schema(dc, role):
@@ -170,12 +295,15 @@ def run_sql(dc, path, **params):
                 print(f"Required parameter {e} for file {f} not supplied - skipping")
                 continue
             sql = sql.format(**kwargs)
-        if f.endswith("_raw.sql"):
-            q = SQL(sql)
-            with conn.connection.cursor() as psycopg2connection:
-                psycopg2connection.execute(q)
-        else:
-            conn.execute(sql)
+        # Each file runs in its own transaction.  SQLAlchemy only autocommits statements it recognises
+        # as modifying data, which excludes e.g. DO blocks and SELECTs of functions that write.
+        with conn.begin():
+            if f.endswith("_raw.sql"):
+                q = SQL(sql)
+                with conn.connection.cursor() as psycopg2connection:
+                    psycopg2connection.execute(q)
+            else:
+                conn.execute(sql)
     conn.close()
 
 
@@ -4,9 +4,12 @@
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+from threading import Lock
 from time import monotonic
-from typing import Any, Callable, TypeVar
+from typing import Any, Callable, MutableMapping, Tuple, TypeVar
 
 F = TypeVar('F', bound=Callable[..., Any])
 
@@ -68,3 +71,30 @@ def get_sqlconn(dc: "datacube.Datacube") -> "sqlalchemy.engine.base.Connection":
     """
     # pylint: disable=protected-access
     return dc.index._db._engine.connect()
+
+
+_thread_pools: MutableMapping[Tuple[str, int, int], ThreadPoolExecutor] = {}
+_thread_pools_lock = Lock()
+
+
+def thread_pool(name: str, size: int) -> ThreadPoolExecutor:
+    """
+    Returns a shared, bounded thread pool.
+
+    Pools are shared by all callers requesting the same name and size, so the total
+    number of threads is bounded regardless of the number of concurrent requests.
+    Pools are never shared between processes (e.g. after a fork).
+
+    Tasks submitted to a pool must not wait on other tasks submitted to the same pool.
+
+    :param name: Name of the pool - used as the thread name prefix.
+    :param size: Maximum number of threads in the pool.
+    :return: A ThreadPoolExecutor
+    """
+    key = (name, size, os.getpid())
+    with _thread_pools_lock:
+        pool = _thread_pools.get(key)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix=name)
+            _thread_pools[key] = pool
+        return pool
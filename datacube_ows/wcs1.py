@@ -5,8 +5,15 @@
 # SPDX-License-Identifier: Apache-2.0
 from __future__ import absolute_import, division, print_function
 
+from functools import partial
+
 from flask import render_template
+from markupsafe import Markup
 
+from datacube_ows.capabilities_cache import (capabilities_cache,
+                                             capabilities_response,
+                                             check_update_sequence,
+                                             description_cache)
 from datacube_ows.data import json_response
 from datacube_ows.ogc_exceptions import WCS1Exception
 from datacube_ows.ogc_utils import cache_control_headers, get_service_base_url
@@ -35,7 +42,7 @@ def handle_wcs1(nocase_args):
 
 @log_call
 def get_capabilities(args):
-    # TODO: Handle updatesequence request parameter for cache consistency.
+    check_update_sequence(args, WCS1Exception)
     section = args.get("section")
     if section:
         section = section.lower()
@@ -61,18 +68,20 @@ def get_capabilities(args):
     cfg = get_config()
     url = args.get('Host', args['url_root'])
     base_url = get_service_base_url(cfg.allowed_urls, url)
-    headers = cache_control_headers(cfg.wms_cap_cache_age)
-    headers["Content-Type"] = "application/xml"
-    return (
-        render_template("wcs_capabilities.xml",
-                        show_service=show_service,
-                        show_capability=show_capability,
-                        show_content_metadata=show_content_metadata,
-                        cfg=cfg,
-                        base_url=base_url),
-        200,
-        cfg.response_headers(headers)
-    )
+
+    def render(update_sequence):
+        return (
+            render_template("wcs_capabilities.xml",
+                            show_service=show_service,
+                            show_capability=show_capability,
+                            show_content_metadata=show_content_metadata,
+                            cfg=cfg,
+                            base_url=base_url,
+                            update_sequence=update_sequence),
+            "application/xml"
+        )
+    section_key = (show_service, show_capability, show_content_metadata)
+    return capabilities_response(cfg, args, ("wcs", "1.0.0", base_url, section_key), render)
 
 
 @log_call
@@ -96,13 +105,21 @@ def desc_coverages(args):
         for p in cfg.product_index.values():
             if p.ready and p.wcs:
                 products.append(p)
+
+    def render_offering(product):
+        return Markup(render_template("wcs_coverage_offering.xml", cfg=cfg, product=product))
+    # Coverage offerings are rendered once per layer (and locale), and reused until the layer's ranges change.
+    offerings = [
+        description_cache.get(p.name, ("wcs", "1.0.0"), partial(render_offering, p))
+        for p in products
+    ]
     min_cache_age = min(p.resource_limits.wcs_desc_cache_rule for p in products)
     headers = cache_control_headers(min_cache_age)
     headers["Content-Type"] = "application/xml"
     return (
         render_template("wcs_desc_coverage.xml",
-                        cfg=cfg,
-                        products=products),
+                        offerings=offerings,
+                        update_sequence=capabilities_cache.update_sequence),
         200,
         cfg.response_headers(headers)
     )
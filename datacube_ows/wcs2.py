@@ -3,9 +3,12 @@
 #
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
+import copy
 import logging
+from functools import lru_cache, partial
 
 from flask import request
+from lxml import etree
 from ows.common import WGS84BoundingBox
 from ows.common.v20.decoders import kvp_decode_get_capabilities
 from ows.gml import Grid, IrregularAxis, RegularAxis, SpatioTemporalType
@@ -16,6 +19,9 @@ from ows.wcs.v20.decoders import (kvp_decode_describe_coverage,
                                   kvp_decode_get_coverage)
 from ows.wcs.v21 import encoders as encoders_v21
 
+from datacube_ows.capabilities_cache import (capabilities_response,
+                                             check_update_sequence,
+                                             description_cache)
 from datacube_ows.data import json_response
 from datacube_ows.ogc_exceptions import WCS2Exception
 from datacube_ows.ogc_utils import (cache_control_headers,
@@ -47,6 +53,7 @@ def handle_wcs2(nocase_args):
 
 @log_call
 def get_capabilities(args):
+    check_update_sequence(args, WCS2Exception)
     # Extract layer metadata from Datacube.
     cfg = get_config()
     url = args.get('Host', args['url_root'])
@@ -79,74 +86,72 @@ def get_capabilities(args):
     if 'coveragesummary' in sections:
         include_coverage_summary = True
 
-    capabilities = ServiceCapabilities.with_defaults_v20(
-        service_url =base_url + '/wcs',
-        allowed_operations=[
-            'GetCapabilities', 'DescribeCoverage', 'GetCoverage'
-        ],
-        allow_post=False,
-        title=cfg.title,
-        abstract=cfg.abstract,
-        keywords=cfg.keywords,
-        fees=cfg.fees,
-        access_constraints=[cfg.access_constraints],
-        provider_name='',
-        provider_site='',
-        individual_name=cfg.contact_info.person,
-        organisation_name=cfg.contact_info.organisation,
-        position_name=cfg.contact_info.position,
-        phone_voice=cfg.contact_info.telephone,
-        phone_facsimile=cfg.contact_info.fax,
-        delivery_point=cfg.contact_info.address.address,
-        city=cfg.contact_info.address.city,
-        administrative_area=cfg.contact_info.address.state,
-        postal_code=cfg.contact_info.address.postcode,
-        country=cfg.contact_info.address.country,
-        electronic_mail_address=cfg.contact_info.email,
-        online_resource=base_url,
-        # hours_of_service=,
-        # contact_instructions=,
-        # role=,
-        coverage_summaries=[
-            CoverageSummary(
-                identifier=product.name,
-                coverage_subtype='RectifiedGridCoverage',
-                title=product.title,
-                wgs84_bbox=WGS84BoundingBox([
-                    product.ranges['lon']['min'], product.ranges['lat']['min'],
-                    product.ranges['lon']['max'], product.ranges['lat']['max'],
-                ])
-            )
-            for product in cfg.product_index.values()
-            if product.ready and not product.hide and product.wcs
-        ],
-        formats_supported=[
-            fmt.mime
-            for fmt in cfg.wcs_formats
-            if 2 in fmt.renderers
-        ],
-        crss_supported=[
-            crs  # TODO: conversion to URL format
-            for crs in cfg.published_CRSs
-        ],
-        interpolations_supported=None,  # TODO: find out interpolations
-    )
-    result = encoders_v20.xml_encode_capabilities(
-        capabilities,
-        include_service_identification=include_service_identification,
-        include_service_provider=include_service_provider,
-        include_operations_metadata=include_operations_metadata,
-        include_service_metadata=include_service_metadata,
-        include_coverage_summary=include_coverage_summary
-    )
-
-    headers = cache_control_headers(cfg.wms_cap_cache_age)
-    headers["Content-Type"] = result.content_type
-    return (
-        result.value,
-        200,
-        cfg.response_headers(headers)
-    )
+    def render(update_sequence):
+        capabilities = ServiceCapabilities.with_defaults_v20(
+            service_url =base_url + '/wcs',
+            allowed_operations=[
+                'GetCapabilities', 'DescribeCoverage', 'GetCoverage'
+            ],
+            allow_post=False,
+            update_sequence=update_sequence,
+            title=cfg.title,
+            abstract=cfg.abstract,
+            keywords=cfg.keywords,
+            fees=cfg.fees,
+            access_constraints=[cfg.access_constraints],
+            provider_name='',
+            provider_site='',
+            individual_name=cfg.contact_info.person,
+            organisation_name=cfg.contact_info.organisation,
+            position_name=cfg.contact_info.position,
+            phone_voice=cfg.contact_info.telephone,
+            phone_facsimile=cfg.contact_info.fax,
+            delivery_point=cfg.contact_info.address.address,
+            city=cfg.contact_info.address.city,
+            administrative_area=cfg.contact_info.address.state,
+            postal_code=cfg.contact_info.address.postcode,
+            country=cfg.contact_info.address.country,
+            electronic_mail_address=cfg.contact_info.email,
+            online_resource=base_url,
+            # hours_of_service=,
+            # contact_instructions=,
+            # role=,
+            coverage_summaries=[
+                CoverageSummary(
+                    identifier=product.name,
+                    coverage_subtype='RectifiedGridCoverage',
+                    title=product.title,
+                    wgs84_bbox=WGS84BoundingBox([
+                        product.ranges['lon']['min'], product.ranges['lat']['min'],
+                        product.ranges['lon']['max'], product.ranges['lat']['max'],
+                    ])
+                )
+                for product in cfg.product_index.values()
+                if product.ready and not product.hide and product.wcs
+            ],
+            formats_supported=[
+                fmt.mime
+                for fmt in cfg.wcs_formats
+                if 2 in fmt.renderers
+            ],
+            crss_supported=[
+                crs  # TODO: conversion to URL format
+                for crs in cfg.published_CRSs
+            ],
+            interpolations_supported=None,  # TODO: find out interpolations
+        )
+        result = encoders_v20.xml_encode_capabilities(
+            capabilities,
+            include_service_identification=include_service_identification,
+            include_service_provider=include_service_provider,
+            include_operations_metadata=include_operations_metadata,
+            include_service_metadata=include_service_metadata,
+            include_coverage_summary=include_coverage_summary
+        )
+        return result.value, result.content_type
+    section_key = (include_service_identification, include_service_provider, include_operations_metadata,
+                include_service_metadata, include_coverage_summary)
+    return capabilities_response(cfg, args, ("wcs", "2.0", base_url, section_key), render)
 
 
 def create_coverage_description(cfg, product):
@@ -241,6 +246,37 @@ def create_coverage_description(cfg, product):
     )
 
 
+DESCRIPTION_ENCODERS = {
+    (2, 0): encoders_v20,
+    (2, 1): encoders_v21,
+}
+
+
+@lru_cache()
+def coverage_descriptions_tags(version):
+    """
+    The opening and closing tags of a CoverageDescriptions document.
+    """
+    root = etree.fromstring(DESCRIPTION_ENCODERS[version].xml_encode_coverage_descriptions([]).value)
+    # Empty text forces separate opening and closing tags
+    root.text = ""
+    open_tag, close_tag = etree.tostring(root).rsplit(b"</", 1)
+    return open_tag, b"</" + close_tag
+
+
+def coverage_description_fragment(cfg, product, version):
+    """
+    The encoded CoverageDescription element for a layer.
+    """
+    result = DESCRIPTION_ENCODERS[version].xml_encode_coverage_descriptions(
+        [create_coverage_description(cfg, product)]
+    )
+    element = copy.deepcopy(etree.fromstring(result.value)[0])
+    # Only declare the namespaces the description uses, rather than all those of the document.
+    etree.cleanup_namespaces(element)
+    return etree.tostring(element)
+
+
 @log_call
 def desc_coverages(args):
     cfg = get_config()
@@ -258,26 +294,24 @@ def desc_coverages(args):
                                 WCS2Exception.NO_SUCH_COVERAGE,
                                 locator=coverage_id)
 
-    coverage_descriptions = [
-        create_coverage_description(cfg, product)
-        for product in products
-    ]
-
-    version = request_obj.version
+    version = (request_obj.version.major, request_obj.version.minor)
 
-    if version == (2, 0):
-        result = encoders_v20.xml_encode_coverage_descriptions(coverage_descriptions)
-    elif version == (2, 1):
-        result = encoders_v21.xml_encode_coverage_descriptions(coverage_descriptions)
-    else:
-        raise WCS2Exception("Unsupported version: %s" % version,
+    if version not in DESCRIPTION_ENCODERS:
+        raise WCS2Exception("Unsupported version: %s" % request_obj.version,
                             WCS2Exception.INVALID_PARAMETER_VALUE,
                             locator="version")
+    # Coverage descriptions are encoded once per layer (and locale), and reused until the layer's ranges change.
+    fragments = [
+        description_cache.get(product.name, ("wcs", version),
+                              partial(coverage_description_fragment, cfg, product, version))
+        for product in products
+    ]
+    open_tag, close_tag = coverage_descriptions_tags(version)
     min_cache_age = min(p.resource_limits.wcs_desc_cache_rule for p in products)
     headers = cache_control_headers(min_cache_age)
-    headers["Content-Type"] = result.content_type
+    headers["Content-Type"] = "application/xml"
     return (
-        result.value,
+        b"".join([open_tag, *fragments, close_tag]),
         200,
         resp_headers(headers)
     )
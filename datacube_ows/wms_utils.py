@@ -14,10 +14,10 @@ from affine import Affine
 from datacube.utils import geometry
 from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
-from matplotlib import pyplot as plt
 from pytz import utc
 from rasterio.warp import Resampling
 
+from datacube_ows.legend_utils import get_mpl_cmap
 from datacube_ows.ogc_exceptions import WMSException
 from datacube_ows.ogc_utils import ConfigException, create_geobox
 from datacube_ows.ows_configuration import get_config
@@ -315,7 +315,7 @@ def single_style_from_args(product, args, required=True):
         code = args["code"]
         mpl_ramp = args["colorscheme"]
         try:
-            plt.get_cmap(mpl_ramp)
+            get_mpl_cmap(mpl_ramp)
         except:
             raise WMSException(f"Invalid Matplotlib ramp name: {mpl_ramp}",
                                locator="Colorscalerange parameter")
@@ -9,9 +9,11 @@ import logging
 
 from flask import render_template
 
+from datacube_ows.capabilities_cache import (capabilities_response,
+                                             check_update_sequence)
 from datacube_ows.data import feature_info, get_map
 from datacube_ows.ogc_exceptions import WMSException, WMTSException
-from datacube_ows.ogc_utils import cache_control_headers, get_service_base_url
+from datacube_ows.ogc_utils import get_service_base_url
 from datacube_ows.ows_configuration import get_config
 from datacube_ows.utils import log_call
 
@@ -42,8 +44,8 @@ def handle_wmts(nocase_args):
 
 @log_call
 def get_capabilities(args):
-    # TODO: Handle updatesequence request parameter for cache consistency.
-    # Note: Only WMS v1.0.0 exists at this stage, so no version negotiation is necessary
+    # Note: Only WMTS v1.0.0 exists at this stage, so no version negotiation is necessary
+    check_update_sequence(args, WMTSException)
     # Extract layer metadata from Datacube.
     cfg = get_config()
     url = args.get('Host', args['url_root'])
@@ -85,21 +87,23 @@ def get_capabilities(args):
                 raise WMTSException("Invalid section: %s" % section,
                                 WMTSException.INVALID_PARAMETER_VALUE,
                                 locator="Section parameter")
-    headers = cache_control_headers(cfg.wms_cap_cache_age)
-    headers["Content-Type"] = "application/xml"
-    return (
-        render_template(
-            "wmts_capabilities.xml",
-            cfg=cfg,
-            base_url=base_url,
-            show_service_id=show_service_id,
-            show_service_provider=show_service_provider,
-            show_ops_metadata=show_ops_metadata,
-            show_contents=show_contents,
-            show_themes=show_themes),
-        200,
-        cfg.response_headers(headers)
-    )
+
+    def render(update_sequence):
+        return (
+            render_template(
+                "wmts_capabilities.xml",
+                cfg=cfg,
+                base_url=base_url,
+                show_service_id=show_service_id,
+                show_service_provider=show_service_provider,
+                show_ops_metadata=show_ops_metadata,
+                show_contents=show_contents,
+                show_themes=show_themes,
+                update_sequence=update_sequence),
+            "application/xml"
+        )
+    section_key = (show_service_id, show_service_provider, show_ops_metadata, show_contents, show_themes)
+    return capabilities_response(cfg, args, ("wmts", "1.0.0", base_url, section_key), render)
 
 
 @log_call
@@ -168,13 +172,46 @@ def wmts_args_to_wms(args, cfg):
     return wms_args
 
 
+def tile_cache_key(args, cfg):
+    """
+    Return the tile cache key for a (validated) GetTile request, or None if the tile should not be cached.
+
+    Defaulted style and time parameters are resolved so that explicit and implicit requests for the
+    same tile share a cache entry.
+    """
+    if args.get("ows_stats"):
+        return None
+    layer = cfg.product_index.get(args.get("layer"))
+    if layer is None:
+        return None
+    style = args.get("style") or layer.default_style.name
+    time = args.get("time") or layer.default_time.isoformat()
+    return cfg.tile_cache.tile_key(
+        layer.name, style,
+        args.get("tilematrixset", ""), int(args.get("tilematrix")),
+        int(args.get("tilerow")), int(args.get("tilecol")),
+        time, args.get("format", ""))
+
+
 @log_call
 def get_tile(args):
     cfg = get_config()
     wms_args = wmts_args_to_wms(args, cfg)
 
     try:
-        return get_map(wms_args)
+        if cfg.tile_cache is None:
+            return get_map(wms_args)
+        key = tile_cache_key(args, cfg)
+        if key is None:
+            return get_map(wms_args)
+        cached = cfg.tile_cache.fetch(key)
+        if cached is not None:
+            body, headers = cached
+            return body, 200, headers
+        body, status, headers = get_map(wms_args)
+        if status == 200 and headers.get("Content-Type") == "image/png":
+            cfg.tile_cache.put(key, body, headers)
+        return body, status, headers
     except WMSException as wmse:
         first_error = wmse.errors[0]
         e = WMTSException(first_error["msg"],
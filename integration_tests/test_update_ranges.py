@@ -62,3 +62,42 @@ def test_update_ranges_misuse_cases(runner, role_name, product_name):
     result = runner.invoke(main, ["--schema", product_name])
     assert "Sorry" in result.output
     assert result.exit_code == 1
+
+    result = runner.invoke(main, ["--incremental", "--partitioned"])
+    assert "Sorry" in result.output
+    assert result.exit_code == 1
+
+
+def test_update_ranges_incremental_needs_table(runner, product_name):
+    # The integration test database uses materialised views.
+    result = runner.invoke(main, ["--incremental"])
+    assert "Sorry" in result.output
+    assert "--schema --incremental" in result.output
+    assert result.exit_code == 1
+    result = runner.invoke(main, ["--incremental", product_name])
+    assert "Sorry" in result.output
+    assert result.exit_code == 1
+
+
+def test_solar_dates_sql(product_name):
+    from datacube_ows.cube_pool import cube
+    from datacube_ows.product_ranges import solar_dates_python, solar_dates_sql
+    from datacube_ows.utils import get_sqlconn
+    with cube() as dc:
+        product = dc.index.products.get_by_name(product_name)
+        conn = get_sqlconn(dc)
+        conn.execute("set timezone to 'Etc/UTC'")
+        sql_dates = solar_dates_sql(conn, product.id)
+        assert sql_dates
+        assert sql_dates == sorted(set(sql_dates))
+        # Longitude offsets can disagree with real timezones near local midnight only.
+        py_dates = solar_dates_python(conn, product.id)
+        assert len(set(sql_dates) ^ set(py_dates)) <= len(py_dates) // 10
+        conn.close()
+
+
+def test_update_ranges_parallel(runner):
+    result = runner.invoke(main, ["--jobs", "2"])
+    assert "ERROR" not in result.output
+    assert "failed" not in result.output
+    assert result.exit_code == 0
@@ -109,6 +109,20 @@ def test_getcap_response(ows_server):
         assert wLong.text == geo_bbox.attrib["miny"]
 
 
+def test_getcap_conditional(ows_server):
+    url = ows_server.url + "/wms?request=GetCapabilities&service=WMS&version=1.3.0"
+    resp = requests.get(url, timeout=10)
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    update_sequence = etree.fromstring(resp.content).attrib["updateSequence"]
+
+    resp = requests.get(url, headers={"If-None-Match": etag}, timeout=10)
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+
+    check_wms_error(url + "&updatesequence=" + update_sequence, expected_status_code=400)
+
+
 def test_wms_server(ows_server):
     # Use owslib to confirm that we have a somewhat compliant WMS service
     wms = WebMapService(url=ows_server.url + "/wms", version="1.3.0")
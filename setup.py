@@ -19,7 +19,7 @@ install_requirements = [
     'fsspec',
     'lxml',
     'deepdiff',
-    'matplotlib',
+    'matplotlib>=3.5',  # matplotlib.colormaps registry
     'pyparsing>=2.2.1,<3',  # resolving dependency conflict between matplotlib and packaging
     'numpy',
     'scipy',
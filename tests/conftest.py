@@ -10,6 +10,7 @@ import numpy as np
 import pytest
 import xarray as xr
 
+from datacube_ows.image_encoding import PNGEncoding
 from tests.utils import coords, dim1_da, dim1_da_time, dummy_da
 
 
@@ -98,6 +99,8 @@ def minimal_global_cfg():
     global_cfg = MagicMock()
     global_cfg.keywords = {"global"}
     global_cfg.product_index = {}
+    global_cfg.png_encoding = PNGEncoding({})
+    global_cfg.defer_layer.return_value = False
     global_cfg.attribution.title = "Global Attribution"
     global_cfg.contact_org = None
     global_cfg.contact_position = None
@@ -0,0 +1,196 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from datacube_ows.capabilities_cache import (UPDATE_SEQUENCE_PLACEHOLDER,
+                                             CapabilitiesCache, FragmentCache,
+                                             capabilities_response,
+                                             check_update_sequence,
+                                             etag_matches)
+from datacube_ows.ogc_exceptions import OGCException, WMSException
+
+
+@pytest.fixture
+def caps_cache():
+    cache = CapabilitiesCache(max_entries=2)
+    with patch("datacube_ows.capabilities_cache.capabilities_cache", cache):
+        yield cache
+
+
+@pytest.fixture
+def renderer():
+    render = MagicMock()
+    render.side_effect = lambda seq: (f"<Capabilities updateSequence='{seq}'/>", "application/xml")
+    return render
+
+
+def test_cache_hit(caps_cache, renderer):
+    doc = caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+    assert doc.update_sequence == caps_cache.update_sequence
+    assert doc.body == f"<Capabilities updateSequence='{doc.update_sequence}'/>"
+    assert doc.etag.startswith('"') and doc.etag.endswith('"')
+    assert caps_cache.get(("wms", "1.3.0", "http://a"), renderer) is doc
+    renderer.assert_called_once_with(UPDATE_SEQUENCE_PLACEHOLDER)
+    # Different base url
+    caps_cache.get(("wms", "1.3.0", "http://b"), renderer)
+    assert renderer.call_count == 2
+
+
+def test_cache_per_locale(caps_cache, renderer):
+    with patch("datacube_ows.capabilities_cache.get_locale") as get_locale:
+        get_locale.return_value = "en"
+        caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+        get_locale.return_value = "de"
+        caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+        caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+    assert renderer.call_count == 2
+
+
+def test_cache_invalidate(caps_cache, renderer):
+    doc1 = caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+    caps_cache.invalidate()
+    assert int(caps_cache.update_sequence) > int(doc1.update_sequence)
+    doc2 = caps_cache.get(("wms", "1.3.0", "http://a"), renderer)
+    assert doc2.update_sequence == caps_cache.update_sequence
+    assert doc2.body == f"<Capabilities updateSequence='{doc2.update_sequence}'/>"
+    # Same document apart from the update sequence, so the same ETag.
+    assert doc2.etag == doc1.etag
+    assert renderer.call_count == 2
+
+
+def test_etag_independent_of_update_sequence(renderer):
+    # e.g. in different worker processes
+    cache1 = CapabilitiesCache()
+    cache2 = CapabilitiesCache()
+    cache2.invalidate()
+    doc1 = cache1.get("key", renderer)
+    doc2 = cache2.get("key", renderer)
+    assert doc1.update_sequence != doc2.update_sequence
+    assert doc1.etag == doc2.etag
+
+
+def test_cache_bytes_document(caps_cache):
+    doc = caps_cache.get("key", lambda seq: (f"<Capabilities updateSequence='{seq}'/>".encode("utf-8"),
+                                             "application/xml"))
+    assert doc.body == f"<Capabilities updateSequence='{doc.update_sequence}'/>".encode("utf-8")
+
+
+def test_cache_invalidated_while_rendering(caps_cache):
+    def render(seq):
+        caps_cache.invalidate()
+        return "<Capabilities/>", "application/xml"
+    caps_cache.get(("wms", "1.3.0", "http://a"), render)
+    # Stale document not cached
+    assert not caps_cache._entries
+
+
+def test_cache_lru(caps_cache, renderer):
+    for url in ("http://a", "http://b", "http://a", "http://c"):
+        caps_cache.get(("wms", "1.3.0", url), renderer)
+    assert [k[0][2] for k in caps_cache._entries] == ["http://a", "http://c"]
+
+
+def test_cache_render_error(caps_cache):
+    render = MagicMock(side_effect=Exception("Broken template"))
+    with pytest.raises(Exception):
+        caps_cache.get(("wms", "1.3.0", "http://a"), render)
+    assert not caps_cache._entries
+    assert not caps_cache._render_locks
+
+
+def test_cache_single_render(caps_cache):
+    rendering = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def render(seq):
+        calls.append(seq)
+        rendering.set()
+        release.wait()
+        return "<Capabilities/>", "application/xml"
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(caps_cache.get("key", render)))
+               for i in range(3)]
+    threads[0].start()
+    rendering.wait()
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert len(results) == 3
+    assert results[1] is results[0] and results[2] is results[0]
+
+
+def test_etag_matches():
+    assert not etag_matches(None, '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+    assert etag_matches('"abc"', '"abc"')
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"xyz", "abc"', '"abc"')
+    assert etag_matches("*", '"abc"')
+
+
+def test_check_update_sequence(caps_cache):
+    check_update_sequence({}, WMSException)
+    check_update_sequence({"updatesequence": "0"}, WMSException)
+    # Values from the future (or another worker) are ignored.
+    check_update_sequence({"updatesequence": str(int(caps_cache.update_sequence) + 1000)}, WMSException)
+    with pytest.raises(WMSException) as e:
+        check_update_sequence({"updatesequence": caps_cache.update_sequence}, WMSException)
+    assert e.value.errors[0]["code"] == OGCException.CURRENT_UPDATE_SEQUENCE
+
+
+def test_capabilities_response(caps_cache, renderer):
+    cfg = MagicMock()
+    cfg.wms_cap_cache_age = 0
+    cfg.response_headers.side_effect = lambda d: d
+    body, status, headers = capabilities_response(cfg, {}, ("wms", "1.3.0", "http://a"), renderer)
+    assert status == 200
+    assert body.startswith("<Capabilities")
+    assert headers["Content-Type"] == "application/xml"
+    assert headers["cache-control"] == "no-cache"
+    etag = headers["ETag"]
+    body, status, headers = capabilities_response(cfg, {"if-none-match": etag},
+                                                  ("wms", "1.3.0", "http://a"), renderer)
+    assert status == 304
+    assert body == ""
+    assert headers["ETag"] == etag
+    assert "Content-Type" not in headers
+    renderer.assert_called_once()
+
+
+def test_fragment_cache():
+    cache = FragmentCache()
+    render = MagicMock(side_effect=lambda: "<CoverageOffering/>")
+    assert cache.get("lyr1", "wcs1", render) == "<CoverageOffering/>"
+    cache.get("lyr1", "wcs1", render)
+    assert render.call_count == 1
+    cache.get("lyr2", "wcs1", render)
+    cache.get("lyr1", "wcs2", render)
+    assert render.call_count == 3
+    # Only the invalidated layer is re-rendered
+    cache.invalidate("lyr1")
+    cache.get("lyr1", "wcs1", render)
+    cache.get("lyr2", "wcs1", render)
+    assert render.call_count == 4
+    cache.invalidate()
+    cache.get("lyr2", "wcs1", render)
+    assert render.call_count == 5
+
+
+def test_fragment_cache_invalidated_while_rendering():
+    cache = FragmentCache()
+
+    def render():
+        cache.invalidate("lyr1")
+        return "<CoverageOffering/>"
+    cache.get("lyr1", "wcs1", render)
+    assert not cache._entries
@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0
 import pytest
 
+from datacube_ows.mv_index import search_cache
 from datacube_ows.ogc_utils import ConfigException
 from datacube_ows.ows_configuration import ContactInfo, OWSConfig
 
@@ -262,3 +263,86 @@ def test_bad_integers_in_wms_section(minimal_global_raw_cfg, minimal_dc):
     assert "caps_cache_maxage in wms section cannot be negative" in str(e.value)
     assert "-100" in str(e.value)
 
+
+
+def test_data_loading_default(minimal_global_raw_cfg):
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.data_load_query_threads == 4
+    assert not cfg.data_load_stream_queries
+    assert cfg.search_cache_ttl == 60
+    assert cfg.search_cache_max_entries == 10000
+    assert search_cache.enabled
+    search_cache.configure(0, 10000)
+
+
+def test_data_loading(minimal_global_raw_cfg):
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["data_loading"] = {"query_threads": 1, "stream_dataset_queries": True}
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.data_load_query_threads == 1
+    assert cfg.data_load_stream_queries
+
+
+def test_search_cache_config(minimal_global_raw_cfg):
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["data_loading"] = {"search_cache_ttl": 0, "search_cache_max_entries": 5}
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.search_cache_max_entries == 5
+    assert not search_cache.enabled
+    assert search_cache.max_entries == 5
+    search_cache.configure(0, 10000)
+
+
+@pytest.mark.parametrize("ttl", ["forever", -1])
+def test_search_cache_bad_ttl(minimal_global_raw_cfg, ttl):
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["data_loading"] = {"search_cache_ttl": ttl}
+    with pytest.raises(ConfigException) as excinfo:
+        OWSConfig(cfg=minimal_global_raw_cfg)
+    assert "search_cache_ttl" in str(excinfo.value)
+
+
+@pytest.mark.parametrize("threads", ["many", 0, -2])
+def test_data_loading_bad_threads(minimal_global_raw_cfg, threads):
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["data_loading"] = {"query_threads": threads}
+    with pytest.raises(ConfigException) as excinfo:
+        OWSConfig(cfg=minimal_global_raw_cfg)
+    assert "query_threads" in str(excinfo.value)
+
+
+def test_dynamic_ranges(minimal_global_raw_cfg):
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.range_refresh_interval == 30
+    assert not cfg.range_refresh_listen
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["dynamic_ranges"] = {"refresh_interval": 0, "listen": True}
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.range_refresh_interval == 0
+    assert cfg.range_refresh_listen
+
+
+@pytest.mark.parametrize("interval", ["often", -5])
+def test_dynamic_ranges_bad_interval(minimal_global_raw_cfg, interval):
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["dynamic_ranges"] = {"refresh_interval": interval}
+    with pytest.raises(ConfigException) as excinfo:
+        OWSConfig(cfg=minimal_global_raw_cfg)
+    assert "refresh_interval" in str(excinfo.value)
+
+
+def test_lazy_layers(minimal_global_raw_cfg):
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert not cfg.defer_layer("foo")
+    OWSConfig._instance = None
+    minimal_global_raw_cfg["global"]["lazy_layers"] = True
+    minimal_global_raw_cfg["global"]["warm_layers"] = ["hot"]
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    assert cfg.defer_layer("foo")
+    assert not cfg.defer_layer("hot")
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg, called_from_update_ranges=True)
+    assert not cfg.defer_layer("foo")
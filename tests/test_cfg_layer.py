@@ -10,7 +10,9 @@ from unittest.mock import MagicMock, patch
 import pytest
 
 from datacube_ows.ogc_utils import ConfigException
-from datacube_ows.ows_configuration import OWSFolder, OWSLayer, parse_ows_layer
+from datacube_ows.ows_configuration import (OWSFolder, OWSLayer,
+                                            OWSProductLayer, _lazy_ready_lock,
+                                            parse_ows_layer)
 from datacube_ows.resource_limits import ResourceLimited
 
 
@@ -900,3 +902,89 @@ def test_native_resolution_mismatch(minimal_global_cfg, minimal_layer_cfg, minim
     assert lyr.ready
     assert math.isclose(lyr.resolution_x, 0.001, rel_tol=1e-8)
     assert math.isclose(lyr.resolution_y, 0.001, rel_tol=1e-8)
+
+
+def test_lazy_layer(minimal_layer_cfg, minimal_global_cfg, minimal_dc, mock_range):
+    minimal_global_cfg.defer_layer.return_value = True
+    folder = OWSFolder({
+        "title": "The Title",
+        "abstract": "The Abstract",
+        "layers": [minimal_layer_cfg]
+    }, global_cfg=minimal_global_cfg)
+    folder.make_ready(minimal_dc)
+    lyr = folder.child_layers[0]
+    assert lyr.lazy
+    assert "ready" in lyr._unready_attributes
+    with patch("datacube_ows.product_ranges.get_ranges") as get_rng, \
+            patch("datacube_ows.ows_configuration.cube") as cube:
+        get_rng.return_value = mock_range
+
+        def checkout():
+            # The cube is checked out before the layer's lock is taken
+            assert not _lazy_ready_lock(lyr.name).locked()
+            return minimal_dc
+        cube.return_value.__enter__.side_effect = checkout
+        # First use makes the layer ready
+        assert lyr.ranges == mock_range
+        cube.assert_called_once()
+        assert lyr.ready
+        assert not lyr.hide
+        assert not lyr.lazy
+        assert lyr.products
+        cube.assert_called_once()
+
+
+def test_lazy_layer_failure(minimal_layer_cfg, minimal_global_cfg, minimal_dc):
+    minimal_global_cfg.defer_layer.return_value = True
+    folder = OWSFolder({
+        "title": "The Title",
+        "abstract": "The Abstract",
+        "layers": [minimal_layer_cfg]
+    }, global_cfg=minimal_global_cfg)
+    folder.make_ready(minimal_dc)
+    lyr = folder.child_layers[0]
+    with patch("datacube_ows.ows_configuration.cube") as cube, \
+            patch.object(type(lyr), "make_ready") as make_ready:
+        cube.return_value.__enter__.return_value = minimal_dc
+        make_ready.side_effect = ConfigException("KerPow!")
+        assert not lyr.ready
+        assert lyr.hide
+        with pytest.raises(ConfigException):
+            lyr.products
+    assert folder.child_layers == []
+    assert folder.unready_layers == [lyr]
+
+
+def test_frozen_layer(minimal_layer_cfg, minimal_global_cfg, minimal_dc, mock_range):
+    minimal_global_cfg.internationalised = False
+    lyr = parse_ows_layer(minimal_layer_cfg, global_cfg=minimal_global_cfg)
+    assert not lyr.frozen
+    with patch("datacube_ows.product_ranges.get_ranges") as get_rng:
+        get_rng.return_value = mock_range
+        lyr.make_ready(minimal_dc)
+    assert lyr.frozen
+    assert isinstance(lyr, OWSProductLayer)
+    assert type(lyr).__getattribute__ is object.__getattribute__
+    assert lyr.band_idx.frozen
+    assert lyr.title == "The Title"
+    with patch.object(OWSProductLayer, "resolve_metadata") as resolve:
+        resolve.return_value = "Memoised"
+        lyr._metadata_cache = {}
+        assert lyr.abstract == "Memoised"
+        assert lyr.abstract == "Memoised"
+        resolve.assert_called_once_with("abstract")
+        # Changing the message catalog invalidates memoised metadata
+        OWSProductLayer.set_msg_src(None)
+        assert lyr.abstract == "Memoised"
+        assert resolve.call_count == 2
+    lyr.thaw()
+    assert not lyr.frozen
+    assert type(lyr) is OWSProductLayer
+    assert lyr.title == "The Title"
+
+
+def test_freeze_unready(minimal_layer_cfg, minimal_global_cfg):
+    lyr = parse_ows_layer(minimal_layer_cfg, global_cfg=minimal_global_cfg)
+    with pytest.raises(ConfigException):
+        lyr.freeze()
+    assert not lyr.frozen
@@ -0,0 +1,109 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import pickle
+from unittest.mock import patch
+
+import pytest
+
+from datacube_ows.config_snapshot import (config_fingerprint, load_snapshot,
+                                          read_snapshot, write_snapshot)
+from datacube_ows.ogc_utils import ConfigException
+from datacube_ows.ows_configuration import OWSConfig, get_config
+
+
+@pytest.fixture
+def ready_cfg(minimal_global_raw_cfg, minimal_dc):
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    cfg.make_ready(minimal_dc)
+    yield cfg
+    OWSConfig._instance = None
+
+
+def test_fingerprint(minimal_global_raw_cfg):
+    fp = config_fingerprint(minimal_global_raw_cfg)
+    assert fp == config_fingerprint(minimal_global_raw_cfg)
+    minimal_global_raw_cfg["global"]["title"] = "Another Title"
+    assert fp != config_fingerprint(minimal_global_raw_cfg)
+
+
+def test_snapshot_roundtrip(ready_cfg, minimal_global_raw_cfg, tmp_path):
+    path = str(tmp_path / "cfg.snapshot")
+    write_snapshot(ready_cfg, minimal_global_raw_cfg, path)
+    OWSConfig._instance = None
+    cfg = read_snapshot(path, minimal_global_raw_cfg)
+    assert cfg is not ready_cfg
+    assert cfg is OWSConfig._instance
+    assert cfg.ready
+    assert cfg.frozen
+    assert isinstance(cfg, OWSConfig)
+    assert cfg.title == "Test Title"
+    assert set(cfg.published_CRSs) == set(ready_cfg.published_CRSs)
+
+
+def test_snapshot_mismatch(ready_cfg, minimal_global_raw_cfg, tmp_path):
+    path = str(tmp_path / "cfg.snapshot")
+    write_snapshot(ready_cfg, minimal_global_raw_cfg, path)
+    minimal_global_raw_cfg["global"]["title"] = "Changed Title"
+    with pytest.raises(ConfigException) as e:
+        read_snapshot(path, minimal_global_raw_cfg)
+    assert "does not match" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        read_snapshot(str(tmp_path / "missing.snapshot"), minimal_global_raw_cfg)
+    assert "Could not read" in str(e.value)
+    with patch("datacube_ows.config_snapshot.read_config") as read_cfg:
+        read_cfg.return_value = minimal_global_raw_cfg
+        assert load_snapshot(path) is None
+
+
+def test_snapshot_not_ready(minimal_global_raw_cfg, tmp_path):
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    with pytest.raises(ConfigException):
+        write_snapshot(cfg, minimal_global_raw_cfg, str(tmp_path / "cfg.snapshot"))
+
+
+def test_get_config_from_snapshot(ready_cfg, minimal_global_raw_cfg, tmp_path, monkeypatch):
+    path = str(tmp_path / "cfg.snapshot")
+    write_snapshot(ready_cfg, minimal_global_raw_cfg, path)
+    OWSConfig._instance = None
+    monkeypatch.setenv("DATACUBE_OWS_CFG_SNAPSHOT", path)
+    with patch("datacube_ows.config_snapshot.read_config") as read_cfg, \
+            patch("datacube_ows.config_snapshot.refresh_snapshot_ranges") as refresh:
+        read_cfg.return_value = minimal_global_raw_cfg
+        cfg = get_config()
+        refresh.assert_called_once_with(cfg)
+    assert cfg.ready
+    assert cfg is not ready_cfg
+    assert get_config() is cfg
+
+
+def test_layers_pickle(minimal_global_raw_cfg, minimal_layer_cfg):
+    minimal_layer_cfg["styling"]["styles"].append({
+        "name": "ramp",
+        "title": "Colour Ramp",
+        "abstract": "",
+        "index_function": {
+            "function": "datacube_ows.band_utils.norm_diff",
+            "mapped_bands": True,
+            "kwargs": {"band1": "band1", "band2": "band2"},
+        },
+        "needed_bands": ["band1", "band2"],
+        "color_ramp": [
+            {"value": -1.0, "color": "#000000"},
+            {"value": 1.0, "color": "#FFFFFF"},
+        ],
+        "range": [-1.0, 1.0],
+    })
+    minimal_global_raw_cfg["layers"] = [minimal_layer_cfg]
+    OWSConfig._instance = None
+    cfg = OWSConfig(cfg=minimal_global_raw_cfg)
+    OWSConfig._instance = None
+    cfg2 = pickle.loads(pickle.dumps(cfg))
+    lyr = cfg2.product_index["a_layer"]
+    assert lyr.global_cfg is cfg2
+    assert set(lyr.style_index) == {"band1", "ramp"}
+    OWSConfig._instance = None
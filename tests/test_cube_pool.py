@@ -0,0 +1,186 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from datacube_ows.cube_pool import (CubePool, CubePoolTimeout,
+                                    ODCInitException, cube, get_cube)
+
+
+@pytest.fixture
+def pool_app(request, monkeypatch):
+    monkeypatch.setenv("DATACUBE_OWS_CUBE_POOL_SIZE", "2")
+    monkeypatch.setenv("DATACUBE_OWS_CUBE_POOL_TIMEOUT", "0.2")
+    monkeypatch.setattr(CubePool, "_new_cube", lambda self: MagicMock())
+    app = f"test_{request.node.name}"
+    yield app
+    CubePool._instances.pop(app, None)
+
+
+def test_pool_singleton(pool_app):
+    pool = CubePool(pool_app)
+    assert CubePool(pool_app) is pool
+    assert pool.max_size == 2
+    assert pool.timeout == 0.2
+
+
+def test_checkout_checkin(pool_app):
+    pool = CubePool(pool_app)
+    with cube(pool_app) as dc1:
+        assert pool.stats()["in_use"] == 1
+        # Nested contexts in the same thread share a Datacube
+        with cube(pool_app) as dc2:
+            assert dc2 is dc1
+            assert get_cube(pool_app) is dc1
+        assert pool.stats()["in_use"] == 1
+    assert pool.stats() == {"size": 1, "in_use": 0, "idle": 1, "waiting": 0}
+    # Idle Datacube objects are reused.
+    with cube(pool_app) as dc3:
+        assert dc3 is dc1
+
+
+def test_pool_limit(pool_app):
+    pool = CubePool(pool_app)
+    checked_out = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with cube(pool_app):
+            checked_out.set()
+            release.wait()
+
+    threads = []
+    for i in range(2):
+        checked_out.clear()
+        t = threading.Thread(target=hold)
+        t.start()
+        checked_out.wait()
+        threads.append(t)
+    assert pool.stats()["in_use"] == 2
+    with pytest.raises(CubePoolTimeout):
+        with cube(pool_app):
+            pass
+    # A waiting thread gets the first Datacube returned.
+    result = []
+
+    def wait_for_cube():
+        with cube(pool_app) as dc:
+            result.append(dc)
+
+    waiter = threading.Thread(target=wait_for_cube)
+    pool.timeout = 5
+    waiter.start()
+    release.set()
+    waiter.join()
+    for t in threads:
+        t.join()
+    assert len(result) == 1
+    assert pool.stats() == {"size": 2, "in_use": 0, "idle": 2, "waiting": 0}
+
+
+def test_recycle_and_validate(pool_app):
+    pool = CubePool(pool_app)
+    with cube(pool_app) as dc1:
+        pass
+    pool.recycle = -1
+    with cube(pool_app) as dc2:
+        pass
+    assert dc2 is not dc1
+    dc1.close.assert_called_once()
+    pool.recycle = 3600
+    pool.validate_idle = -1
+    dc2.index._db.give_me_a_connection.side_effect = Exception("Connection lost")
+    with cube(pool_app) as dc3:
+        pass
+    assert dc3 is not dc2
+    dc2.close.assert_called_once()
+    assert pool.stats()["size"] == 1
+
+
+def test_init_failure(pool_app, monkeypatch):
+    def fail(self):
+        raise Exception("No database")
+    monkeypatch.setattr(CubePool, "_new_cube", fail)
+    pool = CubePool(pool_app)
+    with pytest.raises(ODCInitException):
+        with cube(pool_app):
+            pass
+    assert pool.stats()["size"] == 0
+    with pytest.raises(ODCInitException):
+        get_cube(pool_app)
+
+
+def test_get_cube_per_thread(pool_app):
+    dc = get_cube(pool_app)
+    assert get_cube(pool_app) is dc
+    other = []
+    t = threading.Thread(target=lambda: other.append(get_cube(pool_app)))
+    t.start()
+    t.join()
+    assert other[0] is not dc
+    pool = CubePool(pool_app)
+    # Thread cubes are taken from the pool, and the exited thread's cube returned to it.
+    assert pool.stats()["size"] == 2
+    assert threading_result(checkout_and_return, pool_app) is other[0]
+    assert pool.stats() == {"size": 2, "in_use": 1, "idle": 1, "waiting": 0}
+    # cube() contexts in a thread with its own cube use that cube
+    with cube(pool_app) as pooled:
+        assert pooled is dc
+    assert pool.stats()["in_use"] == 1
+
+
+def test_get_cube_pool_limit(pool_app):
+    got_cube = threading.Event()
+    release = threading.Event()
+
+    def hold_cube():
+        get_cube(pool_app)
+        got_cube.set()
+        release.wait()
+    t = threading.Thread(target=hold_cube)
+    t.start()
+    got_cube.wait()
+    get_cube(pool_app)
+    # Pool of two is full until the other thread exits.
+    with pytest.raises(CubePoolTimeout):
+        threading_result(get_cube, pool_app)
+    release.set()
+    t.join()
+    threading_result(get_cube, pool_app)
+
+
+def checkout_and_return(app):
+    with cube(app) as dc:
+        return dc
+
+
+def threading_result(func, *args):
+    result = []
+
+    def run():
+        try:
+            result.append(func(*args))
+        except Exception as e:  # pylint: disable=broad-except
+            result.append(e)
+    t = threading.Thread(target=run)
+    t.start()
+    t.join()
+    if isinstance(result[0], Exception):
+        raise result[0]
+    return result[0]
+
+
+def test_metrics(pool_app, monkeypatch):
+    metrics = {name: MagicMock() for name in ("in_use", "idle", "waiting", "created", "discarded")}
+    monkeypatch.setattr(CubePool, "metrics", metrics)
+    with cube(pool_app):
+        metrics["in_use"].labels.assert_called_with(pool_app)
+        metrics["in_use"].labels().set.assert_called_with(1)
+    metrics["in_use"].labels().set.assert_called_with(0)
+    metrics["idle"].labels().set.assert_called_with(1)
+    metrics["created"].labels().inc.assert_called_once()
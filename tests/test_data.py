@@ -4,6 +4,8 @@
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
 import datetime
+import threading
+import time
 from unittest.mock import MagicMock
 
 import numpy as np
@@ -316,3 +318,254 @@ def test_create_nodata(dummy_raw_calc_data):
     with pytest.raises(WMSException) as e:
         data_out = ds.create_nodata_filled_flag_bands(Dataset(), pbq)
     assert "Cannot add default flag data as there is no non-flag data available" in str(e.value)
+
+
+def test_datasets_for_ids():
+    from collections import OrderedDict
+
+    from datacube.api.query import query_group_by
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.group_by = query_group_by(group_by="time")
+
+    def mk_ds(ds_id, day):
+        ds = MagicMock()
+        ds.id = ds_id
+        ds.center_time = datetime.datetime(2021, 1, day)
+        return ds
+
+    dss = [mk_ds("a", 1), mk_ds("b", 2), mk_ds("c", 1)]
+    index = MagicMock()
+    index.datasets.bulk_get.return_value = dss
+    main_q, flag_q = MagicMock(), MagicMock()
+    result = stacker.datasets_for_ids(index, OrderedDict([(main_q, ["a", "b"]), (flag_q, ["c"])]))
+    index.datasets.bulk_get.assert_called_once()
+    assert list(result.keys()) == [main_q, flag_q]
+    assert len(result[main_q].time) == 2
+    assert len(result[flag_q].time) == 1
+    assert result[flag_q].values[0][0].id == "c"
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_query_loaders(threads):
+    from collections import OrderedDict
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_query_threads = threads
+    stacker.load_query = lambda pbq, datasets, skip_corrections: (pbq, datasets, skip_corrections)
+    with stacker.query_loaders(OrderedDict([("main", "ds1"), ("flag", "ds2")]), True) as loaders:
+        assert [pbq for pbq, loader in loaders] == ["main", "flag"]
+        assert [loader() for pbq, loader in loaders] == [("main", "ds1", True), ("flag", "ds2", True)]
+
+
+def test_query_loaders_concurrent():
+    from collections import OrderedDict
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_query_threads = 4
+    flag_started = threading.Event()
+
+    def load_query(pbq, datasets, skip_corrections):
+        if pbq == "main":
+            # The flag product load starts while the main product is loading
+            assert flag_started.wait(5)
+        else:
+            flag_started.set()
+        return pbq
+    stacker.load_query = load_query
+    with stacker.query_loaders(OrderedDict([("main", "ds1"), ("flag", "ds2")])) as loaders:
+        assert [loader() for pbq, loader in loaders] == ["main", "flag"]
+
+
+def test_query_loaders_no_main_data():
+    from collections import OrderedDict
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_query_threads = 4
+
+    def load_query(pbq, datasets, skip_corrections):
+        if pbq == "flag":
+            raise Exception("Read failed")
+        return pbq
+    stacker.load_query = load_query
+    with stacker.query_loaders(OrderedDict([("main", "ds1"), ("flag", "ds2")])) as loaders:
+        # No main product data, so the flag product result is never used - its failure is ignored.
+        assert loaders[0][1]() == "main"
+
+
+def test_query_loaders_error():
+    from collections import OrderedDict
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_query_threads = 4
+    finished = []
+
+    def load_query(pbq, datasets, skip_corrections):
+        if pbq == "flag1":
+            raise Exception("Read failed")
+        if pbq == "flag2":
+            time.sleep(0.1)
+            finished.append(pbq)
+        result = MagicMock()
+        result.time = [datasets]
+        return result
+    stacker.load_query = load_query
+    with pytest.raises(Exception) as e:
+        with stacker.query_loaders(OrderedDict([("main", "ds1"), ("flag1", "ds2"), ("flag2", "ds3")])) as loaders:
+            for pbq, loader in loaders:
+                loader()
+    assert "Read failed" in str(e.value)
+    # Waited for the other flag product load
+    assert finished == ["flag2"]
+
+
+def test_mosaic_into_matches_combine_first():
+    import xarray as xr
+    coords = {"y": [0, 1], "x": [0, 1, 2]}
+    first = Dataset({
+        "red": xr.DataArray([[1.0, np.nan, 3.0], [np.nan, np.nan, 6.0]], coords=coords, dims=["y", "x"]),
+        "qa": xr.DataArray([[1, 2, 3], [4, 5, 6]], coords=coords, dims=["y", "x"]),
+    })
+    second = Dataset({
+        "red": xr.DataArray([[10.0, 20.0, np.nan], [40.0, np.nan, 60.0]], coords=coords, dims=["y", "x"]),
+        "qa": xr.DataArray([[10, 20, 30], [40, 50, 60]], coords=coords, dims=["y", "x"]),
+    })
+    third = Dataset({
+        "red": xr.DataArray([[100.0, 200.0, 300.0], [400.0, 500.0, 600.0]], coords=coords, dims=["y", "x"]),
+    })
+    expected = first.combine_first(second).combine_first(third)
+    merged = first.copy(deep=True)
+    datacube_ows.data.DataStacker.mosaic_into(merged, second)
+    datacube_ows.data.DataStacker.mosaic_into(merged, third)
+    xr.testing.assert_identical(merged, expected)
+    # Inputs are untouched
+    assert np.isnan(first["red"].values[0, 1])
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_manual_data_stack(threads):
+    import xarray as xr
+    coords = {"time": [np.datetime64("2021-01-01")], "y": [0, 1], "x": [0, 1]}
+
+    def read(ds, measurements, geobox, fuse_func=None):
+        return Dataset({
+            "red": xr.DataArray(np.array(ds).reshape(1, 2, 2), coords=coords, dims=["time", "y", "x"])
+        })
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_manual_merge_threads = threads
+    stacker.style = None
+    stacker._geobox = None
+    stacker._product = MagicMock()
+    stacker._product.extent_mask_func = []
+    stacker._product.solar_correction = False
+    stacker.read_data_for_single_dataset = read
+    times = [np.datetime64("2021-01-01"), np.datetime64("2021-01-02")]
+    datasets = xr.DataArray(
+        np.empty(2, dtype=object), coords={"time": times}, dims=["time"])
+    datasets.values[0] = ([np.nan, 1.0, np.nan, 2.0], [3.0, 4.0, np.nan, 5.0])
+    datasets.values[1] = ([6.0, 7.0, 8.0, 9.0],)
+    result = stacker.manual_data_stack(datasets, {}, ["red"], False, None)
+    assert list(result.time.values) == times
+    assert result["red"].values[0].flatten().tolist()[:2] == [3.0, 1.0]
+    assert np.isnan(result["red"].values[0, 1, 0])
+    assert result["red"].values[1].flatten().tolist() == [6.0, 7.0, 8.0, 9.0]
+
+
+def test_manual_data_stack_bounded():
+    import xarray as xr
+    coords = {"time": [np.datetime64("2021-01-01")], "y": [0], "x": [0]}
+    started = []
+    lock = threading.Lock()
+
+    def read(ds, measurements, geobox, fuse_func=None):
+        with lock:
+            started.append(ds)
+        if ds == 1:
+            raise Exception("Read failed")
+        return Dataset({
+            "red": xr.DataArray(np.array([[[ds]]], dtype="float64"), coords=coords, dims=["time", "y", "x"])
+        })
+    stacker = datacube_ows.data.DataStacker.__new__(datacube_ows.data.DataStacker)
+    stacker.cfg = MagicMock()
+    stacker.cfg.data_load_manual_merge_threads = 3
+    stacker.style = None
+    stacker._geobox = None
+    stacker._product = MagicMock()
+    stacker._product.extent_mask_func = []
+    stacker._product.solar_correction = False
+    stacker.read_data_for_single_dataset = read
+    times = [np.datetime64(f"2021-01-0{i + 1}") for i in range(5)]
+    datasets = xr.DataArray(np.empty(5, dtype=object), coords={"time": times}, dims=["time"])
+    for i in range(5):
+        datasets.values[i] = (float(i),)
+    with pytest.raises(Exception) as e:
+        stacker.manual_data_stack(datasets, {}, ["red"], False, None)
+    assert "Read failed" in str(e.value)
+    # Reads for later time slices were never started
+    assert max(started) <= 2
+
+
+@pytest.mark.parametrize("n_dates", [1, 5, 20])
+def test_build_extent_mask(n_dates):
+    import xarray as xr
+
+    from datacube_ows.ogc_utils import mask_by_val
+    coords = {"time": np.arange(n_dates).astype("datetime64[D]"), "y": [0.0, 1.0], "x": [0.0, 1.0, 2.0]}
+    red = np.arange(n_dates * 6).reshape(n_dates, 2, 3) % 4
+    green = np.arange(n_dates * 6).reshape(n_dates, 2, 3) % 3
+    data = Dataset({
+        "red": xr.DataArray(red, coords=coords, dims=["time", "y", "x"], attrs={"nodata": 0}),
+        "green": xr.DataArray(green, coords=coords, dims=["time", "y", "x"], attrs={"nodata": 0}),
+        "pq": xr.DataArray(np.zeros((n_dates, 2, 3)), coords=coords, dims=["time", "y", "x"], attrs={"nodata": 0}),
+    })
+    style = MagicMock()
+    style.needed_bands = ["red", "green", "pq"]
+    style.flag_bands = {"pq"}
+    layer = MagicMock()
+    layer.data_manual_merge = False
+    layer.extent_mask_func = [mask_by_val]
+    mask = datacube_ows.data.build_extent_mask(data, style, layer)
+    assert mask.dims == ("time", "y", "x")
+    assert (mask.time.values == coords["time"]).all()
+    assert (mask.values == ((red != 0) & (green != 0))).all()
+
+    layer.extent_mask_func = []
+    mask = datacube_ows.data.build_extent_mask(data, style, layer)
+    assert mask.dims == ("time", "y", "x")
+    assert mask.values.all()
+
+    layer.data_manual_merge = True
+    data["red"] = data["red"].where(data["red"] != 0)
+    mask = datacube_ows.data.build_extent_mask(data, style, layer)
+    assert (mask.values == (red != 0)).all()
+
+
+def test_write_empty():
+    from io import BytesIO
+
+    from PIL import Image
+    geobox = datacube_ows.ogc_utils.create_geobox(geometry.CRS("EPSG:4326"), 0, 0, 1, 1, 20, 10)
+    png = datacube_ows.data._write_empty(geobox)
+    assert png is datacube_ows.data._write_empty(geobox)
+    img = np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+    assert img.shape == (10, 20, 4)
+    assert (img == 0).all()
+
+
+def test_write_polygon():
+    from io import BytesIO
+
+    from PIL import Image
+    geobox = datacube_ows.ogc_utils.create_geobox(geometry.CRS("EPSG:4326"), 0, 0, 10, 10, 10, 10)
+    fill = [150, 180, 200, 160]
+    # Fully inside - solid fill
+    poly = geometry.box(-5, -5, 15, 15, crs="EPSG:4326")
+    png = datacube_ows.data._write_polygon(geobox, poly, fill, None)
+    assert png is datacube_ows.data._write_polygon(geobox, poly, fill, None)
+    img = np.asarray(Image.open(BytesIO(png)).convert("RGBA"))
+    assert (img == fill).all()
+    # Partial coverage
+    poly = geometry.box(0, 0, 5, 10, crs="EPSG:4326")
+    img = np.asarray(Image.open(BytesIO(datacube_ows.data._write_polygon(geobox, poly, fill, None))).convert("RGBA"))
+    assert (img[:, :5] == fill).all()
+    assert (img[:, 5:] == 0).all()
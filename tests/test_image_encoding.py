@@ -0,0 +1,99 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+from io import BytesIO
+
+import numpy
+import pytest
+from PIL import Image
+
+from datacube_ows.image_encoding import PNGEncoding, palette_image
+from datacube_ows.ogc_utils import ConfigException
+
+PALETTE = [
+    (0, 0, 0, 0),
+    (255, 0, 0, 255),
+    (0, 255, 0, 255),
+    (0, 0, 255, 128),
+]
+
+
+@pytest.fixture
+def palette_rgba():
+    rng = numpy.random.default_rng(0)
+    rgba = numpy.array(PALETTE, dtype="uint8")[rng.integers(0, len(PALETTE), (64, 48))]
+    # Masked pixels keep their colour but have zero alpha
+    rgba[:4, :, :3] = 255
+    rgba[:4, :, 3] = 0
+    return rgba
+
+
+def decode(png):
+    im = Image.open(BytesIO(png))
+    mode = im.mode
+    return mode, numpy.asarray(im.convert("RGBA"))
+
+
+def test_defaults():
+    enc = PNGEncoding({})
+    assert enc.compression_level == 6
+    assert enc.strategy == "default"
+    assert enc.palette
+
+
+def test_inheritance():
+    glob = PNGEncoding({"compression_level": 1, "strategy": "rle"})
+    layer = PNGEncoding({"palette": False}, glob, "Layer test")
+    assert layer.compression_level == 1
+    assert layer.strategy == "rle"
+    assert not layer.palette
+    layer = PNGEncoding({"compression_level": 9}, glob, "Layer test")
+    assert layer.compression_level == 9
+    assert layer.save_kwargs()["compress_type"] == PNGEncoding.strategies["rle"]
+
+
+def test_config_errors():
+    with pytest.raises(ConfigException) as e:
+        PNGEncoding({"compression_level": 10}, context="Layer foo")
+    assert "between 0 and 9" in str(e.value)
+    assert "Layer foo" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        PNGEncoding({"compression_level": "max"})
+    assert "integer" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        PNGEncoding({"strategy": "lzw"})
+    assert "lzw" in str(e.value)
+
+
+def test_palette_encoding(palette_rgba):
+    enc = PNGEncoding({})
+    png = enc.encode(palette_rgba, PALETTE)
+    mode, decoded = decode(png)
+    assert mode == "P"
+    expected = palette_rgba.copy()
+    expected[palette_rgba[..., 3] == 0] = 0
+    assert (decoded == expected).all()
+    assert len(png) < len(enc.encode(palette_rgba))
+
+
+def test_palette_fallbacks(palette_rgba):
+    # Colours outside the palette
+    assert palette_image(palette_rgba, PALETTE[:2]) is None
+    mode, decoded = decode(PNGEncoding({}).encode(palette_rgba, PALETTE[:2]))
+    assert mode == "RGBA"
+    assert (decoded == palette_rgba).all()
+    # Too many colours
+    big_palette = [(i, j, 0, 255) for i in range(16) for j in range(17)]
+    assert palette_image(palette_rgba, big_palette) is None
+    # Palette output disabled
+    mode, _ = decode(PNGEncoding({"palette": False}).encode(palette_rgba, PALETTE))
+    assert mode == "RGBA"
+
+
+@pytest.mark.parametrize("level,strategy", [(0, "default"), (1, "filtered"), (9, "huffman_only"), (6, "rle")])
+def test_compression_options(palette_rgba, level, strategy):
+    mode, decoded = decode(PNGEncoding({"compression_level": level, "strategy": strategy}).encode(palette_rgba))
+    assert mode == "RGBA"
+    assert (decoded == palette_rgba).all()
@@ -3,7 +3,37 @@
 #
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
-from datacube_ows.mv_index import MVSelectOpts
+import datetime
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import pytz
+from datacube.utils.geometry import box
+
+from datacube_ows.mv_index import (MVSelectOpts, SearchCache, mv_search,
+                                   mv_search_grouped, search_cache)
+
+
+@pytest.fixture(autouse=True)
+def no_search_cache():
+    # Search cache disabled unless a test enables it.
+    search_cache.configure(0, 10000)
+    yield
+    search_cache.configure(0, 10000)
+
+
+@pytest.fixture
+def mock_index():
+    index = MagicMock()
+    conn = index._db._engine.connect.return_value.__enter__.return_value
+    return index, conn
+
+
+def mock_product(prod_id):
+    prod = MagicMock()
+    prod.id = prod_id
+    return prod
 
 
 def test_all():
@@ -38,3 +68,272 @@ def test_count():
     sel = MVSelectOpts.COUNT.sel(stv)
     assert len(sel) == 1
     assert str(sel[0]) == "count(foo)"
+
+
+def test_grouped_search():
+    from unittest.mock import MagicMock
+
+    from datacube_ows.mv_index import mv_search_grouped
+    index = MagicMock()
+    conn = index._db._engine.connect.return_value.__enter__.return_value
+    conn.execute.return_value = [(1, "id3"), (0, "id1"), (1, "id4"), (0, "id2")]
+    prod_a, prod_b = MagicMock(), MagicMock()
+    prod_a.id, prod_b.id = 1, 2
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None), ([prod_b], None)]) == [
+        ["id1", "id2"], ["id3", "id4"], []
+    ]
+    assert conn.execute.call_count == 1
+    assert "UNION ALL" in str(conn.execute.call_args[0][0])
+    assert mv_search_grouped(index, []) == []
+    assert conn.execute.call_count == 1
+
+
+def test_grouped_search_limits(mock_index):
+    index, conn = mock_index
+    search_cache.configure(60, 100)
+    prod_a, prod_b = mock_product(1), mock_product(2)
+    # Limit reached - the unlimited query is skipped
+    conn.execute.return_value = [(0, "id1"), (0, "id2")]
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None)], limits=[2, None]) == [
+        ["id1", "id2"], []
+    ]
+    stmt, params = conn.execute.call_args[0]
+    sql = compiled(stmt)
+    assert "LIMIT" in sql
+    assert "FROM q0) < %(q0_limit)s" in sql
+    assert params["q0_limit"] == 2
+    assert "q1_limit" not in params
+    # Results cut off by their limit or skipped are not cached
+    conn.execute.return_value = [(0, "id1"), (0, "id2"), (0, "id4"), (1, "id3")]
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None)]) == [["id1", "id2", "id4"], ["id3"]]
+    assert conn.execute.call_count == 2
+    assert "LIMIT" not in compiled(conn.execute.call_args[0][0])
+    # Within the limit - all results are cached
+    search_cache.configure(60, 100)
+    conn.execute.return_value = [(0, "id1"), (1, "id3")]
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None)], limits=[2, None]) == [["id1"], ["id3"]]
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None)]) == [["id1"], ["id3"]]
+    assert conn.execute.call_count == 3
+
+
+def test_search_statement_cache():
+    from unittest.mock import MagicMock
+
+    from datacube_ows.mv_index import _search_statement, mv_search
+    index = MagicMock()
+    conn = index._db._engine.connect.return_value.__enter__.return_value
+    conn.execute.return_value = [("id1",), ("id2",)]
+    prod = MagicMock()
+    prod.id = 7
+    t1 = (datetime.datetime(2021, 1, 1, tzinfo=pytz.utc), datetime.datetime(2021, 1, 2, tzinfo=pytz.utc))
+    t2 = (datetime.datetime(2021, 2, 1, tzinfo=pytz.utc), datetime.datetime(2021, 2, 2, tzinfo=pytz.utc))
+    assert mv_search(index, MVSelectOpts.IDS, times=[t1], products=[prod]) == ["id1", "id2"]
+    stmt, params = conn.execute.call_args[0]
+    assert stmt is _search_statement(MVSelectOpts.IDS, 1, False, False, False)
+    assert params["prod_ids"] == [7]
+    assert params["time_0"].lower == t1[0]
+    # Same statement object reused for different parameter values
+    mv_search(index, MVSelectOpts.IDS, times=[t2], products=[prod])
+    stmt2, params2 = conn.execute.call_args[0]
+    assert stmt2 is stmt
+    assert params2["time_0"].lower == t2[0]
+    # Connections are always released
+    assert index._db._engine.connect.return_value.__exit__.call_count == 2
+    # Different shape, different statement
+    mv_search(index, MVSelectOpts.IDS, times=[t1, t2], products=[prod])
+    assert conn.execute.call_args[0][0] is not stmt
+    assert "time_1" in conn.execute.call_args[0][1]
+
+
+def test_streamed_search():
+    from unittest.mock import MagicMock
+
+    import datacube_ows.mv_index
+    from datacube_ows.mv_index import mv_search
+    index = MagicMock()
+    engine_conn = index._db._engine.connect.return_value
+    conn = engine_conn.__enter__.return_value
+    result = conn.execution_options.return_value.execute.return_value
+    batches = [[("id1",), ("id2",)], [("id3",)], []]
+    result.fetchmany.side_effect = batches
+    index.datasets.bulk_get.side_effect = lambda ids: [f"ds_{i}" for i in ids]
+    prod = MagicMock()
+    prod.id = 7
+    streamed = mv_search(index, MVSelectOpts.DATASETS, products=[prod], stream=True)
+    # Nothing happens until the generator is consumed.
+    assert not index._db._engine.connect.called
+    assert list(streamed) == ["ds_id1", "ds_id2", "ds_id3"]
+    assert conn.execution_options.call_args[1]["stream_results"]
+    assert result.fetchmany.call_args[0][0] == datacube_ows.mv_index.STREAM_BATCH_SIZE
+    assert index.datasets.bulk_get.call_count == 2
+    assert engine_conn.__exit__.call_count == 1
+
+
+T1 = (datetime.datetime(2021, 1, 1, tzinfo=pytz.utc), datetime.datetime(2021, 1, 2, tzinfo=pytz.utc))
+
+
+def test_search_cache_key():
+    prod_a, prod_b = mock_product(1), mock_product(2)
+    t_aest = (T1[0].astimezone(pytz.timezone("Australia/Sydney")), T1[1].astimezone(pytz.timezone("Australia/Sydney")))
+    geom = box(130.0, -30.0, 131.0, -29.0, "EPSG:4326")
+    key = SearchCache.key(MVSelectOpts.IDS, [prod_a, prod_b], [T1], geom)
+    # Product order, time zone and sub-precision coordinate noise don't matter
+    nudged = box(130.0 + 1e-12, -30.0, 131.0, -29.0, "EPSG:4326")
+    assert SearchCache.key(MVSelectOpts.IDS, [prod_b, prod_a, prod_a], [t_aest], nudged) == key
+    assert SearchCache.key(MVSelectOpts.COUNT, [prod_a, prod_b], [T1], geom) != key
+    assert SearchCache.key(MVSelectOpts.IDS, [prod_a], [T1], geom) != key
+    assert SearchCache.key(MVSelectOpts.IDS, [prod_a, prod_b], None, geom) != key
+    assert SearchCache.key(MVSelectOpts.IDS, [prod_a, prod_b], [], geom) == \
+           SearchCache.key(MVSelectOpts.IDS, [prod_a, prod_b], None, geom)
+    assert SearchCache.key(MVSelectOpts.IDS, [prod_a, prod_b], [T1], box(130.0, -30.0, 131.0, -29.5, "EPSG:4326")) != key
+
+
+def test_search_cache_hits(mock_index):
+    index, conn = mock_index
+    search_cache.configure(60, 100)
+    conn.execute.return_value = [("id1",), ("id2",)]
+    prod = mock_product(7)
+    assert mv_search(index, MVSelectOpts.IDS, times=[T1], products=[prod]) == ["id1", "id2"]
+    result = mv_search(index, MVSelectOpts.IDS, times=[T1], products=[prod])
+    assert result == ["id1", "id2"]
+    assert conn.execute.call_count == 1
+    # Callers get their own copy of cached id lists.
+    result.append("id3")
+    assert mv_search(index, MVSelectOpts.IDS, times=[T1], products=[prod]) == ["id1", "id2"]
+    conn.execute.return_value = MagicMock()
+    conn.execute.return_value.scalar.return_value = 2
+    assert mv_search(index, MVSelectOpts.COUNT, times=[T1], products=[prod]) == 2
+    assert mv_search(index, MVSelectOpts.COUNT, times=[T1], products=[prod]) == 2
+    assert conn.execute.call_count == 2
+    # Other selection modes and streamed searches are not cached.
+    conn.execute.return_value.fetchall.return_value = []
+    mv_search(index, MVSelectOpts.ALL, times=[T1], products=[prod])
+    mv_search(index, MVSelectOpts.ALL, times=[T1], products=[prod])
+    assert conn.execute.call_count == 4
+
+
+def test_search_cache_disabled(mock_index):
+    index, conn = mock_index
+    conn.execute.return_value = [("id1",)]
+    prod = mock_product(7)
+    mv_search(index, MVSelectOpts.IDS, products=[prod])
+    mv_search(index, MVSelectOpts.IDS, products=[prod])
+    assert conn.execute.call_count == 2
+
+
+def test_search_cache_expiry(monkeypatch):
+    import datacube_ows.mv_index
+    now = [1000.0]
+    monkeypatch.setattr(datacube_ows.mv_index, "monotonic", lambda: now[0])
+    cache = SearchCache(ttl=10, max_entries=2)
+    cache.put("a", 1)
+    now[0] += 5
+    assert cache.get("a") == 1
+    now[0] += 6
+    assert cache.get("a") is None
+
+
+def test_search_cache_lru():
+    cache = SearchCache(ttl=60, max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_search_cache_invalidate():
+    prod_a, prod_b = mock_product(1), mock_product(2)
+    cache = SearchCache(ttl=60)
+    key_a = SearchCache.key(MVSelectOpts.IDS, [prod_a], None, None)
+    key_ab = SearchCache.key(MVSelectOpts.COUNT, [prod_a, prod_b], None, None)
+    key_b = SearchCache.key(MVSelectOpts.IDS, [prod_b], None, None)
+    for key in (key_a, key_ab, key_b):
+        cache.put(key, 1)
+    cache.invalidate([2])
+    assert cache.get(key_a) == 1
+    assert cache.get(key_ab) is None
+    assert cache.get(key_b) is None
+    cache.invalidate()
+    assert cache.get(key_a) is None
+
+
+def test_grouped_search_cache(mock_index):
+    index, conn = mock_index
+    search_cache.configure(60, 100)
+    prod_a, prod_b = mock_product(1), mock_product(2)
+    conn.execute.return_value = [(0, "id1")]
+    assert mv_search_grouped(index, [([prod_a], None)]) == [["id1"]]
+    # Only the uncached query is sent to the database
+    conn.execute.return_value = [(0, "id2")]
+    assert mv_search_grouped(index, [([prod_a], None), ([prod_b], None)]) == [["id1"], ["id2"]]
+    assert conn.execute.call_count == 2
+    assert list(conn.execute.call_args[0][1]["q0_prod_ids"]) == [2]
+    assert "q1_prod_ids" not in conn.execute.call_args[0][1]
+    # Shared with ungrouped id searches
+    assert mv_search(index, MVSelectOpts.IDS, products=[prod_b]) == ["id2"]
+    assert mv_search_grouped(index, [([prod_b], None), ([prod_a], None)]) == [["id2"], ["id1"]]
+    assert conn.execute.call_count == 2
+
+
+def compiled(stmt):
+    from sqlalchemy.dialects import postgresql
+    return str(stmt.compile(dialect=postgresql.dialect()))
+
+
+def test_geom_filter(mock_index):
+    index, conn = mock_index
+    conn.execute.return_value = [("id1",)]
+    geom = box(130.0, -30.0, 131.0, -29.0, "EPSG:4326")
+    mv_search(index, MVSelectOpts.IDS, geom=geom, products=[mock_product(7)])
+    stmt, params = conn.execute.call_args[0]
+    sql = compiled(stmt)
+    # Index-friendly envelope test ahead of the exact intersection
+    assert sql.index("&& ST_MakeEnvelope") < sql.index("ST_Intersects")
+    # Extents with SRID 0 (from views created by older versions) compared as EPSG:4326
+    assert "ST_Intersects(ST_SetSRID(space_time_view.spatial_extent, 4326), ST_SetSRID(" in sql
+    assert (params["bbox_left"], params["bbox_bottom"], params["bbox_right"], params["bbox_top"]) == \
+           (130.0, -30.0, 131.0, -29.0)
+
+
+def test_extent_search(mock_index):
+    index, conn = mock_index
+    geom = box(14471533.8, -3503549.8, 14582853.0, -3375646.0, "EPSG:3857")
+    conn.execute.return_value.scalar.return_value = json.dumps(
+        box(14500000.0, -3500000.0, 14550000.0, -3400000.0, "EPSG:3857").json
+    )
+    extent = mv_search(index, MVSelectOpts.EXTENT, geom=geom, products=[mock_product(7)], simplify=50.0)
+    stmt, params = conn.execute.call_args[0]
+    sql = compiled(stmt)
+    # Clipped, reprojected and simplified in the database
+    assert "ST_CollectionExtract(ST_Intersection(ST_Union(" in sql
+    assert "ST_Transform(" in sql
+    assert "ST_SimplifyPreserveTopology(" in sql
+    assert params["srid"] == 3857
+    assert params["tolerance"] == 50.0
+    assert extent.crs == "EPSG:3857"
+    assert extent.boundingbox.left == 14500000.0
+    # No intersection
+    conn.execute.return_value.scalar.return_value = json.dumps({"type": "MultiPolygon", "coordinates": []})
+    assert mv_search(index, MVSelectOpts.EXTENT, geom=geom, products=[mock_product(7)]) is None
+    assert "ST_SimplifyPreserveTopology(" not in compiled(conn.execute.call_args[0][0])
+    # Nothing found
+    conn.execute.return_value.scalar.return_value = None
+    assert mv_search(index, MVSelectOpts.EXTENT, geom=geom, products=[mock_product(7)]) is None
+
+
+def test_extent_search_no_epsg(mock_index):
+    from datacube.utils.geometry import CRS
+    index, conn = mock_index
+    crs = CRS("+proj=aea +lat_0=0 +lon_0=132 +lat_1=-18 +lat_2=-36 +datum=WGS84 +units=m +no_defs")
+    geom = box(130.0, -30.0, 131.0, -29.0, "EPSG:4326").to_crs(crs)
+    conn.execute.return_value.scalar.return_value = json.dumps(box(130.2, -29.8, 130.8, -29.2, "EPSG:4326").json)
+    extent = mv_search(index, MVSelectOpts.EXTENT, geom=geom, products=[mock_product(7)], simplify=50.0)
+    stmt, params = conn.execute.call_args[0]
+    assert "ST_Transform(" not in compiled(stmt)
+    assert "srid" not in params
+    assert extent.crs == crs
+    assert extent.contains(box(130.3, -29.7, 130.7, -29.3, "EPSG:4326").to_crs(crs))
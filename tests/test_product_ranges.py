@@ -0,0 +1,86 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import datetime
+from unittest.mock import MagicMock, patch
+
+from datacube_ows.product_ranges import (PreloadedRanges, get_ranges,
+                                         parse_range_dates)
+
+
+def range_row(dates, **kwargs):
+    row = {
+        "lat_min": -10, "lat_max": -9,
+        "lon_min": 130, "lon_max": 131,
+        "dates": dates,
+        "bboxes": {"EPSG:4326": {"top": -9, "bottom": -10, "left": 130, "right": 131}},
+    }
+    row.update(kwargs)
+    return row
+
+
+def test_parse_range_dates():
+    parsed = parse_range_dates([
+        ["2021-01-01", None, "2021-02-28"],
+        [],
+        ["2020-02-29"],
+    ])
+    assert parsed == [
+        [datetime.date(2021, 1, 1), datetime.date(2021, 2, 28)],
+        [],
+        [datetime.date(2020, 2, 29)],
+    ]
+    assert all(isinstance(d, datetime.date) for d in parsed[0])
+    assert parse_range_dates([]) == []
+
+
+def test_preloaded_ranges():
+    cfg = MagicMock()
+    cfg.alias_bboxes.side_effect = lambda bboxes: bboxes
+    conn = MagicMock()
+    conn.execute.side_effect = [
+        [range_row(["2021-01-01", "2021-01-02"], id=1), range_row([], id=2)],
+        [range_row(["2021-03-01"], wms_product_name="multi")],
+    ]
+    with patch("datacube_ows.product_ranges.get_sqlconn") as get_conn:
+        get_conn.return_value = conn
+        preloaded = PreloadedRanges(MagicMock(), cfg)
+    conn.close.assert_called_once()
+
+    layer = MagicMock()
+    layer.multi_product = False
+    layer.product.id = 1
+    layer.global_cfg.preloaded_ranges = preloaded
+    rng = get_ranges(None, layer)
+    assert rng["times"] == [datetime.date(2021, 1, 1), datetime.date(2021, 1, 2)]
+    assert rng["start_time"] == datetime.date(2021, 1, 1)
+    assert rng["end_time"] == datetime.date(2021, 1, 2)
+    assert rng["lat"] == {"min": -10.0, "max": -9.0}
+    # No dates
+    layer.product.id = 2
+    assert get_ranges(None, layer) is None
+    # Not in table
+    layer.product.id = 3
+    assert get_ranges(None, layer) is None
+    layer.multi_product = True
+    layer.name = "multi"
+    assert get_ranges(None, layer)["times"] == [datetime.date(2021, 3, 1)]
+
+
+def test_preloaded_ranges_for_layers():
+    cfg = MagicMock()
+    cfg.alias_bboxes.side_effect = lambda bboxes: bboxes
+    conn = MagicMock()
+    conn.execute.return_value = [range_row(["2021-01-01"], id=7)]
+    layer = MagicMock()
+    layer.multi_product = False
+    layer.product.id = 7
+    with patch("datacube_ows.product_ranges.get_sqlconn") as get_conn:
+        get_conn.return_value = conn
+        preloaded = PreloadedRanges(MagicMock(), cfg, [layer])
+    conn.execute.assert_called_once()
+    # All the product ids bound as one array parameter
+    assert conn.execute.call_args[0][1] == {"ids": [7]}
+    assert preloaded.get(layer)["times"] == [datetime.date(2021, 1, 1)]
@@ -0,0 +1,119 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import datetime
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from datacube_ows.ows_configuration import parse_ows_layer
+from datacube_ows.range_refresher import RangeRefresher, range_refresher
+
+
+@pytest.fixture
+def dynamic_layer(minimal_layer_cfg, minimal_global_cfg, minimal_dc, mock_range):
+    minimal_layer_cfg["dynamic"] = True
+    minimal_global_cfg.range_refresh_interval = 0
+    lyr = parse_ows_layer(minimal_layer_cfg, global_cfg=minimal_global_cfg)
+    with patch("datacube_ows.product_ranges.get_ranges") as get_rng:
+        get_rng.return_value = mock_range
+        lyr.make_ready(minimal_dc)
+    return lyr
+
+
+def test_ranges_without_refresher(dynamic_layer, mock_range):
+    with patch("datacube_ows.product_ranges.get_ranges") as get_rng, \
+            patch("datacube_ows.ows_configuration.cube") as cube:
+        get_rng.return_value = mock_range
+        assert dynamic_layer.ranges == mock_range
+        assert dynamic_layer.ranges == mock_range
+        assert get_rng.call_count == 2
+        # A Datacube object is only checked out of the pool for each update.
+        assert cube.call_count == 2
+        assert cube.return_value.__exit__.call_count == 2
+
+
+def test_ranges_with_refresher(dynamic_layer, mock_range):
+    dynamic_layer.global_cfg.range_refresh_interval = 30
+    with patch("datacube_ows.product_ranges.get_ranges") as get_rng, \
+            patch.object(range_refresher, "ensure_running") as running:
+        running.return_value = True
+        assert dynamic_layer.ranges == mock_range
+        get_rng.assert_not_called()
+        running.assert_called_with(dynamic_layer.global_cfg)
+
+
+def test_refresh_swaps_ranges(dynamic_layer, mock_range):
+    times = mock_range["times"] + [datetime.date(2010, 1, 4)]
+    new_range = dict(mock_range, times=times, end_time=times[-1], time_set=set(times))
+    preloaded = MagicMock()
+    preloaded.get.return_value = new_range
+    cfg = dynamic_layer.global_cfg
+    cfg.product_index = {dynamic_layer.name: dynamic_layer}
+    with patch("datacube_ows.product_ranges.PreloadedRanges") as pr:
+        pr.return_value = preloaded
+        RangeRefresher().refresh(cfg, MagicMock())
+        pr.assert_called_once()
+        assert pr.call_args[0][2] == [dynamic_layer]
+    assert dynamic_layer._ranges is new_range
+    assert dynamic_layer.default_time == datetime.date(2010, 1, 4)
+    assert not dynamic_layer.hide
+    # No ranges - layer is hidden
+    preloaded.get.return_value = None
+    with patch("datacube_ows.product_ranges.PreloadedRanges") as pr:
+        pr.return_value = preloaded
+        RangeRefresher().refresh(cfg, MagicMock())
+    assert dynamic_layer._ranges is None
+    assert dynamic_layer.hide
+    assert dynamic_layer.bboxes == {}
+
+
+def test_refresher_thread():
+    cfg = MagicMock()
+    cfg.range_refresh_interval = 0
+    refresher = RangeRefresher()
+    assert not refresher.ensure_running(cfg)
+    assert not refresher.running()
+
+    cfg.range_refresh_interval = 0.01
+    cfg.range_refresh_listen = False
+    refreshed = threading.Event()
+    with patch.object(RangeRefresher, "refresh") as refresh, \
+            patch("datacube_ows.range_refresher.cube") as cube:
+        refresh.side_effect = lambda cfg, dc: refreshed.set()
+        assert refresher.ensure_running(cfg)
+        assert refresher.running()
+        thread = refresher._thread
+        assert refresher.ensure_running(cfg)
+        assert refresher._thread is thread
+        assert refreshed.wait(5)
+        refresher.stop()
+        # The Datacube object is returned to the pool after each refresh.
+        assert cube.return_value.__exit__.call_count == cube.call_count
+    assert not refresher.running()
+
+
+def test_notification_invalidates_search_cache():
+    cfg = MagicMock()
+    cfg.range_refresh_interval = 0.01
+    cfg.range_refresh_listen = True
+    refresher = RangeRefresher()
+    listener = MagicMock()
+    listener.notifies = [MagicMock()]
+    refreshed = threading.Event()
+    with patch.object(RangeRefresher, "refresh") as refresh, \
+            patch.object(RangeRefresher, "_listen") as listen, \
+            patch("datacube_ows.range_refresher.select.select") as sel, \
+            patch("datacube_ows.range_refresher.cube"), \
+            patch("datacube_ows.range_refresher.search_cache") as cache:
+        listen.return_value = listener
+        sel.return_value = ([listener], [], [])
+        refresh.side_effect = lambda cfg, dc: refreshed.set()
+        assert refresher.ensure_running(cfg)
+        assert refreshed.wait(5)
+        refresher.stop()
+        cache.invalidate.assert_called_with()
+    assert not listener.notifies
@@ -5,6 +5,8 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import subprocess
+import sys
 from unittest.mock import MagicMock, patch
 
 import flask
@@ -159,3 +161,12 @@ def test_init_babel_off(babel_cfg, flask_app):
     bab = initialise_babel(babel_cfg, flask_app)
     assert bab is None
 
+
+def test_heavy_imports_deferred():
+    # Matplotlib and Sentry are only imported when first needed
+    code = ("import sys, datacube_ows.wms, datacube_ows.startup_utils; "
+            "print(','.join(m for m in ('matplotlib', 'sentry_sdk') if m in sys.modules))")
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=src_dir, env=dict(os.environ, PYTHONPATH=src_dir))
+    assert result.stdout.strip() == ""
@@ -5,6 +5,7 @@
 # SPDX-License-Identifier: Apache-2.0
 from decimal import Decimal
 
+import numpy
 import pytest
 
 from datacube_ows.ogc_utils import ConfigException
@@ -199,6 +200,35 @@ def test_ramp_expr_style(dummy_raw_calc_data, raw_calc_null_mask, simple_ramp_st
     assert result["red"].values[5] < 255
 
 
+@pytest.mark.parametrize("ramp_cfg", [
+    None,
+    {"range": [-0.1, 0.85]},
+    {"range": [0.0, 3000.0], "mpl_ramp": "viridis"},
+])
+def test_ramp_lut(simple_ramp_style_cfg, ramp_cfg):
+    if ramp_cfg is not None:
+        del simple_ramp_style_cfg["color_ramp"]
+        simple_ramp_style_cfg.update(ramp_cfg)
+    ramp = StandaloneStyle(simple_ramp_style_cfg).color_ramp
+    assert ramp.lut is not None
+    lo, hi = ramp.values[0], ramp.values[-1]
+    span = hi - lo
+    data = numpy.concatenate([
+        numpy.random.default_rng(42).uniform(lo - span * 0.1, hi + span * 0.1, 10000),
+        numpy.array(ramp.values),
+        numpy.array([lo - span, hi + span, numpy.nan]),
+    ])
+    lut_rgba = ramp.get_8bit_values(data)
+    for i, band in enumerate(("red", "green", "blue", "alpha")):
+        with numpy.errstate(invalid="ignore"):
+            interp = ramp.get_8bit_value(data[:-1], band)
+        assert numpy.abs(lut_rgba[:-1, i].astype("int") - interp).max() <= 1
+        # Breakpoints and clamped values are exact
+        assert (lut_rgba[10000:-1, i] == interp[10000:]).all()
+    # NaN is transparent
+    assert (lut_rgba[-1] == 0).all()
+
+
 def test_ramp_legend_standalone(simple_ramp_style_cfg):
     style = StandaloneStyle(simple_ramp_style_cfg)
     img = generate_ows_legend_style(style, 1)
@@ -625,6 +655,17 @@ def test_colormap_style(dummy_col_map_data, raw_calc_null_mask, simple_colormap_
     # point 5 fall through -transparent
     assert result["alpha"].values[5] == 0
 
+def test_colormap_palette(dummy_col_map_data, raw_calc_null_mask, simple_colormap_style_cfg):
+    style = StandaloneStyle(simple_colormap_style_cfg)
+    palette = style.image_palette()
+    assert palette[0] == (0, 0, 0, 0)
+    assert len(palette) == len(set(palette))
+    result = apply_ows_style(style, dummy_col_map_data, valid_data_mask=raw_calc_null_mask)
+    rgba = numpy.stack([result[c].values.ravel() for c in ("red", "green", "blue", "alpha")], axis=-1)
+    for colour in rgba:
+        assert tuple(colour) in palette or colour[3] == 0
+
+
 def test_colormap_multidate(dummy_col_map_time_data, timed_raw_calc_null_mask, simple_colormap_style_cfg):
     result = apply_ows_style_cfg(
                         simple_colormap_style_cfg,
@@ -4,6 +4,7 @@
 # Copyright (c) 2017-2021 OWS Contributors
 # SPDX-License-Identifier: Apache-2.0
 import datetime
+import io
 from unittest.mock import MagicMock, patch
 
 import numpy as np
@@ -874,3 +875,82 @@ def test_styles_with_invalid_pq_masks(product_layer, style_with_pq_masking):
     with pytest.raises(ConfigException) as e:
         style_def = datacube_ows.styles.StyleDef(product_layer, style_with_pq_masking)
     assert "contains a mask, but the layer has no flag bands" in str(e.value)
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "int16", "int32", "float64"])
+def test_value_map_lut_matches_rules(dtype):
+    from datacube_ows.styles.colormap import (ValueMapLUT, ValueMapRule,
+                                              apply_value_map)
+    style = MagicMock()
+    flags_def = {
+        "water": {"bits": 0, "values": {"0": False, "1": True}},
+        "cloud": {"bits": 1, "values": {"0": False, "1": True}},
+        "shadow": {"bits": 2, "values": {"0": False, "1": True}},
+    }
+    value_map = {
+        "pq": [
+            ValueMapRule(style, "pq", {"title": "Cloud", "flags": {"cloud": True}, "color": "#FFFFFF"}),
+            ValueMapRule(style, "pq", {"title": "Wet", "flags": {"or": {"water": True, "shadow": True}},
+                                       "color": "#0000FF", "alpha": 0.5}),
+            ValueMapRule(style, "pq", {"title": "Masked", "flags": {"water": False}, "color": "#FF0000",
+                                       "mask": True}),
+        ],
+        "cls": [
+            ValueMapRule(style, "cls", {"title": "Forest", "values": [10, 11], "color": "#00FF00"}),
+            ValueMapRule(style, "cls", {"title": "Not urban", "values": [20], "invert": True,
+                                        "color": "#123456"}),
+        ],
+    }
+    rng = np.random.default_rng(0)
+    coords = {"y": np.arange(8), "x": np.arange(9)}
+    pq = DataArray(rng.integers(0, 8, (8, 9)).astype(dtype), coords=coords, dims=["y", "x"],
+                   attrs={"flags_definition": flags_def})
+    cls = DataArray(rng.integers(0, 30, (8, 9)).astype(dtype), coords=coords, dims=["y", "x"])
+    data = Dataset({"pq": pq, "cls": cls})
+    luts = {}
+    expected = apply_value_map(value_map, data, lambda b: b)
+    result = apply_value_map(value_map, data, lambda b: b, luts)
+    for channel in ("red", "green", "blue", "alpha"):
+        assert (result[channel].values == expected[channel].values).all()
+        assert result[channel].dtype == np.dtype("uint8")
+    assert luts
+    assert all(isinstance(lut, ValueMapLUT) for lut in luts.values())
+
+
+def test_value_map_lut_fallback():
+    from datacube_ows.styles.colormap import ValueMapRule, lut_value_map
+    style = MagicMock()
+    value_map = {
+        "cls": [ValueMapRule(style, "cls", {"title": "Big", "values": [100000], "color": "#00FF00"})],
+    }
+    data = Dataset({"cls": DataArray(np.array([[100000, 3]], dtype="int32"), dims=["y", "x"])})
+    assert lut_value_map(value_map, data, lambda b: b, {}) is None
+
+
+def test_compile_value_map_luts(product_layer_mask_map, style_cfg_map_mask):
+    import pandas as pd
+    style_def = datacube_ows.styles.StyleDef(product_layer_mask_map, style_cfg_map_mask)
+    band_idx = MagicMock()
+    band_idx.dtype_val.return_value = np.dtype("uint8")
+    band_idx.band.return_value = "foo"
+    band_idx.native_bands = pd.DataFrame(
+        {"flags_definition": [{"bar": {"bits": [0, 1], "values": {"1": 1, "2": 2}}}]},
+        index=["foo"])
+    style_def.product = MagicMock()
+    style_def.product.band_idx = band_idx
+    style_def.compile_value_map_luts()
+    lut = style_def.value_map_luts[("foo", "|u1")]
+    rgba, matched = lut.lookup(np.array([1, 2, 3], dtype="uint8"))
+    assert matched.tolist() == [True, True, False]
+    assert rgba[0].tolist() == [17, 17, 17, 0]
+    assert rgba[1].tolist() == [255, 255, 255, 255]
+
+
+def test_render_legends(product_layer, style_cfg_ramp, style_cfg_map):
+    # Matplotlib is imported on first use.
+    style_cfg_ramp["legend"] = {"begin": "0.0", "end": "1.0"}
+    for cfg in (style_cfg_ramp, style_cfg_map):
+        style_def = datacube_ows.styles.StyleDef(product_layer, cfg)
+        bytesio = io.BytesIO()
+        style_def.legend_cfg.render(bytesio)
+        assert bytesio.getvalue().startswith(b"\x89PNG")
@@ -0,0 +1,156 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+import datetime
+import os
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from datacube_ows.ogc_utils import ConfigException
+from datacube_ows.tile_cache import (FilesystemTileCache, SQLiteTileCache,
+                                     TileCache)
+from datacube_ows.wmts import tile_cache_key
+
+
+@pytest.fixture(params=["filesystem", "sqlite"])
+def tile_cache(request, tmp_path):
+    if request.param == "filesystem":
+        path = str(tmp_path / "tiles")
+    else:
+        path = str(tmp_path / "tiles.sqlite")
+    return TileCache.from_config({
+        "backend": request.param,
+        "path": path,
+        "max_entries": 10,
+    })
+
+
+def key(layer="layer", row=0, time_="2021-01-01"):
+    return TileCache.tile_key(layer, "style", "WholeWorld_WebMercator", 3, row, 4, time_, "image/png")
+
+
+def test_no_cache():
+    assert TileCache.from_config(None) is None
+    assert TileCache.from_config({}) is None
+
+
+def test_backend_selection(tmp_path):
+    assert isinstance(TileCache.from_config({"path": str(tmp_path)}), FilesystemTileCache)
+    assert isinstance(TileCache.from_config({"path": str(tmp_path / "t.db"), "backend": "sqlite"}), SQLiteTileCache)
+
+
+def test_bad_config(tmp_path):
+    with pytest.raises(ConfigException) as e:
+        TileCache.from_config({"backend": "memcached", "path": str(tmp_path)})
+    assert "memcached" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        TileCache.from_config({"backend": "filesystem"})
+    assert "path" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        TileCache.from_config({"path": str(tmp_path), "max_size_mb": "lots"})
+    assert "numeric" in str(e.value)
+    with pytest.raises(ConfigException) as e:
+        TileCache.from_config({"path": str(tmp_path), "max_entries": 0})
+    assert "positive" in str(e.value)
+
+
+def test_roundtrip(tile_cache):
+    assert tile_cache.fetch(key()) is None
+    tile_cache.put(key(), b"PNGDATA", {"Content-Type": "image/png", "Cache-Control": "max-age=300"})
+    body, headers = tile_cache.fetch(key())
+    assert body == b"PNGDATA"
+    assert headers["Content-Type"] == "image/png"
+    assert headers["Cache-Control"] == "max-age=300"
+    assert tile_cache.fetch(key(time_="2021-01-02")) is None
+
+
+def test_invalidate_layer(tile_cache):
+    tile_cache.put(key("layer1"), b"one", {})
+    tile_cache.put(key("layer2"), b"two", {})
+    tile_cache.invalidate_layers(["layer1"])
+    assert tile_cache.fetch(key("layer1")) is None
+    assert tile_cache.fetch(key("layer2"))[0] == b"two"
+
+
+def test_lru_eviction(tile_cache):
+    # No background eviction while filling the cache
+    tile_cache.max_entries = 100
+    for row in range(12):
+        tile_cache.put(key(row=row), b"x", {})
+    tile_cache.max_entries = 10
+    # Make tile 0 the most recently used.
+    if isinstance(tile_cache, FilesystemTileCache):
+        now = time.time()
+        for row in range(12):
+            os.utime(tile_cache._tile_path(key(row=row)), (now - 100 + row, now - 100 + row))
+        os.utime(tile_cache._tile_path(key(row=0)))
+    else:
+        tile_cache.touch_resolution = -1
+        tile_cache._conn().execute("UPDATE tiles SET accessed = accessed - 100")
+        tile_cache.fetch(key(row=0))
+    tile_cache.evict()
+    cached = [row for row in range(12) if tile_cache.fetch(key(row=row)) is not None]
+    assert len(cached) == 9
+    assert 0 in cached
+    assert 1 not in cached
+    assert 2 not in cached
+
+
+def test_background_eviction(tile_cache):
+    evicting = threading.Event()
+    release = threading.Event()
+    evict = tile_cache._evict
+
+    def slow_evict():
+        evicting.set()
+        release.wait()
+        return evict()
+    tile_cache._evict = slow_evict
+    for row in range(10):
+        tile_cache.put(key(row=row), b"x", {})
+    assert not evicting.is_set()
+    # Over the size limits - eviction starts in the background and does not block writes.
+    tile_cache.put(key(row=10), b"x", {})
+    assert evicting.wait(5)
+    tile_cache.put(key(row=11), b"x", {})
+    release.set()
+    tile_cache._eviction_thread.join(5)
+    assert sum(1 for row in range(12) if tile_cache.fetch(key(row=row)) is not None) <= 10
+    assert tile_cache._count <= 10
+
+
+def test_abstract_backend():
+    with pytest.raises(TypeError):
+        TileCache({"path": "/tmp"})
+
+
+def test_tile_cache_key_defaults():
+    cfg = MagicMock()
+    cfg.tile_cache = TileCache
+    layer = MagicMock()
+    layer.name = "layer"
+    layer.default_style.name = "style"
+    layer.default_time = datetime.date(2021, 1, 1)
+    cfg.product_index = {"layer": layer}
+    args = {
+        "layer": "layer",
+        "tilematrixset": "WholeWorld_WebMercator",
+        "tilematrix": "3",
+        "tilerow": "0",
+        "tilecol": "4",
+        "format": "image/png",
+    }
+    assert tile_cache_key(args, cfg) == key()
+    args["style"] = "style"
+    args["time"] = "2021-01-01"
+    assert tile_cache_key(args, cfg) == key()
+    args["ows_stats"] = "yes"
+    assert tile_cache_key(args, cfg) is None
+    args = dict(args, layer="nosuchlayer")
+    del args["ows_stats"]
+    assert tile_cache_key(args, cfg) is None
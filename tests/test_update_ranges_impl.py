@@ -0,0 +1,35 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+from unittest.mock import MagicMock, patch
+
+import pkg_resources
+
+from datacube_ows.update_ranges_impl import refresh_views, run_sql
+
+
+def test_run_sql_transaction_per_file():
+    conn = MagicMock()
+    with patch("datacube_ows.update_ranges_impl.get_sqlconn") as get_conn:
+        get_conn.return_value = conn
+        run_sql(MagicMock(), "extent_views/incremental_update")
+    n_files = len([f for f in pkg_resources.resource_listdir("datacube_ows", "sql/extent_views/incremental_update")
+                   if f.endswith(".sql")])
+    assert n_files
+    # Each file committed in its own transaction
+    assert conn.begin.call_count == n_files
+    assert conn.begin.return_value.__exit__.call_count == n_files
+    conn.close.assert_called_once()
+
+
+def test_refresh_views_notifies():
+    with patch("datacube_ows.update_ranges_impl.views_are_incremental") as incremental, \
+            patch("datacube_ows.update_ranges_impl.run_sql") as run, \
+            patch("datacube_ows.update_ranges_impl.get_sqlconn"), \
+            patch("datacube_ows.update_ranges_impl.notify_ranges_updated") as notify:
+        incremental.return_value = False
+        refresh_views(MagicMock())
+        run.assert_called_once()
+        notify.assert_called_once()
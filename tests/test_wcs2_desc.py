@@ -0,0 +1,51 @@
+# This file is part of datacube-ows, part of the Open Data Cube project.
+# See https://opendatacube.org for more information.
+#
+# Copyright (c) 2017-2021 OWS Contributors
+# SPDX-License-Identifier: Apache-2.0
+from unittest.mock import patch
+
+import pytest
+from lxml import etree
+from ows.gml import Grid, RegularAxis
+from ows.swe import Field
+from ows.wcs import CoverageDescription
+
+from datacube_ows.wcs2 import (DESCRIPTION_ENCODERS,
+                               coverage_description_fragment,
+                               coverage_descriptions_tags)
+
+
+def coverage_description(cfg, name):
+    return CoverageDescription(
+        identifier=name,
+        title=name.upper(),
+        abstract=None,
+        range_type=[Field(name="red", description="red", uom="red", nil_values={-1: "invalid"})],
+        grid=Grid(
+            axes=[
+                RegularAxis(label="x", index_label="i", lower_bound=0, upper_bound=10,
+                            resolution=1, uom="m", size=10),
+                RegularAxis(label="y", index_label="j", lower_bound=0, upper_bound=10,
+                            resolution=1, uom="m", size=10),
+            ],
+            srs="EPSG:3857"
+        ),
+        native_format="image/geotiff",
+        coverage_subtype="RectifiedGridCoverage",
+    )
+
+
+def canonical(xml):
+    return etree.tostring(etree.fromstring(xml), method="c14n")
+
+
+@pytest.mark.parametrize("version", list(DESCRIPTION_ENCODERS.keys()))
+def test_concatenated_descriptions(version):
+    with patch("datacube_ows.wcs2.create_coverage_description", side_effect=coverage_description):
+        open_tag, close_tag = coverage_descriptions_tags(version)
+        fragments = [coverage_description_fragment(None, name, version) for name in ("lyr1", "lyr2")]
+    expected = DESCRIPTION_ENCODERS[version].xml_encode_coverage_descriptions(
+        [coverage_description(None, "lyr1"), coverage_description(None, "lyr2")]
+    ).value
+    assert canonical(b"".join([open_tag, *fragments, close_tag])) == canonical(expected)